@@ -0,0 +1,109 @@
+"""
+    Benchmark of the latency of the job information lookup
+    behind GET /job_info/<job_id>.
+
+    Compares:
+    -) two_queries: the former lookup, with one query on table request
+       and one on table request_parameter;
+    -) single_query: db_utils.get_job_info(), returning also the
+       parameters with one query.
+    Both run on a pooled connection: the connections were opened
+    for each query before, but their cost is not measured here.
+
+    The DB configured in va_simple_provider/database.ini is used:
+    the test requests (service 'benchmark') are removed at the end.
+
+    Usage:
+      python benchmarks/bench_job_info.py [--jobs N] [--parameters M] [--repeat R]
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+import statistics
+
+import psycopg2.extras
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from va_simple_provider import db_utils
+
+SERVICE = 'benchmark'
+
+def two_queries(request_id):
+  """
+  The lookup as it was done before the single query: one query
+  on table request, one on table request_parameter, here on the same
+  pooled connection, so that only the change of the queries is measured.
+  """
+  with db_utils.get_db_connection() as conn:
+    with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+      cur.execute(
+        """SELECT service, received, start_processing,
+                  end_processing, time_to_clean,
+                  exit_code, std_out, std_err
+           FROM request
+           WHERE id = %s""", (request_id, ))
+      cur.fetchone()
+      cur.execute(
+        """SELECT name, value
+           FROM request_parameter
+           WHERE request_id = %s""", (request_id, ))
+      cur.fetchall()
+
+def single_query(request_id):
+  with db_utils.get_db_connection() as conn:
+    db_utils.get_job_info(conn, request_id)
+
+def measure(function, request_ids, repeat):
+  """
+  Returns the latencies, in milliseconds, of function(request_id).
+  """
+  latencies = []
+  for _ in range(repeat):
+    for request_id in request_ids:
+      start = time.perf_counter()
+      function(request_id)
+      latencies.append((time.perf_counter() - start) * 1000)
+  return latencies
+
+def report(name, latencies):
+  latencies = sorted(latencies)
+  print("{0:<14} n={1:<6} mean={2:8.3f} ms  p50={3:8.3f} ms  "
+        "p95={4:8.3f} ms  p99={5:8.3f} ms".format(
+          name, len(latencies), statistics.mean(latencies),
+          latencies[len(latencies) // 2],
+          latencies[int(len(latencies) * 0.95)],
+          latencies[int(len(latencies) * 0.99)]))
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('--jobs', type=int, default=50)
+  parser.add_argument('--parameters', type=int, default=20)
+  parser.add_argument('--repeat', type=int, default=10)
+  args = parser.parse_args()
+
+  request_ids = [
+    'benchmark-' + str(uuid.uuid4()) for _ in range(args.jobs)
+  ]
+  with db_utils.get_db_connection() as conn:
+    for request_id in request_ids:
+      db_utils.add_new_request(
+        conn, SERVICE, request_id,
+        {'-p{0}'.format(i): str(i) for i in range(args.parameters)}
+      )
+
+  try:
+    # Warm up the pool.
+    measure(single_query, request_ids[:1], 1)
+    report('two_queries', measure(two_queries, request_ids, args.repeat))
+    report('single_query', measure(single_query, request_ids, args.repeat))
+  finally:
+    with db_utils.get_db_connection() as conn:
+      for request_id in request_ids:
+        db_utils.abort_request(conn, request_id)
+
+if __name__ == '__main__':
+  main()
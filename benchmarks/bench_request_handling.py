@@ -0,0 +1,153 @@
+"""
+    Micro-benchmark of the CPU time per request spent validating
+    the parameters of /execute and encoding the JSON of /job_info.
+
+    Compares:
+    -) validation: the former checks, done by hand for each parameter,
+       against views.convert_parameters(), without and with the types
+       declared in section 'parameters' of application.ini;
+    -) encoding: the default JSON provider of Flask (standard module
+       json) against orjson, if installed, for a job with --output-kb KiB
+       of standard output; decoding, always done by the standard module.
+
+    No DB is used.
+
+    Usage:
+      python benchmarks/bench_request_handling.py [--parameters N]
+                                                  [--output-kb K] [--repeat R]
+"""
+
+import os
+import sys
+import time
+import numbers
+import argparse
+import statistics
+
+from datetime import datetime, timezone
+
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from va_simple_provider import app
+from va_simple_provider import json_backend
+from va_simple_provider import views
+
+MAX_PARAM_LEN = 20
+
+def former_validation(code_input_params):
+  """
+  The validation as it was done before views.convert_parameters().
+  """
+  string_parameters = {}
+  for parameter_key in code_input_params.keys():
+    if (len(parameter_key) > MAX_PARAM_LEN):
+      raise ValueError(parameter_key)
+    if isinstance(code_input_params[parameter_key], str):
+      string_parameters[parameter_key] = code_input_params[parameter_key]
+    elif isinstance(code_input_params[parameter_key], list):
+      string_parameters[parameter_key] = [
+        str(v) for v in code_input_params[parameter_key]
+      ]
+    elif isinstance(code_input_params[parameter_key], bool):
+      string_parameters[parameter_key] = ""
+    elif isinstance(code_input_params[parameter_key], numbers.Number):
+      string_parameters[parameter_key] = str(code_input_params[parameter_key])
+    else:
+      raise ValueError(parameter_key)
+  return string_parameters
+
+def sample_parameters(count):
+  """
+  Returns count parameters of all the types, and their declaration.
+  """
+  samples = [
+    ('string', 'value'), ('integer', 42), ('number', 3.14),
+    ('boolean', True), ('list', ['a', 1, 2.5]),
+  ]
+  parameters = {}
+  declared = {}
+  for i in range(count):
+    type_name, value = samples[i % len(samples)]
+    parameters['-p{0}'.format(i)] = value
+    declared['-p{0}'.format(i)] = type_name
+  return parameters, declared
+
+def sample_job_info(output_kb):
+  """
+  Returns a response of /job_info, as built by views.
+  """
+  now = datetime.now(timezone.utc)
+  output = ('x' * 79 + '\n') * (output_kb * 1024 // 80)
+  return {
+    "job_id": "benchmark",
+    "job_info": {
+      "received": now, "start_processing": now, "end_processing": now,
+      "exit_code": 0, "std_out": output, "std_err": "",
+      "std_out_bytes": len(output), "std_err_bytes": 0,
+      "std_out_url": None, "std_err_url": None,
+      "cancelled": False, "reused_from": None,
+      "priority": 0, "client": None,
+      "resource_usage": {
+        "peak_rss_kb": 10240, "user_cpu_time": 1.5,
+        "system_cpu_time": 0.25, "wall_time": 2.0}},
+    "params": {"-p0": "value", "-p1": ["a", "b"]}
+  }
+
+def measure(function, repeat):
+  """
+  Returns the CPU times, in microseconds, of function().
+  """
+  times = []
+  for _ in range(repeat):
+    start = time.process_time_ns()
+    function()
+    times.append((time.process_time_ns() - start) / 1000)
+  return times
+
+def report(name, times):
+  times = sorted(times)
+  print("{0:<26} n={1:<6} mean={2:10.1f} us  p50={3:10.1f} us  "
+        "p99={4:10.1f} us".format(
+          name, len(times), statistics.mean(times),
+          times[len(times) // 2], times[int(len(times) * 0.99)]))
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('--parameters', type=int, default=20)
+  parser.add_argument('--output-kb', type=int, default=1024)
+  parser.add_argument('--repeat', type=int, default=1000)
+  args = parser.parse_args()
+
+  parameters, declared = sample_parameters(args.parameters)
+  parameter_types = views.compile_parameter_types(declared)
+  if former_validation(parameters) != views.convert_parameters(parameters):
+    raise SystemExit("The validations differ.")
+  report('former_validation', measure(
+    lambda: former_validation(parameters), args.repeat))
+  report('convert_parameters', measure(
+    lambda: views.convert_parameters(parameters), args.repeat))
+  report('convert_parameters_typed', measure(
+    lambda: views.convert_parameters(parameters, parameter_types),
+    args.repeat))
+
+  job_info = sample_job_info(args.output_kb)
+  providers = [('json', DefaultJSONProvider(app))]
+  if json_backend.is_available(json_backend.ORJSON_BACKEND):
+    providers.append(
+      ('orjson', json_backend.create_provider(app, json_backend.ORJSON_BACKEND))
+    )
+  else:
+    print("orjson not installed: only the standard module json is measured.")
+  with app.app_context():
+    for name, provider in providers:
+      encoded = provider.dumps(job_info)
+      report(name + '_dumps', measure(
+        lambda: provider.dumps(job_info), args.repeat))
+    # Request bodies are always decoded by the standard module json.
+    report('json_loads', measure(
+      lambda: providers[0][1].loads(encoded), args.repeat))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,88 @@
+"""
+    Stand-in for the code of a service, for the benchmarks:
+    sleeps, then writes some output and exits.
+
+    Usage (the parameters of a job are passed as name value):
+      python benchmarks/dummy_code.py [--startup T] [--sleep S]
+                                      [--output-mb N] [--error-kb K]
+                                      [--exit-code C] [--warm]
+
+    --startup seconds are slept first, as the cost of loading the code.
+    With --warm it is then a warm process of the pool of module
+    va_simple_provider.controllers.warm_pool: it runs the jobs sent
+    on its standard input, with the same parameters.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+CHUNK = b'x' * 1023 + b'\n'
+
+def run(arguments):
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('--sleep', type=float, default=0.0,
+                      help='seconds to sleep before writing the output')
+  parser.add_argument('--output-mb', type=float, default=0.0,
+                      help='MiB written to the standard output')
+  parser.add_argument('--error-kb', type=float, default=0.0,
+                      help='KiB written to the standard error')
+  parser.add_argument('--exit-code', type=int, default=0)
+  args, _ = parser.parse_known_args(arguments)
+
+  time.sleep(args.sleep)
+  for _ in range(int(args.output_mb * 1024)):
+    sys.stdout.buffer.write(CHUNK)
+  for _ in range(int(args.error_kb)):
+    sys.stderr.buffer.write(CHUNK)
+  sys.stdout.flush()
+  sys.stderr.flush()
+  return args.exit_code
+
+def serve_warm():
+  """
+  Serve the jobs of the warm pool: a JSON line in, a JSON line out.
+  The standard output and error of each job are redirected
+  (file descriptors 1 and 2) to the files given for the job.
+  """
+
+  protocol = os.fdopen(os.dup(1), 'w')
+  saved_fds = os.dup(1), os.dup(2)
+  protocol.write(json.dumps({'ready': True}) + '\n')
+  protocol.flush()
+  for line in sys.stdin:
+    job = json.loads(line)
+    os.chdir(job['cwd'])
+    with open(job['stdout'], 'ab') as std_out, \
+         open(job['stderr'], 'ab') as std_err:
+      os.dup2(std_out.fileno(), 1)
+      os.dup2(std_err.fileno(), 2)
+      try:
+        exit_code = run(job['arguments'])
+      except SystemExit as ex:
+        exit_code = ex.code if isinstance(ex.code, int) else 2
+      except Exception as ex:
+        print(ex, file=sys.stderr)
+        exit_code = 1
+      finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+    protocol.write(json.dumps({'exit_code': exit_code}) + '\n')
+    protocol.flush()
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--startup', type=float, default=0.0)
+  args, _ = parser.parse_known_args()
+  time.sleep(args.startup)
+  if '--warm' in sys.argv[1:]:
+    serve_warm()
+    return 0
+  return run(sys.argv[1:])
+
+if __name__ == '__main__':
+  sys.exit(main())
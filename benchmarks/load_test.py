@@ -0,0 +1,458 @@
+"""
+    Load test of the service: submit latency, synchronous round trip
+    latency, throughput and DB connections at several concurrency levels.
+
+    A copy of the application is started, in a temporary directory,
+    as a separate server process with generated configuration files:
+    the code of the service is benchmarks/dummy_code.py, sleeping
+    --startup seconds to load, --sleep seconds per job and writing
+    --output-mb MiB of standard output; with --warm the jobs run
+    on warm processes of the code (section 'warm_pool').
+    The DB is, by default, an ephemeral PostgreSQL cluster created with
+    initdb (from --pg-bin or the PATH) and loaded with the shipped
+    schema; with --use-configured-db the DB configured in
+    va_simple_provider/database.ini is used instead (the test requests,
+    of service 'benchmark', are removed at the end).
+
+    For each concurrency level C, C clients:
+    -) submit --jobs asynchronous jobs (submit latency), then the end
+       of all the jobs is awaited (jobs/s, from first submit to last end);
+    -) run --jobs synchronous jobs (round trip latency).
+    The connections to the DB are sampled from pg_stat_activity.
+
+    Usage:
+      python benchmarks/load_test.py [--levels 1,4,16] [--jobs N]
+                                     [--sleep S] [--output-mb M]
+                                     [--startup T] [--warm]
+                                     [--max-concurrent-jobs J]
+                                     [--server-command CMD] [--json FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import shlex
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import urllib.request
+
+from configparser import ConfigParser
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+REPOSITORY_DIRECTORY = os.path.dirname(
+  os.path.dirname(os.path.abspath(__file__))
+)
+PACKAGE_DIRECTORY = os.path.join(REPOSITORY_DIRECTORY, 'va_simple_provider')
+SCHEMA_FILE = os.path.join(REPOSITORY_DIRECTORY, 'postgresql_schema.backup.sql')
+DUMMY_CODE = os.path.join(REPOSITORY_DIRECTORY, 'benchmarks', 'dummy_code.py')
+
+SERVICE = 'benchmark'
+DB_NAME = 'ogc_api_benchmark'
+DB_USER = 'ogc_api_user'
+DB_PASSWORD = 'benchmark'
+
+DEFAULT_SERVER_COMMAND = (
+  '{python} -m flask --app va_simple_provider run '
+  '--host 127.0.0.1 --port {port} --with-threads'
+)
+
+def free_port() -> int:
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+class EphemeralPostgres:
+  """
+  A PostgreSQL cluster in a temporary directory, with the shipped schema.
+  """
+
+  def __init__(self, directory, pg_bin=None):
+    self.directory = directory
+    self.pg_bin = pg_bin
+    self.port = free_port()
+    self.data_directory = os.path.join(directory, 'pgdata')
+
+  def __tool(self, name):
+    return os.path.join(self.pg_bin, name) if self.pg_bin else name
+
+  def __psql(self, *arguments, database='postgres'):
+    subprocess.run(
+      [self.__tool('psql'), '-q', '-h', '127.0.0.1', '-p', str(self.port),
+       '-U', 'postgres', '-d', database, *arguments],
+      check=True, stdout=subprocess.DEVNULL
+    )
+
+  def start(self):
+    subprocess.run(
+      [self.__tool('initdb'), '-D', self.data_directory, '-U', 'postgres',
+       '--auth=trust'],
+      check=True, stdout=subprocess.DEVNULL
+    )
+    subprocess.run(
+      [self.__tool('pg_ctl'), '-D', self.data_directory, '-w',
+       '-l', os.path.join(self.directory, 'postgresql.log'),
+       '-o', "-p {0} -k {1} -c listen_addresses=127.0.0.1 "
+             "-c max_connections=500".format(self.port, self.directory),
+       'start'],
+      check=True, stdout=subprocess.DEVNULL
+    )
+    self.__psql('-c', "CREATE ROLE {0} LOGIN PASSWORD '{1}'".format(
+      DB_USER, DB_PASSWORD))
+    self.__psql('-c', 'CREATE DATABASE {0}'.format(DB_NAME))
+    self.__psql('-f', SCHEMA_FILE, database=DB_NAME)
+
+  def stop(self):
+    subprocess.run(
+      [self.__tool('pg_ctl'), '-D', self.data_directory, '-m', 'fast',
+       'stop'],
+      stdout=subprocess.DEVNULL
+    )
+
+  def connection_parameters(self):
+    return {
+      'host': '127.0.0.1', 'port': str(self.port), 'database': DB_NAME,
+      'user': DB_USER, 'password': DB_PASSWORD,
+    }
+
+def write_configuration(package_copy, connection_parameters, job_directory,
+                        max_concurrent_jobs, startup, warm):
+  """
+  Write the configuration files of the copy of the application,
+  starting from the shipped ones.
+  """
+
+  application = ConfigParser()
+  application.read(os.path.join(PACKAGE_DIRECTORY, 'application.ini'))
+  application['executable'] = {
+    'id_service': SERVICE,
+    'command_line': repr(
+      [sys.executable, DUMMY_CODE, '--startup', str(startup)]
+    ),
+    'file_root_directory': job_directory,
+    'completion_listener': 'False',
+  }
+  application['executor'] = {
+    'max_concurrent_jobs': str(max_concurrent_jobs),
+    'max_queued_jobs': '100000',
+    'queue_full_policy': 'wait',
+  }
+  application['retention'] = {'retention_period': '0'}
+  if warm:
+    application['warm_pool'] = {
+      'command_line': repr(
+        [sys.executable, DUMMY_CODE, '--startup', str(startup), '--warm']
+      ),
+    }
+  else:
+    application.remove_section('warm_pool')
+  with open(os.path.join(package_copy, 'application.ini'), 'w') as f:
+    application.write(f)
+
+  database = ConfigParser()
+  database.read(os.path.join(PACKAGE_DIRECTORY, 'database.ini'))
+  database['postgresql'] = connection_parameters
+  with open(os.path.join(package_copy, 'database.ini'), 'w') as f:
+    database.write(f)
+
+class Server:
+  """
+  The copy of the application, run as a separate process.
+  """
+
+  def __init__(self, directory, command):
+    self.directory = directory
+    self.port = free_port()
+    self.command = command.format(python=sys.executable, port=self.port)
+    self.process = None
+    self.url = 'http://127.0.0.1:{0}'.format(self.port)
+
+  def start(self, timeout=60):
+    environment = dict(os.environ, PYTHONPATH=self.directory)
+    self.process = subprocess.Popen(
+      shlex.split(self.command), cwd=self.directory, env=environment,
+      stdout=subprocess.DEVNULL,
+      stderr=open(os.path.join(self.directory, 'server.log'), 'wb')
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+      if self.process.poll() is not None:
+        raise RuntimeError(
+          "Server ended: see {0}.".format(
+            os.path.join(self.directory, 'server.log')
+          )
+        )
+      try:
+        request(self.url + '/executor_stats')
+        return
+      except OSError:
+        time.sleep(0.2)
+    raise RuntimeError("Server not started in {0} seconds.".format(timeout))
+
+  def stop(self):
+    if self.process is not None and self.process.poll() is None:
+      self.process.terminate()
+      try:
+        self.process.wait(10)
+      except subprocess.TimeoutExpired:
+        self.process.kill()
+
+def request(url, payload=None):
+  """
+  Returns the decoded JSON response to a GET, or to a POST of payload.
+  """
+
+  data = None
+  headers = {}
+  if payload is not None:
+    data = json.dumps(payload).encode()
+    headers['Content-Type'] = 'application/json'
+  with urllib.request.urlopen(
+      urllib.request.Request(url, data=data, headers=headers),
+      timeout=3600) as response:
+    return json.loads(response.read() or b'null')
+
+class ConnectionSampler:
+  """
+  Samples in background the number of connections to the DB.
+  """
+
+  def __init__(self, connection_parameters, interval=0.1):
+    self.connection_parameters = connection_parameters
+    self.interval = interval
+    self.samples = []
+    self.stopped = threading.Event()
+    self.thread = None
+
+  def __enter__(self):
+    self.thread = threading.Thread(target=self.__run, daemon=True)
+    self.thread.start()
+    return self
+
+  def __exit__(self, *exc_info):
+    self.stopped.set()
+    self.thread.join()
+
+  def __run(self):
+    conn = psycopg2.connect(**self.connection_parameters)
+    conn.set_session(autocommit=True)
+    try:
+      with conn.cursor() as cur:
+        while not self.stopped.wait(self.interval):
+          cur.execute(
+            """SELECT count(*) FROM pg_stat_activity
+               WHERE datname = current_database()
+                 AND pid <> pg_backend_pid()""")
+          self.samples.append(cur.fetchone()[0])
+    finally:
+      conn.close()
+
+  def statistics(self):
+    if not self.samples:
+      return {'max': None, 'mean': None}
+    return {
+      'max': max(self.samples),
+      'mean': round(statistics.mean(self.samples), 1),
+    }
+
+def latency_statistics(latencies):
+  """
+  Returns mean and percentiles, in milliseconds.
+  """
+
+  latencies = sorted(latency * 1000 for latency in latencies)
+  return {
+    'n': len(latencies),
+    'mean': round(statistics.mean(latencies), 3),
+    'p50': round(latencies[len(latencies) // 2], 3),
+    'p95': round(latencies[int(len(latencies) * 0.95)], 3),
+    'p99': round(latencies[int(len(latencies) * 0.99)], 3),
+  }
+
+def job_body(job_id, args, synch_execution):
+  return {
+    'code_input_params': {
+      '--sleep': args.sleep, '--output-mb': args.output_mb,
+    },
+    'application_params': {
+      'job_id': job_id, 'synch_execution': synch_execution,
+    },
+  }
+
+def timed_submit(url, body):
+  start = time.perf_counter()
+  request(url, body)
+  return time.perf_counter() - start
+
+def wait_for_jobs(server, job_ids, poll_interval=0.2):
+  """
+  Wait until all the jobs have ended.
+  """
+
+  pending = list(job_ids)
+  while pending:
+    jobs = request(server.url + '/jobs_info', {
+      'job_id': pending[:1000], 'include_output': False, 'limit': 1000,
+    })['jobs']
+    ended = {
+      job['job_id'] for job in jobs
+      if job['job_info']['end_processing'] is not None
+    }
+    pending = [job_id for job_id in pending if job_id not in ended]
+    if pending:
+      time.sleep(poll_interval)
+
+def run_level(server, connection_parameters, concurrency, args):
+  """
+  Returns the measures at a concurrency level.
+  """
+
+  result = {'concurrency': concurrency}
+  with ThreadPoolExecutor(concurrency) as clients:
+    job_ids = [
+      'benchmark-' + str(uuid.uuid4()) for _ in range(args.jobs)
+    ]
+    with ConnectionSampler(connection_parameters) as sampler:
+      start = time.perf_counter()
+      latencies = list(clients.map(
+        lambda job_id: timed_submit(
+          server.url + '/execute', job_body(job_id, args, False)
+        ),
+        job_ids
+      ))
+      wait_for_jobs(server, job_ids)
+      elapsed = time.perf_counter() - start
+    result['submit_latency_ms'] = latency_statistics(latencies)
+    result['jobs_per_second'] = round(args.jobs / elapsed, 2)
+    result['db_connections_async'] = sampler.statistics()
+
+    job_ids = [
+      'benchmark-' + str(uuid.uuid4()) for _ in range(args.jobs)
+    ]
+    with ConnectionSampler(connection_parameters) as sampler:
+      latencies = list(clients.map(
+        lambda job_id: timed_submit(
+          server.url + '/execute', job_body(job_id, args, True)
+        ),
+        job_ids
+      ))
+    result['synch_round_trip_ms'] = latency_statistics(latencies)
+    result['db_connections_synch'] = sampler.statistics()
+
+  result['db_pool'] = request(server.url + '/db_pool_stats')
+  return result
+
+def report(result):
+  print("concurrency={0}".format(result['concurrency']))
+  for key in ('submit_latency_ms', 'synch_round_trip_ms'):
+    measures = result[key]
+    print("  {0:<22} n={1:<6} mean={2:9.3f}  p50={3:9.3f}  "
+          "p95={4:9.3f}  p99={5:9.3f}".format(
+            key, measures['n'], measures['mean'], measures['p50'],
+            measures['p95'], measures['p99']))
+  print("  {0:<22} {1}".format('jobs_per_second', result['jobs_per_second']))
+  for key in ('db_connections_async', 'db_connections_synch'):
+    print("  {0:<22} max={1}  mean={2}".format(
+      key, result[key]['max'], result[key]['mean']))
+
+def remove_benchmark_requests(connection_parameters):
+  conn = psycopg2.connect(**connection_parameters)
+  try:
+    with conn:
+      with conn.cursor() as cur:
+        cur.execute(
+          """DELETE FROM request_parameter WHERE request_id IN
+               (SELECT id FROM request WHERE service = %s)""", (SERVICE, ))
+        cur.execute("""DELETE FROM request WHERE service = %s""", (SERVICE, ))
+  finally:
+    conn.close()
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+  parser.add_argument('--levels', default='1,4,16',
+                      help='comma separated concurrency levels')
+  parser.add_argument('--jobs', type=int, default=100,
+                      help='jobs per level and mode')
+  parser.add_argument('--sleep', type=float, default=0.0,
+                      help='seconds each job sleeps')
+  parser.add_argument('--output-mb', type=float, default=0.0,
+                      help='MiB of standard output of each job')
+  parser.add_argument('--startup', type=float, default=0.0,
+                      help='seconds the code sleeps when started')
+  parser.add_argument('--warm', action='store_true',
+                      help='run the jobs on warm processes of the code')
+  parser.add_argument('--max-concurrent-jobs', type=int,
+                      default=os.cpu_count() or 1)
+  parser.add_argument('--server-command', default=DEFAULT_SERVER_COMMAND,
+                      help='command starting the server, with {python} '
+                           'and {port} placeholders')
+  parser.add_argument('--pg-bin', help='directory of initdb and pg_ctl')
+  parser.add_argument('--use-configured-db', action='store_true',
+                      help='use the DB of va_simple_provider/database.ini')
+  parser.add_argument('--keep', action='store_true',
+                      help='keep the temporary directory')
+  parser.add_argument('--json', help='file where to write the results')
+  args = parser.parse_args()
+
+  directory = tempfile.mkdtemp(prefix='va_benchmark_')
+  postgres = None
+  server = None
+  connection_parameters = None
+  try:
+    if args.use_configured_db:
+      configured = ConfigParser()
+      configured.read(os.path.join(PACKAGE_DIRECTORY, 'database.ini'))
+      connection_parameters = dict(configured.items('postgresql'))
+    else:
+      postgres = EphemeralPostgres(directory, args.pg_bin)
+      postgres.start()
+      connection_parameters = postgres.connection_parameters()
+
+    application_directory = os.path.join(directory, 'application')
+    package_copy = os.path.join(application_directory, 'va_simple_provider')
+    shutil.copytree(
+      PACKAGE_DIRECTORY, package_copy,
+      ignore=shutil.ignore_patterns('__pycache__')
+    )
+    job_directory = os.path.join(directory, 'jobs', '')
+    os.makedirs(job_directory)
+    write_configuration(
+      package_copy, connection_parameters, job_directory,
+      args.max_concurrent_jobs, args.startup, args.warm
+    )
+
+    server = Server(application_directory, args.server_command)
+    server.start()
+
+    results = []
+    for level in [int(level) for level in args.levels.split(',')]:
+      result = run_level(server, connection_parameters, level, args)
+      report(result)
+      results.append(result)
+
+    if args.json:
+      with open(args.json, 'w') as f:
+        json.dump({'parameters': vars(args), 'results': results}, f,
+                  indent=2)
+  finally:
+    if server is not None:
+      server.stop()
+    if args.use_configured_db and connection_parameters is not None:
+      remove_benchmark_requests(connection_parameters)
+    if postgres is not None:
+      postgres.stop()
+    if args.keep:
+      print("Temporary directory kept: {0}".format(directory))
+    else:
+      shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+  main()
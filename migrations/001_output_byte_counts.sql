@@ -0,0 +1,8 @@
+--
+-- Size in bytes of the full standard output and error of each job:
+-- columns std_out and std_err hold at most their head and tail.
+--
+
+ALTER TABLE public.request
+    ADD COLUMN IF NOT EXISTS std_out_bytes bigint,
+    ADD COLUMN IF NOT EXISTS std_err_bytes bigint;
@@ -0,0 +1,17 @@
+--
+-- Indexes for the scans of table request by status and for cleanup.
+--
+
+-- Jobs of a service in order of arrival.
+CREATE INDEX IF NOT EXISTS request_service_received_idx
+    ON public.request USING btree (service, received);
+
+-- Jobs not yet ended (queued or running).
+CREATE INDEX IF NOT EXISTS request_not_ended_idx
+    ON public.request USING btree (service, received)
+    WHERE (end_processing IS NULL);
+
+-- Jobs to be removed, scanned by the cleanup.
+CREATE INDEX IF NOT EXISTS request_time_to_clean_idx
+    ON public.request USING btree (time_to_clean)
+    WHERE (time_to_clean IS NOT NULL);
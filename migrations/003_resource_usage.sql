@@ -0,0 +1,11 @@
+--
+-- Resources used by the code of each job:
+-- peak resident set size (KiB), user and system CPU time,
+-- wall clock time (seconds).
+--
+
+ALTER TABLE public.request
+    ADD COLUMN IF NOT EXISTS peak_rss_kb bigint,
+    ADD COLUMN IF NOT EXISTS user_cpu_time double precision,
+    ADD COLUMN IF NOT EXISTS system_cpu_time double precision,
+    ADD COLUMN IF NOT EXISTS wall_time double precision;
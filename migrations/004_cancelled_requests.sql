@@ -0,0 +1,6 @@
+--
+-- Time of cancellation of the jobs cancelled by DELETE /job/<job_id>.
+--
+
+ALTER TABLE public.request
+    ADD COLUMN IF NOT EXISTS cancelled timestamp without time zone;
@@ -0,0 +1,12 @@
+--
+-- Jobs queued on the DB for the worker processes (distributed execution):
+-- arguments of the code, worker running the job, time of its last
+-- heartbeat and expiry of its lease, after which the job is claimed again.
+-- Claims scan index request_not_ended_idx.
+--
+
+ALTER TABLE public.request
+    ADD COLUMN IF NOT EXISTS arguments character varying[],
+    ADD COLUMN IF NOT EXISTS worker_id character varying,
+    ADD COLUMN IF NOT EXISTS heartbeat timestamp without time zone,
+    ADD COLUMN IF NOT EXISTS lease_expires timestamp without time zone;
@@ -0,0 +1,16 @@
+--
+-- Reuse of the results of identical requests (memoization):
+-- key of the result of the request, size of the reusable result
+-- (set when the request ended successfully), request whose result
+-- was reused.
+--
+
+ALTER TABLE public.request
+    ADD COLUMN IF NOT EXISTS result_key character(64),
+    ADD COLUMN IF NOT EXISTS result_bytes bigint,
+    ADD COLUMN IF NOT EXISTS reused_from character varying;
+
+-- Reusable results of a service.
+CREATE INDEX IF NOT EXISTS request_result_key_idx
+    ON public.request USING btree (service, result_key)
+    WHERE (result_key IS NOT NULL);
@@ -0,0 +1,8 @@
+--
+-- Reference to the standard output and error kept in the output storage,
+-- when too large to be stored on the DB.
+--
+
+ALTER TABLE public.request
+    ADD COLUMN IF NOT EXISTS std_out_ref character varying,
+    ADD COLUMN IF NOT EXISTS std_err_ref character varying;
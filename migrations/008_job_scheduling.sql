@@ -0,0 +1,20 @@
+--
+-- Scheduling of the queued jobs: priority (higher first, synchronous jobs
+-- boosted) and client submitting the job, for fair share and for the cap
+-- on the running jobs of each client.
+-- Claims by the workers (distributed execution) scan request_queued_idx.
+--
+
+ALTER TABLE public.request
+    ADD COLUMN IF NOT EXISTS priority integer DEFAULT 0 NOT NULL,
+    ADD COLUMN IF NOT EXISTS client character varying;
+
+CREATE INDEX IF NOT EXISTS request_queued_idx
+    ON public.request USING btree (service, priority DESC, received)
+    WHERE ((end_processing IS NULL) AND (arguments IS NOT NULL));
+
+-- Running jobs of each client.
+CREATE INDEX IF NOT EXISTS request_running_client_idx
+    ON public.request USING btree (service, client)
+    WHERE ((end_processing IS NULL) AND (start_processing IS NOT NULL)
+           AND (client IS NOT NULL));
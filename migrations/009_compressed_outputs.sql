@@ -0,0 +1,15 @@
+--
+-- Standard output and error larger than the compression threshold
+-- (section output_compression of database.ini), stored compressed
+-- with zlib, with an empty std_out/std_err.
+-- Stored out of line without compression: PostgreSQL would not gain
+-- anything compressing them again.
+--
+
+ALTER TABLE public.request
+    ADD COLUMN IF NOT EXISTS std_out_compressed bytea,
+    ADD COLUMN IF NOT EXISTS std_err_compressed bytea;
+
+ALTER TABLE public.request
+    ALTER COLUMN std_out_compressed SET STORAGE EXTERNAL,
+    ALTER COLUMN std_err_compressed SET STORAGE EXTERNAL;
@@ -40,10 +40,34 @@ CREATE TABLE public.request (
     exit_code smallint,
     std_out text,
     std_err text,
+    std_out_bytes bigint,
+    std_err_bytes bigint,
+    peak_rss_kb bigint,
+    user_cpu_time double precision,
+    system_cpu_time double precision,
+    wall_time double precision,
+    cancelled timestamp without time zone,
+    arguments character varying[],
+    worker_id character varying,
+    heartbeat timestamp without time zone,
+    lease_expires timestamp without time zone,
+    result_key character(64),
+    result_bytes bigint,
+    reused_from character varying,
+    std_out_ref character varying,
+    std_err_ref character varying,
+    priority integer DEFAULT 0 NOT NULL,
+    client character varying,
+    std_out_compressed bytea,
+    std_err_compressed bytea,
     CONSTRAINT request_check CHECK ((((end_processing IS NULL) = (exit_code IS NULL)) AND ((end_processing IS NULL) = (std_out IS NULL)) AND ((end_processing IS NULL) = (std_err IS NULL))))
 );
 
 
+ALTER TABLE ONLY public.request ALTER COLUMN std_out_compressed SET STORAGE EXTERNAL;
+ALTER TABLE ONLY public.request ALTER COLUMN std_err_compressed SET STORAGE EXTERNAL;
+
+
 ALTER TABLE public.request OWNER TO postgres;
 
 --
@@ -127,6 +151,48 @@ ALTER TABLE ONLY public.request
     ADD CONSTRAINT request_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: request_not_ended_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX request_not_ended_idx ON public.request USING btree (service, received) WHERE (end_processing IS NULL);
+
+
+--
+-- Name: request_queued_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX request_queued_idx ON public.request USING btree (service, priority DESC, received) WHERE ((end_processing IS NULL) AND (arguments IS NOT NULL));
+
+
+--
+-- Name: request_result_key_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX request_result_key_idx ON public.request USING btree (service, result_key) WHERE (result_key IS NOT NULL);
+
+
+--
+-- Name: request_running_client_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX request_running_client_idx ON public.request USING btree (service, client) WHERE ((end_processing IS NULL) AND (start_processing IS NOT NULL) AND (client IS NOT NULL));
+
+
+--
+-- Name: request_service_received_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX request_service_received_idx ON public.request USING btree (service, received);
+
+
+--
+-- Name: request_time_to_clean_idx; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX request_time_to_clean_idx ON public.request USING btree (time_to_clean) WHERE (time_to_clean IS NOT NULL);
+
+
 --
 -- Name: request_parameter request_parameter_request_fkey; Type: FK CONSTRAINT; Schema: public; Owner: postgres
 --
@@ -0,0 +1,69 @@
+"""
+    Tests of module code_handler not requiring a DB:
+    the status of the jobs on the DB is replaced by a flag.
+
+    Usage:
+      python -m pytest tests
+"""
+
+import threading
+
+import pytest
+
+from va_simple_provider.controllers import code_handler
+
+REQUEST_ID = 'job-1'
+
+@pytest.fixture
+def job(monkeypatch, tmp_path):
+  """
+  A running job whose end is given by job['ended'],
+  with its working directory under tmp_path.
+  """
+
+  state = {'ended': False}
+  monkeypatch.setattr(code_handler, '__file_root_directory', str(tmp_path))
+  monkeypatch.setattr(code_handler, '__completion_listener', False)
+  monkeypatch.setattr(code_handler, '__completion_recheck_interval', 3600.0)
+  monkeypatch.setattr(code_handler, 'OUTPUT_POLL_INTERVAL', 0.01)
+  monkeypatch.setattr(
+    code_handler, '__job_ended', lambda request_id: state['ended']
+  )
+  (tmp_path / REQUEST_ID).mkdir()
+  state['output'] = tmp_path / REQUEST_ID / code_handler.STD_OUT_FILE
+  return state
+
+def __notify_completion(request_id):
+  getattr(code_handler, '__notify_completion')(request_id)
+
+def test_follow_output_survives_wake_up_of_all_waiters(job):
+  """
+  The wake-up of all the waiters (sent by the completion listener
+  on each (re)connection) does not end the output of a running job;
+  its actual end, notified later, is not lost.
+  """
+
+  job['output'].write_bytes(b'first\n')
+  received = []
+  first_chunk = threading.Event()
+  follower_ended = threading.Event()
+
+  def follow():
+    for offset, data in code_handler.follow_output(
+        REQUEST_ID, code_handler.STD_OUT_STREAM):
+      received.append(data)
+      first_chunk.set()
+    follower_ended.set()
+
+  threading.Thread(target=follow, daemon=True).start()
+  assert first_chunk.wait(5)
+
+  __notify_completion(None)
+  assert not follower_ended.wait(0.2)
+
+  with open(job['output'], 'ab') as output:
+    output.write(b'second\n')
+  job['ended'] = True
+  __notify_completion(REQUEST_ID)
+  assert follower_ended.wait(5)
+  assert b''.join(received) == b'first\nsecond\n'
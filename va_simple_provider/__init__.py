@@ -26,6 +26,10 @@ try:
     # This import from "va_simple_provider" module must come after creating "app" variable,
     # so that views can import app variable
     from va_simple_provider import views
+    from va_simple_provider import config
+    # Reload the configuration on SIGHUP (where the server runs the app
+    # in the main thread).
+    config.install_reload_handler()
 except (Exception) as error:
     app.logger.critical("Initialization error: " + str(error))
     raise
@@ -0,0 +1,185 @@
+"""
+    ASGI entry point of the application, e.g.:
+      uvicorn va_simple_provider.asgi:application
+
+    JSON requests to /execute are served by coroutines: a synchronous
+    request awaits the end of its job without holding a thread
+    or a process, so that thousands of clients may wait at the same time.
+    The short DB operations run in the default executor of the event loop,
+    on the pooled connections of module db_utils.
+
+    All other routes are served by the Flask application
+    through the WSGI adapter of asgiref.
+"""
+
+import time
+import asyncio
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.exceptions import HTTPException
+
+from va_simple_provider import app
+from va_simple_provider import metrics
+from va_simple_provider import views
+from va_simple_provider.controllers import code_handler
+
+__flask_application = WsgiToAsgi(app)
+
+async def application(scope, receive, send):
+  """
+  The ASGI application.
+  """
+
+  if scope['type'] == 'lifespan':
+    await __lifespan(receive, send)
+  elif (scope['type'] == 'http' and scope['method'] == 'POST'
+        and scope['path'] == '/execute'
+        and not __is_multipart(scope)):
+    await __execute(scope, receive, __observed(send, '/execute', 'POST'))
+  else:
+    await __flask_application(scope, receive, send)
+
+def __observed(send, endpoint: str, method: str):
+  """
+  Returns send, recording the time to serve the request when the response
+  starts, as the Flask application does for its routes (requests served
+  here do not pass through its before_request and after_request).
+  """
+
+  start_time = time.monotonic()
+
+  async def observed_send(message) -> None:
+    if message['type'] == 'http.response.start':
+      metrics.HTTP_REQUEST_SECONDS.observe(
+        time.monotonic() - start_time,
+        endpoint=endpoint, method=method, status=message['status']
+      )
+    await send(message)
+
+  return observed_send
+
+def __is_multipart(scope) -> bool:
+  """
+  Returns True for multipart requests (with input files): they are
+  served by the Flask application, which receives the body
+  spooled to a temporary file and writes the files in chunks.
+  """
+
+  return any(
+    name.lower() == b'content-type' and value.startswith(b'multipart/')
+    for name, value in scope['headers']
+  )
+
+async def __lifespan(receive, send) -> None:
+  """
+  Acknowledge the startup and shutdown of the server:
+  the application is initialized on import.
+  """
+
+  while True:
+    message = await receive()
+    if message['type'] == 'lifespan.startup':
+      await send({'type': 'lifespan.startup.complete'})
+    elif message['type'] == 'lifespan.shutdown':
+      await send({'type': 'lifespan.shutdown.complete'})
+      return
+
+async def __execute(scope, receive, send) -> None:
+  """
+  Asynchronous equivalent of views.do_execute().
+  """
+
+  headers = {
+    name.decode('latin-1').lower(): value.decode('latin-1')
+    for name, value in scope['headers']
+  }
+
+  body = await __read_body(receive, app.config['MAX_CONTENT_LENGTH'])
+  if body is None:
+    await __send_json(send, 413, {'Message': 'Request body too large.'})
+    return
+
+  try:
+    request_id, synch_execution = await asyncio.to_thread(
+      views.submit_execute_request, headers.get('content-type'), body
+    )
+    if not synch_execution:
+      await __send_json(send, 200, {})
+      return
+
+    wait_start = time.monotonic()
+    await code_handler.async_wait_for_completion(request_id)
+    metrics.SYNCH_WAIT_SECONDS.observe(time.monotonic() - wait_start)
+    job_info = await asyncio.to_thread(views.build_job_info, request_id)
+  except HTTPException as error:
+    await __send_response(send, error.get_response())
+    return
+  except Exception as error:
+    app.logger.error(str(error), exc_info=True)
+    err_msg = "Please report to the application manager " \
+              "with date and time of the problem."
+    await __send_json(send, 400, {'Message': err_msg})
+    return
+
+  if job_info is None:
+    err_msg = "Data on job_id  {0} not present.".format(request_id)
+    await __send_json(send, 400, {'Message': err_msg})
+  else:
+    await __send_json(send, 200, job_info, headers.get('accept-encoding'))
+
+async def __read_body(receive, max_size):
+  """
+  Returns the whole body of the request,
+  or None if it exceeds max_size bytes.
+  """
+
+  chunks = []
+  size = 0
+  more_body = True
+  while more_body:
+    message = await receive()
+    if message['type'] == 'http.disconnect':
+      break
+    chunk = message.get('body', b'')
+    size += len(chunk)
+    if max_size is not None and size > max_size:
+      return None
+    chunks.append(chunk)
+    more_body = message.get('more_body', False)
+  return b''.join(chunks)
+
+async def __send_json(send, status: int, payload,
+                      accept_encoding: str = None) -> None:
+  """
+  Send a JSON response, serialized as Flask would,
+  compressed as by the Flask application (see views.compress_body).
+  """
+
+  body = app.json.dumps(payload).encode()
+  headers = [(b'content-type', b'application/json')]
+  if status == 200 and views.is_compressible(body, 'application/json'):
+    headers.append((b'vary', b'Accept-Encoding'))
+    body, encoding = views.compress_body(body, accept_encoding)
+    if encoding is not None:
+      headers.append((b'content-encoding', encoding.encode()))
+  await __send(send, status, headers, body)
+
+async def __send_response(send, response) -> None:
+  """
+  Send a werkzeug Response, e.g. the one of an aborted request.
+  """
+
+  await __send(
+    send, response.status_code,
+    [(name.lower().encode('latin-1'), value.encode('latin-1'))
+     for name, value in response.headers.items()],
+    response.get_data()
+  )
+
+async def __send(send, status: int, headers: list, body: bytes) -> None:
+  headers = [h for h in headers if h[0] != b'content-length']
+  headers.append((b'content-length', str(len(body)).encode()))
+  await send({
+    'type': 'http.response.start', 'status': status, 'headers': headers
+  })
+  await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,122 @@
+"""
+    Configuration of the application: files application.ini and
+    database.ini of the configuration directory, each parsed once
+    and shared by all the modules.
+
+    Each module reads and validates its own sections in its __config()
+    function, registered with on_reload().
+    reload() parses the files again and calls the registered functions,
+    in order of registration (i.e. of import of the modules):
+    if any of them raises an exception the configuration is invalid,
+    and the previous one is restored.
+    With install_reload_handler() the configuration is reloaded
+    on SIGHUP, without restarting the process.
+"""
+
+import os
+import signal
+import threading
+
+from configparser import ConfigParser
+
+from va_simple_provider import app, configuration_directory
+
+APPLICATION_FILE = 'application.ini'
+DATABASE_FILE = 'database.ini'
+
+# File name -> parsed file.
+__parsers = {}
+__reload_functions = []
+__lock = threading.RLock()
+
+def __read(name: str) -> ConfigParser:
+  parser = ConfigParser()
+  # Case sensitive keys: the names of the parameters declared
+  # in section 'parameters' are passed to the code as they are.
+  parser.optionxform = str
+  parser.read(os.path.join(configuration_directory, name))
+  return parser
+
+def __get(name: str) -> ConfigParser:
+  with __lock:
+    parser = __parsers.get(name)
+    if parser is None:
+      parser = __read(name)
+      __parsers[name] = parser
+    return parser
+
+def get_application() -> ConfigParser:
+  """
+  Returns the parsed file application.ini (not to be modified).
+  """
+
+  return __get(APPLICATION_FILE)
+
+def get_database() -> ConfigParser:
+  """
+  Returns the parsed file database.ini (not to be modified).
+  """
+
+  return __get(DATABASE_FILE)
+
+def on_reload(function) -> None:
+  """
+  Register the function (the __config() of a module) to be called,
+  without arguments, when the configuration is reloaded.
+  """
+
+  with __lock:
+    __reload_functions.append(function)
+
+def reload() -> bool:
+  """
+  Parse the configuration files again and apply them to all
+  the registered modules.
+
+  Returns False, restoring the previous configuration,
+  if the new one is invalid.
+  """
+
+  with __lock:
+    previous = dict(__parsers)
+    for name in (APPLICATION_FILE, DATABASE_FILE):
+      __parsers[name] = __read(name)
+    try:
+      for function in __reload_functions:
+        function()
+    except Exception as ex:
+      app.logger.error(
+        "Configuration not reloaded, the previous one is kept: " + str(ex)
+      )
+      __parsers.clear()
+      __parsers.update(previous)
+      for function in __reload_functions:
+        try:
+          function()
+        except Exception as ex:
+          app.logger.error(
+            "Previous configuration not restored: " + str(ex)
+          )
+      return False
+
+  app.logger.info("Configuration reloaded.")
+  return True
+
+def install_reload_handler() -> bool:
+  """
+  Reload the configuration on SIGHUP, on a separate thread.
+
+  Returns False if the handler cannot be installed:
+  not called from the main thread.
+  """
+
+  if threading.current_thread() is not threading.main_thread():
+    return False
+
+  def on_signal(signum, frame):
+    threading.Thread(
+      target=reload, name='config-reload', daemon=True
+    ).start()
+
+  signal.signal(signal.SIGHUP, on_signal)
+  return True
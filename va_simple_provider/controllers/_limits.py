@@ -0,0 +1,50 @@
+"""
+    Exec trampoline applying the limits of module process_runner
+    to the code before it starts:
+      python _limits.py <limits as JSON> <command line of the code>
+
+    The limits are a JSON object with keys (all optional):
+    -) rlimits: resource number (e.g. resource.RLIMIT_CPU) -> limit;
+    -) nice: scheduling priority increment;
+    -) cpu_affinity: list of the CPUs the code may run on.
+
+    The process then executes the code in place (os.execvp): the code,
+    and any child it starts, run within the limits from their first
+    instruction.
+    Run as a script, so that it does not import the application.
+"""
+
+import os
+import sys
+import json
+import resource
+
+# Exit code when the code cannot be executed, as for a shell.
+EXEC_FAILED_EXIT_CODE = 127
+
+def apply_limits(limits: dict) -> None:
+  """
+  Apply the limits to the current process.
+  """
+
+  for rlimit, value in limits.get('rlimits', {}).items():
+    resource.setrlimit(int(rlimit), (value, value))
+  if limits.get('nice'):
+    os.nice(limits['nice'])
+  if limits.get('cpu_affinity'):
+    os.sched_setaffinity(0, limits['cpu_affinity'])
+
+def main(argv: list) -> None:
+  limits = json.loads(argv[1])
+  command_line = argv[2:]
+  apply_limits(limits)
+  try:
+    os.execvp(command_line[0], command_line)
+  except OSError as ex:
+    sys.stderr.write(
+      "Code not executed: {0}: {1}\n".format(command_line[0], ex.strerror)
+    )
+    sys.exit(EXEC_FAILED_EXIT_CODE)
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -5,22 +5,67 @@
 """
 
 import os
+import re
+import time
+import shutil
+import asyncio
 import threading
-import subprocess
 import ast
+import json
+import hashlib
 
-from cgi import FieldStorage
+from contextlib import contextmanager
 
-from configparser import ConfigParser
+from werkzeug.utils import secure_filename
 
 from va_simple_provider import app, configuration_directory
+from va_simple_provider import config
 from va_simple_provider import db_utils
+from va_simple_provider import metrics
+from va_simple_provider.lru_cache import LRUCache
+from va_simple_provider.controllers import job_executor
+from va_simple_provider.controllers import output_storage
+from va_simple_provider.controllers import process_runner
+from va_simple_provider.controllers import warm_pool
 from va_simple_provider.custom_exceptions import AppCustomException
 from va_simple_provider.custom_exceptions import BaseCustomException
+from va_simple_provider.custom_exceptions import ServiceBusyException
+
+# Files, in the working directory of each job,
+# where standard output and error of the code are written.
+STD_OUT_FILE = 'std_out.log'
+STD_ERR_FILE = 'std_err.log'
+
+# Outputs that can be followed while the job runs: name -> file.
+STD_OUT_STREAM = 'std_out'
+STD_ERR_STREAM = 'std_err'
+OUTPUT_STREAMS = {STD_OUT_STREAM: STD_OUT_FILE, STD_ERR_STREAM: STD_ERR_FILE}
+OUTPUT_CHUNK_SIZE = 64 * 1024
+OUTPUT_POLL_INTERVAL = 0.5
+
+# Job ids accepted: they name the working directory of the job,
+# under file_root_directory ('.' and '..' are refused as well).
+JOB_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]+')
 
 __id_service = None
 __command_line = None
 __file_root_directory = None
+__max_stored_output_size = None
+__job_info_cache = None
+__job_info_cache_ttl = None
+__retention_period = None
+__completion_listener = None
+__completion_recheck_interval = None
+__memoization = None
+__memoization_ttl = None
+__memoization_max_entries = None
+__memoization_max_bytes = None
+
+# Events signalling the end of a job to the threads waiting for it,
+# one for each waiting thread: request id -> list of events.
+__completion_events = {}
+__completion_events_lock = threading.Lock()
+__completion_listener_thread = None
 
 def __config():
   """
@@ -31,6 +76,27 @@ def __config():
     id_service
     command_line
     file_root_directory
+    suppress_stdout (optional)
+    max_stored_output_size (optional)
+    completion_listener (optional, always on with distributed execution)
+    completion_recheck_interval (optional)
+
+  The following parameters are read from file 'application.ini',
+  section 'cache' (all optional):
+    job_info_max_entries
+    job_info_max_bytes
+    job_info_ttl
+
+  The following parameter is read from file 'application.ini',
+  section 'retention' (optional):
+    retention_period
+
+  The following parameters are read from file 'application.ini',
+  section 'memoization' (all optional):
+    enabled
+    ttl
+    max_entries
+    max_bytes
   """
 
   filename = os.path.join(configuration_directory, 'application.ini')
@@ -48,8 +114,17 @@ def __config():
   global __suppress_stdout
   suppress_stdout_key = 'suppress_stdout'
 
-  parser = ConfigParser()
-  parser.read(filename)
+  global __max_stored_output_size
+  max_stored_output_size_key = 'max_stored_output_size'
+
+  global __completion_listener
+  completion_listener_key = 'completion_listener'
+
+  global __completion_recheck_interval
+  completion_recheck_interval_key = 'completion_recheck_interval'
+
+  parser = config.get_application()
+  previous_id_service = __id_service
 
   section_parameters = {}
   if parser.has_section(section):
@@ -91,34 +166,353 @@ def __config():
   else:
     __command_line = [tmp_command_line]
 
-  if (suppress_stdout_key in section_parameters.keys()):
-    __suppress_stdout = section_parameters[suppress_stdout_key]
+  try:
+    __suppress_stdout = parser.getboolean(
+      section, suppress_stdout_key, fallback=False
+    )
+  except ValueError as ex:
+    raise AppCustomException(
+      "Parameter '{0}' in section '{1}' in file '{2}' "
+      "must be a boolean.".format(
+        suppress_stdout_key, section, os.path.abspath(filename)
+      )
+    ) from ex
+
+  try:
+    __max_stored_output_size = parser.getint(
+      section, max_stored_output_size_key, fallback=1024 * 1024
+    )
+  except ValueError:
+    raise AppCustomException(
+      "Parameter '{0}' in section '{1}' in file '{2}' "
+      "must be an integer.".format(
+        max_stored_output_size_key, section, os.path.abspath(filename)
+      )
+    )
+
+  try:
+    # With distributed execution every job is run by another process:
+    # the listener is always needed.
+    __completion_listener = parser.getboolean(
+      section, completion_listener_key, fallback=False
+    ) or job_executor.is_distributed()
+    __completion_recheck_interval = parser.getfloat(
+      section, completion_recheck_interval_key, fallback=30.0
+    )
+  except ValueError:
+    raise AppCustomException(
+      "Parameter '{0}' must be a boolean and '{1}' a number "
+      "in section '{2}' in file '{3}'.".format(
+        completion_listener_key, completion_recheck_interval_key,
+        section, os.path.abspath(filename)
+      )
+    )
+
+  section_cache = 'cache'
+
+  global __job_info_cache
+
+  global __job_info_cache_ttl
+
+  try:
+    job_info_max_entries = parser.getint(
+      section_cache, 'job_info_max_entries', fallback=1000
+    )
+    job_info_max_bytes = parser.getint(
+      section_cache, 'job_info_max_bytes', fallback=64 * 1024 * 1024
+    )
+    __job_info_cache_ttl = parser.getfloat(
+      section_cache, 'job_info_ttl', fallback=3600.0
+    )
+  except ValueError:
+    raise AppCustomException(
+      "Parameters in section '{0}' in file '{1}' must be numbers.".format(
+        section_cache, os.path.abspath(filename)
+      )
+    )
+  if __job_info_cache is None or __id_service != previous_id_service:
+    # Cached information is of the jobs of the service.
+    __job_info_cache = LRUCache(
+      job_info_max_entries, job_info_max_bytes, __job_info_cache_ttl
+    )
   else:
-    __suppress_stdout = False
+    # On reload the cached information stays valid: only the limits change.
+    __job_info_cache.resize(
+      job_info_max_entries, job_info_max_bytes, __job_info_cache_ttl
+    )
+
+  section_retention = 'retention'
+  retention_period_key = 'retention_period'
+
+  global __retention_period
+
+  try:
+    __retention_period = parser.getfloat(
+      section_retention, retention_period_key, fallback=0
+    )
+  except ValueError:
+    raise AppCustomException(
+      "Parameter '{0}' in section '{1}' in file '{2}' "
+      "must be a number.".format(
+        retention_period_key, section_retention, os.path.abspath(filename)
+      )
+    )
+  if __retention_period <= 0:
+    # Requests are kept forever.
+    __retention_period = None
+
+  section_memoization = 'memoization'
+
+  global __memoization
+
+  global __memoization_ttl
+
+  global __memoization_max_entries
+
+  global __memoization_max_bytes
+
+  try:
+    __memoization = parser.getboolean(
+      section_memoization, 'enabled', fallback=False
+    )
+    __memoization_ttl = parser.getfloat(
+      section_memoization, 'ttl', fallback=86400.0
+    )
+    __memoization_max_entries = parser.getint(
+      section_memoization, 'max_entries', fallback=1000
+    )
+    __memoization_max_bytes = parser.getint(
+      section_memoization, 'max_bytes', fallback=1024 * 1024 * 1024
+    )
+  except ValueError:
+    raise AppCustomException(
+      "Parameter 'enabled' must be a boolean and the others numbers "
+      "in section '{0}' in file '{1}'.".format(
+        section_memoization, os.path.abspath(filename)
+      )
+    )
 
   return
 __config()
+config.on_reload(__config)
+
+def __notify_completion(request_id) -> None:
+  """
+  Wake up the threads waiting for the end of the job.
+
+  With request_id None all the waiting threads are woken up,
+  to check again the status of their job on the DB.
+  """
+
+  with __completion_events_lock:
+    if request_id is None:
+      events = [
+        event for events in __completion_events.values() for event in events
+      ]
+    else:
+      events = list(__completion_events.get(request_id, []))
+  for event in events:
+    event.set()
+
+class _AsyncioEvent:
+  """
+  Completion event for coroutines: set() may be called from any thread,
+  wait() is awaited in the event loop that created the instance.
+  """
+
+  def __init__(self):
+    self._loop = asyncio.get_running_loop()
+    self._event = asyncio.Event()
+
+  def set(self) -> None:
+    try:
+      self._loop.call_soon_threadsafe(self._event.set)
+    except RuntimeError:
+      # Event loop closed (e.g. on shutdown): nobody is waiting.
+      pass
+
+  def clear(self) -> None:
+    self._event.clear()
+
+  async def wait(self, timeout: float) -> bool:
+    try:
+      await asyncio.wait_for(self._event.wait(), timeout)
+    except asyncio.TimeoutError:
+      return False
+    return True
+
+@contextmanager
+def __completion_event(request_id: str, event=None):
+  """
+  Register, for the duration of the with block, an event
+  set when the job ends.
+
+  Any object with a set() method may be given as event;
+  by default a threading.Event is created.
+  """
+
+  if __completion_listener:
+    __start_completion_listener()
+
+  if event is None:
+    event = threading.Event()
+  with __completion_events_lock:
+    __completion_events.setdefault(request_id, []).append(event)
+  try:
+    yield event
+  finally:
+    with __completion_events_lock:
+      events = __completion_events[request_id]
+      events.remove(event)
+      if not events:
+        del __completion_events[request_id]
+
+def __job_ended(request_id: str) -> bool:
+  """
+  Returns True if the job ended, or is not present on the DB.
+  """
+
+  job_info = get_job_info(request_id)
+  return job_info is None or job_info['end_processing'] is not None
+
+def __on_notification(channel, request_id) -> None:
+  """
+  Dispatch a notification received from PostgreSQL:
+  terminate the code of a cancelled job if it runs in this process,
+  otherwise wake up the threads waiting for the job.
+  """
+
+  if channel == db_utils.JOB_CANCELLED_CHANNEL:
+    process_runner.terminate(request_id)
+  else:
+    __notify_completion(request_id)
+
+def __start_completion_listener() -> None:
+  """
+  Start, at first use, the thread receiving from PostgreSQL
+  the notifications of the jobs completed or cancelled by any process.
+  """
+
+  global __completion_listener_thread
+  with __completion_events_lock:
+    if __completion_listener_thread is not None:
+      return
+    __completion_listener_thread = threading.Thread(
+      target=db_utils.listen_for_notifications,
+      name='completion-listener',
+      args=(
+        [db_utils.JOB_COMPLETED_CHANNEL, db_utils.JOB_CANCELLED_CHANNEL],
+        __on_notification
+      ),
+      daemon=True
+    )
+    __completion_listener_thread.start()
 
 def __callable_function(request_id, command_line_args, base_working_dir):
   """
-  Function called as separate thread to invoke (run) the requested code.
+  Function called by a worker thread to invoke (run) the requested code.
 
   The function record the state of the request on the DB:
   -) before calling the code
   -) after the end of the execution
   The end of processing will be recorded also if
   the code ends with exceptions.
+  In any case the threads waiting for the job are notified.
+  """
+
+  try:
+    __run_request(request_id, command_line_args, base_working_dir)
+  finally:
+    __notify_completion(request_id)
+
+def __read_head_tail(file_path: str, max_size: int):
+  """
+  Returns the content of an output file, decoded as text,
+  and its size in bytes.
+
+  If the file is larger than max_size bytes only its head and tail
+  are returned, so that memory use does not depend on the file size.
+  """
+
+  total_bytes = os.path.getsize(file_path)
+  with open(file_path, 'rb') as f:
+    if total_bytes <= max_size:
+      content = f.read()
+    else:
+      head_size = max_size // 2
+      head = f.read(head_size)
+      f.seek(total_bytes - (max_size - head_size))
+      tail = f.read()
+      content = (
+        head
+        + "\n...[{0} bytes omitted]...\n".format(
+            total_bytes - max_size
+          ).encode()
+        + tail
+      )
+
+  return content.decode('utf-8', errors='replace'), total_bytes
+
+def __stored_output(request_id: str, file_path: str):
+  """
+  Returns the content of an output file as to be stored on the DB,
+  its size in bytes and the reference to the output in the storage
+  of module output_storage (None if not stored there).
+
+  Outputs larger than the storage threshold are handed to the storage:
+  only their reference is stored on the DB, with an empty content.
+  """
+
+  total_bytes = os.path.getsize(file_path)
+  if output_storage.is_to_store(total_bytes):
+    reference = output_storage.store(
+      request_id, os.path.basename(file_path), file_path
+    )
+    return "", total_bytes, reference
+
+  text, total_bytes = __read_head_tail(file_path, __max_stored_output_size)
+  return text, total_bytes, None
+
+def __run_request(request_id, command_line_args, base_working_dir,
+                  record_start: bool = True, worker_id: str = None):
+  """
+  Record the start on the DB, run the code, record the outcome on the DB.
+  With record_start False the start was already recorded
+  (the request was claimed by a worker process, worker_id: the outcome
+  is discarded if the worker no more holds the request).
+
+  The standard output and error of the code are written by the code
+  itself to files in its working directory (STD_OUT_FILE, STD_ERR_FILE):
+  only their head and tail, up to max_stored_output_size bytes,
+  and their size are stored on the DB; outputs over the threshold
+  of module output_storage are stored there, with their reference
+  on the DB.
+  The code runs within the limits of module process_runner,
+  on a warm process of module warm_pool if enabled:
+  the resources it used are stored on the DB.
   """
 
   command_line = []
   command_line.extend(command_line_args)
 
+  if __completion_listener:
+    # Cancellations requested to other processes arrive as notifications.
+    __start_completion_listener()
+
+  taken_time = time.monotonic()
   try:
     with db_utils.get_db_connection() as conn:
       try: 
-        db_utils.record_started_request(conn, request_id)
+        started = (
+          not record_start
+          or db_utils.record_started_request(conn, request_id)
+        )
       except Exception as ex:
-        db_utils.record_failed_request(conn, request_id, str(ex))
+        conn.rollback()
+        db_utils.record_failed_request(
+          conn, request_id, str(ex), __retention_period
+        )
+        raise
   except Exception as ex:
     app.logger.error(
       "Request failed on start. Request id = {0}. {1}".format(
@@ -126,20 +520,109 @@ def __callable_function(request_id, command_line_args, base_working_dir):
       ),
       exc_info=True
     )
+    metrics.JOBS_ENDED.inc(outcome='error')
     # There is nothing else to do.
     return
+  if not started:
+    # Cancelled while queued: its end is already recorded.
+    metrics.JOBS_ENDED.inc(outcome='cancelled')
+    return
 
-  outcome = subprocess.run(
-    command_line,
-    stdout=subprocess.PIPE,
-    stderr=subprocess.PIPE,
-    text=True,
-    cwd=base_working_dir
-  )
+  std_out_path = os.path.join(base_working_dir, STD_OUT_FILE)
+  std_err_path = os.path.join(base_working_dir, STD_ERR_FILE)
+  try:
+    with open(std_out_path, 'wb') as std_out, \
+         open(std_err_path, 'wb') as std_err:
+      metrics.JOB_START_LATENCY_SECONDS.observe(time.monotonic() - taken_time)
+      metrics.ACTIVE_SUBPROCESSES.inc()
+      try:
+        resource_usage = None
+        if warm_pool.is_enabled():
+          resource_usage = warm_pool.run_job(
+            request_id, command_line[len(__command_line):],
+            base_working_dir, std_out_path, std_err_path
+          )
+        if resource_usage is None:
+          resource_usage = process_runner.run_process(
+            command_line, base_working_dir, std_out, std_err, request_id
+          )
+      finally:
+        metrics.ACTIVE_SUBPROCESSES.dec()
+      end_time = time.monotonic()
+      metrics.JOB_RUNTIME_SECONDS.observe(resource_usage['wall_time'])
+      exit_code = resource_usage.pop('exit_code')
+  except Exception as ex:
+    app.logger.error(
+      "Request failed to run the code. Request id = {0}. {1}".format(
+        request_id, str(ex)
+      ),
+      exc_info=True
+    )
+    try:
+      with db_utils.get_db_connection() as conn:
+        db_utils.record_failed_request(
+          conn, request_id, str(ex), __retention_period, worker_id
+        )
+    except Exception as ex:
+      app.logger.error(
+        "Request failure was not registered to the DB. "
+        "Request id = {0}. {1}".format(request_id, str(ex))
+      )
+    metrics.JOBS_ENDED.inc(outcome='error')
+    return
 
   try:
+    if worker_id is not None:
+      with db_utils.get_db_connection() as conn:
+        held = db_utils.holds_lease(conn, worker_id, request_id)
+      if not held:
+        # Its outputs may be those of the worker now running it.
+        app.logger.warning(
+          "Lease on job {0} lost: outcome discarded.".format(request_id)
+        )
+        metrics.JOBS_ENDED.inc(outcome='error')
+        return
+    if __suppress_stdout:
+      std_out_text, std_out_bytes, std_out_ref = (
+        "", os.path.getsize(std_out_path), None
+      )
+    else:
+      std_out_text, std_out_bytes, std_out_ref = __stored_output(
+        request_id, std_out_path
+      )
+    std_err_text, std_err_bytes, std_err_ref = __stored_output(
+      request_id, std_err_path
+    )
+    if resource_usage.pop('timed_out'):
+      std_err_text += (
+        "\n[Code terminated: wall clock timeout exceeded.]\n"
+      )
+    cancelled = resource_usage.pop('terminated')
+    if cancelled:
+      std_err_text += "\n[Code terminated: job cancelled.]\n"
+    metrics.JOB_OUTPUT_BYTES.inc(std_out_bytes, stream=STD_OUT_STREAM)
+    metrics.JOB_OUTPUT_BYTES.inc(std_err_bytes, stream=STD_ERR_STREAM)
     with db_utils.get_db_connection() as conn:
-      db_utils.record_completed_request(conn, request_id, outcome, __suppress_stdout)
+      recorded = db_utils.record_completed_request(
+        conn, request_id, exit_code, std_out_text, std_err_text,
+        std_out_bytes, std_err_bytes, __retention_period, resource_usage,
+        std_out_ref, std_err_ref, worker_id
+      )
+    metrics.JOB_RESULT_WRITE_SECONDS.observe(time.monotonic() - end_time)
+    if not recorded:
+      app.logger.warning(
+        "Lease on job {0} lost: outcome discarded.".format(request_id)
+      )
+      metrics.JOBS_ENDED.inc(outcome='error')
+      return
+    if __memoization and exit_code == 0 and not cancelled:
+      __record_reusable_result(request_id, base_working_dir)
+    if cancelled:
+      metrics.JOBS_ENDED.inc(outcome='cancelled')
+    else:
+      metrics.JOBS_ENDED.inc(
+        outcome='success' if exit_code == 0 else 'failure'
+      )
   except Exception as ex:
     app.logger.error(
       "Request completed but was not registered to the DB. "
@@ -148,87 +631,640 @@ def __callable_function(request_id, command_line_args, base_working_dir):
       ),
       exc_info=True
     )
+    metrics.JOBS_ENDED.inc(outcome='error')
 
   return
 
-def __submit_request(request_id, command_line, base_working_dir) -> None:
+def __directory_size(path: str) -> int:
+  """
+  Returns the total size in bytes of the files under the directory.
   """
-  Prepare the new thread to call the code asynchronously; 
-  update the request state on the DB.
 
-  Return the timestamp when the request was received.
+  size = 0
+  for dir_path, dir_names, file_names in os.walk(path):
+    for file_name in file_names:
+      try:
+        size += os.lstat(os.path.join(dir_path, file_name)).st_size
+      except OSError:
+        pass
+  return size
+
+def __record_reusable_result(request_id: str, base_working_dir: str) -> None:
+  """
+  Record the result of a job ended successfully as reusable
+  by later identical requests (memoization), evicting the oldest ones.
   """
 
-  # per interrompere provare:
-  # https://stackoverflow.com/questions/28633357/kill-python-thread-using-os
-  t = threading.Thread(
-    target=__callable_function,
-    name=request_id,
-    kwargs={
+  try:
+    with db_utils.get_db_connection() as conn:
+      db_utils.record_result_size(
+        conn, __id_service, request_id, __directory_size(base_working_dir),
+        __memoization_ttl, __memoization_max_entries, __memoization_max_bytes
+      )
+  except Exception as ex:
+    app.logger.warning(
+      "Result not recorded as reusable. Request id = {0}. {1}".format(
+        request_id, str(ex)
+      )
+    )
+
+def __submit_request(request_id, command_line, base_working_dir,
+                     priority: int = 0, client: str = None) -> None:
+  """
+  Queue the job to call the code asynchronously on a worker thread,
+  scheduled by priority and client (see module job_executor).
+
+  Until a worker picks it up the request stays on the DB
+  as accepted but not started (start_processing not set).
+  Raise ServiceBusyException if the job queue is full.
+  """
+
+  job_executor.submit(
+    request_id,
+    __callable_function,
+    {
       'request_id' : request_id,
       'command_line_args': command_line,
       'base_working_dir': base_working_dir,
-    }
+    },
+    priority,
+    client
   )
-  t.start()
 
   return
 
+def run_claimed_request(request_id: str, arguments: list,
+                        worker_id: str) -> None:
+  """
+  Run the code for a request claimed from the DB by the worker process
+  worker_id (distributed execution), with the given arguments after the
+  configured command line, and record the outcome on the DB.
+
+  The start of the request was recorded when claimed. The outcome
+  is recorded only while the worker still holds the request:
+  once its lease is lost, the request belongs to another worker.
+  """
+
+  base_local_file_dir = _get_root_local_file_dir(request_id)
+  os.makedirs(base_local_file_dir, exist_ok=True)
+  try:
+    __run_request(
+      request_id, __command_line + list(arguments), base_local_file_dir,
+      record_start=False, worker_id=worker_id
+    )
+  finally:
+    __notify_completion(request_id)
+
+def check_request_id(request_id) -> None:
+  """
+  Check that the job id is a string usable as name of its working
+  directory (see JOB_ID_PATTERN).
+
+  Raise BaseCustomException if the job id is not acceptable.
+  """
+
+  if (not isinstance(request_id, str)
+      or not JOB_ID_PATTERN.fullmatch(request_id)
+      or request_id in ('.', '..')):
+    raise BaseCustomException(
+      "Job id must be a string of letters, digits, '.', '_' or '-' "
+      "(not '.' or '..')."
+    )
+
 def _get_root_local_file_dir(request_id: str) -> str:
   """
   Get the base directory where to write the files associated to the request.
+
+  Raise BaseCustomException if the directory would not be strictly
+  below file_root_directory.
+  """
+
+  check_request_id(request_id)
+  root_directory = os.path.abspath(__file_root_directory)
+  directory = os.path.abspath(os.path.join(root_directory, request_id))
+  if os.path.dirname(directory) != root_directory:
+    raise BaseCustomException(
+      "Job id '{0}' not usable as directory name.".format(request_id)
+    )
+  return os.path.join(directory, "")
+
+def create_request_directory(request_id: str) -> None:
+  """
+  Create the working directory of a request before its submission,
+  to receive its input files (see open_input_file).
+
+  Raise BaseCustomException if the directory is already present:
+  the job id is already used.
+  """
+
+  try:
+    os.makedirs(_get_root_local_file_dir(request_id))
+  except FileExistsError:
+    raise BaseCustomException(
+      "Job id '{0}' already used.".format(request_id)
+    )
+
+def remove_request_directory(request_id: str) -> None:
   """
+  Remove the working directory created by create_request_directory
+  for a request not accepted, with the input files received.
 
-  return os.path.join(__file_root_directory, request_id, "")
+  Nothing else is removed: the job id may belong to another job.
+  """
+
+  shutil.rmtree(_get_root_local_file_dir(request_id), ignore_errors=True)
+
+def open_input_file(request_id: str, filename: str):
+  """
+  Create an input file in the working directory of the request,
+  named as the file uploaded by the client, made safe.
+  Names already used, including those of the output files,
+  are prefixed with a number.
+
+  Returns the pair (path of the file, file open for binary writing).
+  """
+
+  base_local_file_dir = _get_root_local_file_dir(request_id)
+  name = secure_filename(filename or '') or 'input'
+  taken = set(OUTPUT_STREAMS.values())
+  candidate = name
+  counter = 0
+  while True:
+    path = os.path.join(base_local_file_dir, candidate)
+    if candidate not in taken:
+      try:
+        return path, open(path, 'xb')
+      except FileExistsError:
+        pass
+    counter += 1
+    candidate = "{0}_{1}".format(counter, name)
+
+def __prepare_parameters(string_parameters: "dict[str, str]"):
+  """
+  Returns the parameters as to be saved on the DB
+  and the arguments to pass to the code, after the configured command line.
+
+  List values are saved on the DB joined by spaces,
+  and passed to the code as separate arguments.
+  """
+
+  db_parameters = {}
+  command_line_args = []
+
+  for param_name, param_value in string_parameters.items():
+    if isinstance(param_value, list):
+        db_parameters[param_name] = " ".join(param_value)
+    else:
+        db_parameters[param_name] = param_value
+
+    command_line_args.append(param_name)
+    if isinstance(param_value, list):
+        command_line_args.extend(param_value)
+    else:
+        command_line_args.append(param_value)
+
+  return db_parameters, command_line_args
+
+def __result_key(string_parameters: "dict[str, str]") -> str:
+  """
+  Returns the key identifying the result of a request: the hash
+  of the service, the configured command line, suppress_stdout
+  and the parameters, in order of name.
+  """
+
+  key = json.dumps(
+    [
+      __id_service, __command_line, bool(__suppress_stdout),
+      sorted(string_parameters.items())
+    ],
+    separators=(',', ':')
+  )
+  return hashlib.sha256(key.encode('utf-8')).hexdigest()
 
-def submit_form_request(string_parameters: "dict[str, str]", request_id: str) -> None:
+def __store_reused_outputs(request_id: str, source_id: str,
+                           base_local_file_dir: str) -> dict:
+  """
+  Store, as outputs of the request, the copies in its directory
+  of the outputs of source_id kept in the storage of module output_storage:
+  they remain available when source_id is removed.
+
+  Returns a dictionary stream -> reference (None if not stored there).
+  """
+
+  source_info = get_job_info(source_id) or {}
+  references = {}
+  for stream, file_name in OUTPUT_STREAMS.items():
+    references[stream] = None
+    if source_info.get(stream + '_ref') is None:
+      continue
+    path = os.path.join(base_local_file_dir, file_name)
+    if not os.path.isfile(path):
+      raise FileNotFoundError(path)
+    references[stream] = output_storage.store(request_id, file_name, path)
+  return references
+
+def __reuse_result(request_id: str, result_key: str,
+                   db_parameters: "dict[str, str]",
+                   directory_created: bool = False) -> bool:
+  """
+  Record the request as ended with the result of an identical request
+  ended successfully within the memoization ttl, copying its files
+  to the directory of the request.
+
+  The directory of the request is created here, unless already created
+  by create_request_directory (directory_created): an existing directory
+  belongs to a job with the same id, and BaseCustomException is raised.
+  On failure only what was created here is removed.
+
+  Returns False, with nothing recorded, if there is no such result.
+  """
+
+  with db_utils.get_db_connection() as conn:
+    source_id = db_utils.find_result(
+      conn, __id_service, result_key, __memoization_ttl
+    )
+  if source_id is None:
+    return False
+
+  base_local_file_dir = _get_root_local_file_dir(request_id)
+  try:
+    os.makedirs(base_local_file_dir)
+  except FileExistsError:
+    if not directory_created:
+      raise BaseCustomException(
+        "Job id '{0}' already used.".format(request_id)
+      )
+    if os.listdir(base_local_file_dir):
+      # Input files uploaded: the copies would mix with them.
+      return False
+  references = {}
+  try:
+    # Files first: when the request is recorded as ended they are in place.
+    shutil.copytree(
+      _get_root_local_file_dir(source_id), base_local_file_dir,
+      dirs_exist_ok=True
+    )
+    references = __store_reused_outputs(
+      request_id, source_id, base_local_file_dir
+    )
+    with db_utils.get_db_connection() as conn:
+      reused = db_utils.add_reused_request(
+        conn, __id_service, request_id, db_parameters, source_id,
+        bool(__suppress_stdout), __retention_period,
+        references[STD_OUT_STREAM], references[STD_ERR_STREAM]
+      )
+  except Exception as ex:
+    app.logger.warning(
+      "Result of request {0} not reused. {1}".format(source_id, str(ex))
+    )
+    reused = False
+  if not reused:
+    if any(references.values()):
+      output_storage.delete(request_id)
+    shutil.rmtree(base_local_file_dir, ignore_errors=True)
+    if directory_created:
+      os.makedirs(base_local_file_dir, exist_ok=True)
+    return False
+
+  app.logger.info(
+    "Request {0} served with the result of request {1}.".format(
+      request_id, source_id
+    )
+  )
+  metrics.JOBS_SUBMITTED.inc()
+  metrics.JOBS_REUSED.inc()
+  __notify_completion(request_id)
+  return True
+
+def submit_form_request(string_parameters: "dict[str, str]", request_id: str,
+                        priority: int = 0, client: str = None,
+                        synch_execution: bool = False,
+                        directory_created: bool = False) -> None:
   """
   Accept a request having the parameters as dictionary items.
 
-  If the function fails to record the parameters
-  the request is removed from DB.
-  If the function succeded a separate thread is initialized and started.
+  The request and all its parameters are recorded on the DB
+  in a single transaction: nothing is recorded if it fails.
+  If the function succeded the job is queued to be run by a worker thread;
+  if the queue is full the request is removed from DB and
+  ServiceBusyException is raised.
+  With distributed execution the job is left queued on the DB,
+  to be claimed by a worker process (see run_claimed_request).
+  With memoization enabled, if an identical request ended successfully
+  within the memoization ttl, the request is recorded as ended
+  with its result, without running the code.
+  The job is scheduled by priority (raised for synchronous jobs)
+  and client as described in module job_executor;
+  BaseCustomException is raised if priority is out of range.
+  directory_created tells that the directory of the request was already
+  created by create_request_directory (to receive its input files).
   
   The values  may either be empty (i.e. flag parameters), or strings.
   """
 
-  command_line_args = []
-  command_line_args.extend(__command_line)
+  priority = job_executor.scheduling_priority(priority, synch_execution)
+  db_parameters, arguments = __prepare_parameters(string_parameters)
+  distributed = job_executor.is_distributed()
+
+  result_key = None
+  if __memoization:
+    result_key = __result_key(string_parameters)
+    if __reuse_result(request_id, result_key, db_parameters,
+                      directory_created):
+      return
 
   with db_utils.get_db_connection() as conn:
-    db_utils.add_new_request(conn, __id_service, request_id)
+    db_utils.add_new_request(
+      conn, __id_service, request_id, db_parameters,
+      arguments if distributed else None, result_key, priority, client
+    )
 
-    base_local_file_dir = _get_root_local_file_dir(request_id)
-    if not os.path.exists(base_local_file_dir):
-      os.makedirs(base_local_file_dir)
+  __start_request(request_id, arguments, distributed, priority, client)
+  
+  return
+
+def submit_form_requests(requests: list) -> dict:
+  """
+  Accept a batch of requests, given as list of tuples
+  (request id, parameters as dictionary items, priority, client),
+  run asynchronously.
+
+  The requests not served with a reused result (memoization) are recorded
+  on the DB, with all their parameters, in a single transaction:
+  nothing is recorded if it fails, and the exception is raised.
+  Requests whose id is already used are not recorded.
+  Then the jobs are queued as by submit_form_request: once the queue
+  is full, the remaining requests are removed from DB.
 
+  Returns a dictionary request id -> None if accepted,
+  or the exception (ServiceBusyException if the queue was full)
+  for which it was not: an error reusing a result fails only its request.
+  """
+
+  distributed = job_executor.is_distributed()
+  outcomes = {}
+  new_requests = []
+  for request_id, string_parameters, priority, client in requests:
     try:
-      for param_name, param_value in string_parameters.items():
-        # Save parameters to DB:
-        if isinstance(param_value, list):
-            db_value = " ".join(param_value)
-        else:
-            db_value = param_value
-        db_utils.add_request_parameter(
-            conn, request_id, param_name, db_value
+      priority = job_executor.scheduling_priority(priority, False)
+    except BaseCustomException as ex:
+      outcomes[request_id] = ex
+      continue
+    db_parameters, arguments = __prepare_parameters(string_parameters)
+    result_key = None
+    if __memoization:
+      result_key = __result_key(string_parameters)
+      try:
+        reused = __reuse_result(request_id, result_key, db_parameters)
+      except BaseCustomException as ex:
+        outcomes[request_id] = ex
+        continue
+      except Exception as ex:
+        # As for the other jobs of the batch: reported for this job only.
+        app.logger.error(
+          "Request not submitted. Request id = {0}. {1}".format(
+            request_id, str(ex)
+          ),
+          exc_info=True
         )
+        outcomes[request_id] = ex
+        continue
+      if reused:
+        outcomes[request_id] = None
+        continue
+    new_requests.append(
+      (request_id, db_parameters, arguments if distributed else None,
+       result_key, priority, client, arguments)
+    )
 
-        # Add command line parameters
-        command_line_args.append(param_name)
-        if isinstance(param_value, list):
-            command_line_args.extend(param_value)
-        else:
-            command_line_args.append(param_value)
+  with db_utils.get_db_connection() as conn:
+    inserted = db_utils.add_new_requests(
+      conn, __id_service,
+      [request[:6] for request in new_requests]
+    )
+
+  busy = None
+  for request_id, db_parameters, db_arguments, result_key, priority, \
+      client, arguments in new_requests:
+    if request_id not in inserted:
+      outcomes[request_id] = BaseCustomException(
+        "Job id '{0}' already used.".format(request_id)
+      )
+      continue
+    if busy is not None:
+      # The queue is full: the following jobs would not fit either.
+      __abort_request(request_id)
+      outcomes[request_id] = busy
+      continue
+    try:
+      __start_request(request_id, arguments, distributed, priority, client)
+      outcomes[request_id] = None
+    except ServiceBusyException as ex:
+      busy = ex
+      outcomes[request_id] = ex
     except Exception as ex:
+      outcomes[request_id] = ex
+
+  return outcomes
+
+def __start_request(request_id: str, arguments: list, distributed: bool,
+                    priority: int = 0, client: str = None) -> None:
+  """
+  Create the directory of a request recorded on the DB and queue its job
+  (unless left on the DB for the workers, with distributed execution).
+
+  On failure the request is removed from the DB and the exception raised.
+  """
+
+  base_local_file_dir = _get_root_local_file_dir(request_id)
+  try:
+    if not os.path.exists(base_local_file_dir):
+      os.makedirs(base_local_file_dir)
+    if not distributed:
+      __submit_request(
+        request_id, __command_line + arguments, base_local_file_dir,
+        priority, client
+      )
+    metrics.JOBS_SUBMITTED.inc()
+  except Exception as ex:
+    if not isinstance(ex, ServiceBusyException):
       app.logger.error(
         "Request not completely submitted: aborting. " + str(ex)
       )
-      db_utils.abort_request(conn, request_id)
-      raise ex
-        
-  __submit_request(request_id, command_line_args, base_local_file_dir)
-  
-  return
+    __abort_request(request_id)
+    raise
+
+def __abort_request(request_id: str) -> None:
+  """
+  Remove from the DB a request recorded but not queued,
+  with its (empty) directory.
+  """
+
+  with db_utils.get_db_connection() as conn:
+    db_utils.abort_request(conn, request_id)
+  __invalidate_cache(request_id)
+  try:
+    os.rmdir(_get_root_local_file_dir(request_id))
+  except OSError:
+    pass
+
+def wait_for_completion(request_id: str, timeout: float = None) -> bool:
+  """
+  Block until the job ends, or timeout seconds have elapsed.
+
+  The thread is woken up as soon as the job run by this process ends;
+  with completion_listener enabled, also when a PostgreSQL notification
+  announces the end of a job run by any other process.
+  As a safety net the status on the DB is checked again every
+  completion_recheck_interval seconds.
+
+  Returns True if the job ended (or is not present on the DB),
+  False on timeout.
+  """
+
+  deadline = None if timeout is None else time.monotonic() + timeout
+  with __completion_event(request_id) as event:
+    while True:
+      # Checked after registering and clearing the event:
+      # an end occurring from now on sets the event.
+      event.clear()
+      if __job_ended(request_id):
+        return True
+
+      wait_time = __completion_recheck_interval
+      if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          return False
+        wait_time = min(wait_time, remaining)
+      event.wait(wait_time)
+
+async def async_wait_for_completion(request_id: str,
+                                    timeout: float = None) -> bool:
+  """
+  Coroutine equivalent to wait_for_completion():
+  waiting costs a coroutine instead of a thread.
+
+  The short DB queries checking the job status run in
+  the default executor of the event loop.
+  """
+
+  deadline = None if timeout is None else time.monotonic() + timeout
+  with __completion_event(request_id, _AsyncioEvent()) as event:
+    while True:
+      event.clear()
+      if await asyncio.to_thread(__job_ended, request_id):
+        return True
+
+      wait_time = __completion_recheck_interval
+      if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          return False
+        wait_time = min(wait_time, remaining)
+      await event.wait(wait_time)
+
+def follow_output(request_id: str, stream: str, offset: int = 0):
+  """
+  Generator of the output of the job, from byte offset on,
+  as it is written by the code.
+
+  stream is one of OUTPUT_STREAMS. Yields pairs (offset, data), where
+  offset is the position in the output just after the bytes in data.
+  The generator ends when the job has ended and all its output was yielded.
+
+  The output file is checked for new data every OUTPUT_POLL_INTERVAL
+  seconds; the DB is queried only to know when the job ends
+  (see wait_for_completion).
+  """
+
+  file_path = os.path.join(
+    _get_root_local_file_dir(request_id), OUTPUT_STREAMS[stream]
+  )
+  output_file = None
+  with __completion_event(request_id) as event:
+    try:
+      ended = __job_ended(request_id)
+      last_check = time.monotonic()
+      while True:
+        if output_file is None and os.path.exists(file_path):
+          output_file = open(file_path, 'rb')
+          output_file.seek(offset)
+        if output_file is not None:
+          while True:
+            data = output_file.read(OUTPUT_CHUNK_SIZE)
+            if not data:
+              break
+            offset += len(data)
+            yield offset, data
+        if ended:
+          return
+
+        # A wake-up is not always the end of this job (e.g. listener
+        # reconnection): the DB is checked again, as by wait_for_completion.
+        woken = event.wait(OUTPUT_POLL_INTERVAL)
+        if (woken or
+            time.monotonic() - last_check > __completion_recheck_interval):
+          event.clear()
+          ended = __job_ended(request_id)
+          last_check = time.monotonic()
+    finally:
+      if output_file is not None:
+        output_file.close()
+
+def get_output_file(request_id: str, stream: str):
+  """
+  Returns the full output ('std_out' or 'std_err') of an ended job:
+  from the storage of module output_storage if stored there,
+  otherwise from the job directory.
+  The output is returned as path on the local file system or,
+  if not a local file, as binary file object open for reading.
+
+  Returns None if the job is not present, not ended, or its output
+  is no more available.
+  """
+
+  job_info = get_job_info(request_id)
+  if job_info is None or job_info['end_processing'] is None:
+    return None
+
+  reference = job_info[stream + '_ref']
+  if reference is not None:
+    try:
+      return output_storage.get_output(reference)
+    except FileNotFoundError:
+      return None
+
+  path = os.path.join(
+    _get_root_local_file_dir(request_id), OUTPUT_STREAMS[stream]
+  )
+  return path if os.path.isfile(path) else None
+
+def is_output_available(stream: str) -> bool:
+  """
+  Returns False for the standard output when it is suppressed
+  by configuration (suppress_stdout).
+  """
+
+  return not (stream == STD_OUT_STREAM and __suppress_stdout)
+
+def __entry_size(entry) -> int:
+  """
+  Approximate size in bytes of a job_info row, for the cache.
+  """
+
+  return sum(
+    len(value) if isinstance(value, str) else 64 for value in entry.values()
+  ) + sum(
+    len(name) + len(value) for name, value in entry['parameters'].items()
+  )
+
+def __invalidate_cache(request_id: str) -> None:
+  """
+  Remove the cached information on the request.
+  """
+
+  __job_info_cache.invalidate(request_id)
 
 def get_request_parameters(request_id: str):
   """
@@ -247,12 +1283,19 @@ def get_request_parameters(request_id: str):
 
 def get_job_info(request_id: str):
   """
-  Returns a dictionary with job specific information.
+  Returns a dictionary with job specific information,
+  including the request parameters as dictionary under key 'parameters'.
 
   If the id_request is not present on the DB for this code,
   then returns None.
+
+  Information on ended jobs never change: they are cached.
   """
   
+  job_info = __job_info_cache.get(request_id)
+  if job_info is not None:
+    return job_info
+
   with db_utils.get_db_connection() as conn:
     job_info = db_utils.get_job_info(conn, request_id)
 
@@ -264,6 +1307,123 @@ def get_job_info(request_id: str):
       )
     )
     return None
-  else:
-    return job_info
 
+  if job_info:
+    job_info = dict(job_info)
+    if job_info['end_processing'] is not None:
+      __job_info_cache.put(request_id, job_info, __entry_size(job_info))
+  return job_info
+
+def get_jobs_info(ids: list = None, status: str = None,
+                  received_since=None, include_output: bool = True,
+                  limit: int = 1000) -> list:
+  """
+  Returns a list of dictionaries with job specific information,
+  as get_job_info plus key 'id', for the jobs of the service selected
+  as described for db_utils.get_jobs_info, with a single query.
+
+  Without include_output, keys std_out and std_err are not present.
+  """
+
+  with db_utils.get_db_connection() as conn:
+    jobs_info = db_utils.get_jobs_info(
+      conn, __id_service, ids, status, received_since, include_output, limit
+    )
+
+  if include_output:
+    for job_info in jobs_info:
+      if job_info['end_processing'] is not None:
+        entry = dict(job_info)
+        del entry['id']
+        __job_info_cache.put(job_info['id'], entry, __entry_size(entry))
+  return jobs_info
+
+def cancel_request(request_id: str):
+  """
+  Cancel a job not yet ended.
+
+  A queued job is recorded as ended without running its code.
+  The code of a running job is terminated, with all its children,
+  by the process running it: its end is recorded when the code ends.
+
+  Returns 'queued' or 'running' according to the state of the cancelled
+  job, None if the job is not present on the DB for this code
+  or already ended.
+  """
+
+  job_info = get_job_info(request_id)
+  if job_info is None or job_info['end_processing'] is not None:
+    return None
+
+  with db_utils.get_db_connection() as conn:
+    state = db_utils.record_cancelled_request(
+      conn, request_id, "Job cancelled before start.", __retention_period
+    )
+
+  if state == 'queued':
+    __notify_completion(request_id)
+  elif state == 'running':
+    # Without the listener, only codes running in this process
+    # can be terminated.
+    process_runner.terminate(request_id)
+  return state
+
+def end_abandoned_requests() -> list:
+  """
+  Record as ended the cancelled jobs whose worker process stopped
+  (distributed execution) before recording their end.
+
+  Returns the list of the ids of the jobs ended.
+  """
+
+  with db_utils.get_db_connection() as conn:
+    ended = db_utils.end_abandoned_requests(
+      conn, __id_service, "Job cancelled: its worker stopped.",
+      __retention_period
+    )
+  for request_id in ended:
+    __notify_completion(request_id)
+  return ended
+
+def get_id_service() -> str:
+  """
+  Returns the identification of the service on the DB.
+  """
+
+  return __id_service
+
+def remove_request_files(request_id: str) -> int:
+  """
+  Remove the working directory of a request removed from the DB,
+  and forget any cached information on it.
+
+  Returns the number of bytes freed on disk.
+  """
+
+  __invalidate_cache(request_id)
+
+  try:
+    base_local_file_dir = _get_root_local_file_dir(request_id)
+  except BaseCustomException as ex:
+    app.logger.warning(
+      "Files of request {0!r} not removed. {1}".format(request_id, str(ex))
+    )
+    return 0
+  freed_bytes = __directory_size(base_local_file_dir)
+  shutil.rmtree(base_local_file_dir, ignore_errors=True)
+  freed_bytes += output_storage.delete(request_id)
+  return freed_bytes
+
+def get_cache_statistics() -> dict:
+  """
+  Returns the usage counters of the cache of job information.
+  """
+
+  return __job_info_cache.get_statistics()
+
+def get_cache_ttl() -> float:
+  """
+  Returns the time to live, in seconds, of the cached job information.
+  """
+
+  return __job_info_cache_ttl
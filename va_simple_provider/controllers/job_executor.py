@@ -0,0 +1,405 @@
+"""
+    Run the submitted jobs on a bounded pool of worker threads.
+
+    On initialization the module is configured using parameters
+    in file application.ini, section 'executor' (optional).
+
+    At most max_concurrent_jobs jobs run at the same time;
+    further jobs wait in a queue of at most max_queued_jobs entries.
+    When the queue is full a new job is either rejected at once
+    (policy 'reject') or waits for a free place up to
+    queue_wait_timeout seconds (policy 'wait').
+
+    A free worker takes the queued job of highest priority; at equal
+    priority the job of the client with fewer running jobs (fair share),
+    then the oldest one. Synchronous jobs get synch_priority_boost more
+    than their priority, to overtake batch work. A client (jobs
+    without client excluded) runs at most max_running_jobs_per_client
+    jobs at the same time: its further jobs wait even if workers are free.
+
+    With distributed set, jobs are not run by this process:
+    they are queued on the DB and run by the worker processes
+    (module va_simple_provider.worker), possibly on other hosts.
+"""
+
+import os
+import time
+import heapq
+import itertools
+import threading
+
+from va_simple_provider import app, configuration_directory
+from va_simple_provider import config
+from va_simple_provider import metrics
+from va_simple_provider.custom_exceptions import AppCustomException
+from va_simple_provider.custom_exceptions import BaseCustomException
+from va_simple_provider.custom_exceptions import ServiceBusyException
+
+REJECT_POLICY = 'reject'
+WAIT_POLICY = 'wait'
+
+__max_concurrent_jobs = None
+__max_queued_jobs = None
+__queue_full_policy = None
+__queue_wait_timeout = None
+__distributed = None
+__max_priority = None
+__synch_priority_boost = None
+__max_running_jobs_per_client = None
+
+__workers = []
+__workers_lock = threading.Lock()
+# Queued jobs: client -> heap of
+# (-priority, sequence number, request id, function, kwargs, queued time).
+__queued_jobs = {}
+__queued_count = 0
+__job_sequence = itertools.count()
+# Running jobs, in total and by client.
+__running_jobs = 0
+__running_by_client = {}
+# Guards the queued and running jobs; notified when they change.
+__scheduler = threading.Condition()
+
+def __queued_job_count() -> int:
+  return __queued_count
+
+def __config():
+  """
+  Set the private internal parameters for the whole module.
+
+  The following parameters are read from file 'application.ini',
+  section 'executor' (all optional):
+    max_concurrent_jobs (default: number of CPUs)
+    max_queued_jobs (default: 100)
+    queue_full_policy (default: reject)
+    queue_wait_timeout (default: 10 seconds)
+    distributed (default: False)
+    max_priority (default: 10)
+    synch_priority_boost (default: 1)
+    max_running_jobs_per_client (default: not set, no limit)
+  """
+
+  filename = os.path.join(configuration_directory, 'application.ini')
+  section = 'executor'
+
+  global __max_concurrent_jobs
+  max_concurrent_jobs_key = 'max_concurrent_jobs'
+
+  global __max_queued_jobs
+  max_queued_jobs_key = 'max_queued_jobs'
+
+  global __queue_full_policy
+  queue_full_policy_key = 'queue_full_policy'
+
+  global __queue_wait_timeout
+  queue_wait_timeout_key = 'queue_wait_timeout'
+
+  global __distributed
+  distributed_key = 'distributed'
+
+  global __max_priority
+  max_priority_key = 'max_priority'
+
+  global __synch_priority_boost
+  synch_priority_boost_key = 'synch_priority_boost'
+
+  global __max_running_jobs_per_client
+  max_running_jobs_per_client_key = 'max_running_jobs_per_client'
+
+  parser = config.get_application()
+
+  section_parameters = {}
+  if parser.has_section(section):
+    for param in parser.items(section):
+      section_parameters[param[0]] = param[1]
+
+  try:
+    __max_concurrent_jobs = int(
+      section_parameters.get(max_concurrent_jobs_key, os.cpu_count() or 1)
+    )
+    __max_queued_jobs = int(
+      section_parameters.get(max_queued_jobs_key, 100)
+    )
+    __queue_wait_timeout = float(
+      section_parameters.get(queue_wait_timeout_key, 10)
+    )
+  except ValueError:
+    raise AppCustomException(
+      "Parameters '{0}', '{1}', '{2}' in section '{3}' in file '{4}' "
+      "must be numbers.".format(
+        max_concurrent_jobs_key, max_queued_jobs_key, queue_wait_timeout_key,
+        section, os.path.abspath(filename)
+      )
+    )
+  if __max_concurrent_jobs < 1 or __max_queued_jobs < 0:
+    raise AppCustomException(
+      "Parameter '{0}' must be at least 1 and '{1}' at least 0 "
+      "in section '{2}' in file '{3}'.".format(
+        max_concurrent_jobs_key, max_queued_jobs_key,
+        section, os.path.abspath(filename)
+      )
+    )
+
+  __queue_full_policy = section_parameters.get(
+    queue_full_policy_key, REJECT_POLICY
+  ).strip()
+  if __queue_full_policy not in (REJECT_POLICY, WAIT_POLICY):
+    raise AppCustomException(
+      "Parameter '{0}' in section '{1}' in file '{2}' "
+      "must be either '{3}' or '{4}'.".format(
+        queue_full_policy_key, section, os.path.abspath(filename),
+        REJECT_POLICY, WAIT_POLICY
+      )
+    )
+
+  try:
+    __distributed = parser.getboolean(
+      section, distributed_key, fallback=False
+    )
+  except ValueError:
+    raise AppCustomException(
+      "Parameter '{0}' in section '{1}' in file '{2}' "
+      "must be a boolean.".format(
+        distributed_key, section, os.path.abspath(filename)
+      )
+    )
+
+  try:
+    __max_priority = parser.getint(section, max_priority_key, fallback=10)
+    __synch_priority_boost = parser.getint(
+      section, synch_priority_boost_key, fallback=1
+    )
+    __max_running_jobs_per_client = parser.getint(
+      section, max_running_jobs_per_client_key, fallback=None
+    )
+  except ValueError:
+    raise AppCustomException(
+      "Parameters '{0}', '{1}', '{2}' in section '{3}' in file '{4}' "
+      "must be integers.".format(
+        max_priority_key, synch_priority_boost_key,
+        max_running_jobs_per_client_key, section, os.path.abspath(filename)
+      )
+    )
+  if (__max_priority < 0 or __synch_priority_boost < 0
+      or (__max_running_jobs_per_client is not None
+          and __max_running_jobs_per_client < 1)):
+    raise AppCustomException(
+      "Parameters '{0}', '{1}' must be at least 0 and '{2}' at least 1 "
+      "in section '{3}' in file '{4}'.".format(
+        max_priority_key, synch_priority_boost_key,
+        max_running_jobs_per_client_key, section, os.path.abspath(filename)
+      )
+    )
+
+  # Jobs handed to a worker are no more queued:
+  # only jobs accepted but not started are counted.
+  metrics.QUEUED_JOBS.set_function(__queued_job_count)
+
+  return
+__config()
+
+def __reload_config():
+  __config()
+  # More workers, or other limits per client, may run the queued jobs.
+  if __workers:
+    __start_workers()
+  with __scheduler:
+    __scheduler.notify_all()
+config.on_reload(__reload_config)
+
+def __next_job():
+  """
+  Remove from the queue and return the next job to run, as described
+  in the module documentation, or None if no job may run now.
+  To be called holding __scheduler.
+  """
+
+  global __queued_count
+
+  # Fewer workers may run jobs after a reload of the configuration.
+  if __running_jobs >= __max_concurrent_jobs:
+    return None
+
+  next_client = None
+  next_key = None
+  for client, jobs in __queued_jobs.items():
+    running = __running_by_client.get(client, 0)
+    if (client is not None and __max_running_jobs_per_client
+        and running >= __max_running_jobs_per_client):
+      continue
+    # Priority, running jobs of the client, order of arrival.
+    key = (jobs[0][0], running, jobs[0][1])
+    if next_key is None or key < next_key:
+      next_client, next_key = client, key
+  if next_key is None:
+    return None
+
+  jobs = __queued_jobs[next_client]
+  job = heapq.heappop(jobs)
+  if not jobs:
+    del __queued_jobs[next_client]
+  __queued_count -= 1
+  return next_client, job
+
+def __worker_loop():
+  """
+  Body of each worker thread: run queued jobs one at a time, forever.
+
+  While running a job the thread takes the request id as name,
+  so that log lines are associated to the job.
+  """
+
+  global __running_jobs
+  worker_name = threading.current_thread().name
+
+  while True:
+    with __scheduler:
+      next_job = __next_job()
+      while next_job is None:
+        __scheduler.wait()
+        next_job = __next_job()
+      client, (_, _, request_id, function, kwargs, queued_time) = next_job
+      __running_jobs += 1
+      __running_by_client[client] = __running_by_client.get(client, 0) + 1
+      # A place in the queue is free.
+      __scheduler.notify_all()
+    metrics.JOB_QUEUE_WAIT_SECONDS.observe(time.monotonic() - queued_time)
+    threading.current_thread().name = request_id
+    try:
+      function(**kwargs)
+    except Exception as ex:
+      app.logger.error(
+        "Job terminated with unexpected error. Request id = {0}. {1}".format(
+          request_id, str(ex)
+        ),
+        exc_info=True
+      )
+    finally:
+      threading.current_thread().name = worker_name
+      with __scheduler:
+        __running_jobs -= 1
+        __running_by_client[client] -= 1
+        if not __running_by_client[client]:
+          del __running_by_client[client]
+        # Jobs of the client may run now.
+        __scheduler.notify_all()
+
+def __start_workers() -> None:
+  """
+  Start the worker threads, at first use.
+  """
+
+  with __workers_lock:
+    while len(__workers) < __max_concurrent_jobs:
+      t = threading.Thread(
+        target=__worker_loop,
+        name='job-worker-{0}'.format(len(__workers)),
+        daemon=True
+      )
+      t.start()
+      __workers.append(t)
+
+def submit(request_id: str, function, kwargs: dict,
+           priority: int = 0, client: str = None) -> None:
+  """
+  Place the job on the queue, to be run as function(**kwargs)
+  by a free worker, according to its priority and client
+  (see scheduling_priority).
+
+  Raise ServiceBusyException if the queue is full
+  (after waiting, with policy 'wait').
+  """
+
+  global __queued_count
+
+  __start_workers()
+
+  job = (
+    -priority, next(__job_sequence), request_id, function, kwargs,
+    time.monotonic()
+  )
+  with __scheduler:
+    if __max_queued_jobs == 0:
+      # No queue: accept only if there is a free worker right now.
+      accepted = (
+        (__running_jobs + __queued_count) < __max_concurrent_jobs
+      )
+    elif __queue_full_policy == WAIT_POLICY:
+      accepted = __scheduler.wait_for(
+        lambda: __queued_job_count() < __max_queued_jobs,
+        timeout=__queue_wait_timeout
+      )
+    else:
+      accepted = __queued_count < __max_queued_jobs
+    if accepted:
+      heapq.heappush(__queued_jobs.setdefault(client, []), job)
+      __queued_count += 1
+      __scheduler.notify_all()
+
+  if not accepted:
+    metrics.JOBS_REJECTED.inc()
+    app.logger.warning(
+      "Job queue full: request id '{0}' rejected.".format(request_id)
+    )
+    raise ServiceBusyException(
+      "Too many jobs in progress: please retry later."
+    )
+
+def scheduling_priority(priority: int, synch_execution: bool) -> int:
+  """
+  Returns the priority with which a job is scheduled: the priority
+  requested (from 0, the default, to max_priority), plus
+  synch_priority_boost for synchronous jobs.
+
+  Raise BaseCustomException if priority is out of range.
+  """
+
+  if not 0 <= priority <= __max_priority:
+    raise BaseCustomException(
+      "Priority must be an integer from 0 to {0}.".format(__max_priority)
+    )
+  return priority + (__synch_priority_boost if synch_execution else 0)
+
+def is_distributed() -> bool:
+  """
+  Returns True if the jobs are run by the worker processes
+  claiming them from the DB, instead of by this process.
+  """
+
+  return __distributed
+
+def get_max_concurrent_jobs() -> int:
+  """
+  Returns the maximum number of codes running at the same time.
+  """
+
+  return __max_concurrent_jobs
+
+def get_max_running_jobs_per_client():
+  """
+  Returns the maximum number of jobs of a client running
+  at the same time, or None if not limited.
+  """
+
+  return __max_running_jobs_per_client
+
+def get_statistics() -> dict:
+  """
+  Returns a dictionary with the number of running and queued jobs,
+  of the clients having any, and the configured limits.
+  """
+
+  with __scheduler:
+    running_jobs = __running_jobs
+    queued_jobs = __queued_count
+    clients = len(set(__running_by_client) | set(__queued_jobs))
+  return {
+    'running_jobs': running_jobs,
+    'queued_jobs': queued_jobs,
+    'clients': clients,
+    'max_concurrent_jobs': __max_concurrent_jobs,
+    'max_queued_jobs': __max_queued_jobs,
+    'max_running_jobs_per_client': __max_running_jobs_per_client,
+    'queue_full_policy': __queue_full_policy,
+    'distributed': __distributed,
+  }
@@ -0,0 +1,230 @@
+"""
+    Store the outputs of the jobs too large to be kept on the DB.
+
+    On initialization the module is configured using parameters
+    in file application.ini, section 'storage' (optional).
+
+    Standard output and error larger than threshold bytes are not
+    stored on the DB: they are handed to the storage backend, and only
+    the reference returned by the backend is stored on the DB
+    (with the size of the output).
+    With threshold not set all the outputs are stored on the DB.
+
+    The backend is either 'local' (LocalFileStorage, files under
+    directory, by default file_root_directory of section 'executable':
+    the job directories themselves) or the path 'package.module:Class'
+    of a subclass of OutputStorage, created as Class(**options) with
+    the other parameters of the section.
+"""
+
+import os
+import shutil
+import importlib
+
+from abc import ABC, abstractmethod
+
+from va_simple_provider import app, configuration_directory
+from va_simple_provider import config
+from va_simple_provider.custom_exceptions import AppCustomException
+
+LOCAL_BACKEND = 'local'
+
+__storage = None
+__threshold = None
+
+class OutputStorage(ABC):
+  """
+  Interface of the storage backends.
+  """
+
+  @abstractmethod
+  def store(self, request_id: str, name: str, path: str) -> str:
+    """
+    Store the file at path as output name of the request.
+
+    Returns the reference to the stored output, to be kept on the DB.
+    """
+
+  @abstractmethod
+  def open(self, reference: str):
+    """
+    Returns the stored output as binary file object, open for reading.
+
+    Raise FileNotFoundError if the output is not present.
+    """
+
+  def path(self, reference: str):
+    """
+    Returns the path of the stored output on the local file system,
+    or None if it is not a local file (then open() is used).
+    """
+    return None
+
+  @abstractmethod
+  def delete(self, request_id: str) -> int:
+    """
+    Remove all the outputs stored for the request.
+
+    Returns the number of bytes freed.
+    """
+
+class LocalFileStorage(OutputStorage):
+  """
+  Outputs stored as files directory/<request id>/<name>.
+
+  With directory the file_root_directory of the jobs the outputs
+  written by the code are already in place: they are not copied.
+  """
+
+  def __init__(self, directory: str):
+    self._directory = os.path.abspath(directory)
+
+  def __path(self, reference: str) -> str:
+    path = os.path.abspath(os.path.join(self._directory, reference))
+    if (path == self._directory
+        or os.path.commonpath([path, self._directory]) != self._directory):
+      raise FileNotFoundError(reference)
+    return path
+
+  def store(self, request_id: str, name: str, path: str) -> str:
+    reference = os.path.join(request_id, name)
+    target = self.__path(reference)
+    if os.path.abspath(path) != target:
+      os.makedirs(os.path.dirname(target), exist_ok=True)
+      shutil.copyfile(path, target)
+    return reference
+
+  def open(self, reference: str):
+    return open(self.__path(reference), 'rb')
+
+  def path(self, reference: str):
+    return self.__path(reference)
+
+  def delete(self, request_id: str) -> int:
+    request_directory = self.__path(request_id)
+    freed_bytes = 0
+    for dir_path, dir_names, file_names in os.walk(request_directory):
+      for file_name in file_names:
+        try:
+          freed_bytes += os.lstat(os.path.join(dir_path, file_name)).st_size
+        except OSError:
+          pass
+    shutil.rmtree(request_directory, ignore_errors=True)
+    return freed_bytes
+
+def __config():
+  """
+  Set the private internal parameters for the whole module.
+
+  The following parameters are read from file 'application.ini',
+  section 'storage' (all optional):
+    threshold (default: not set, outputs always stored on the DB)
+    backend (default: local)
+    directory (backend local only,
+               default: file_root_directory of section 'executable')
+  Any other parameter is passed to the constructor of a custom backend.
+  """
+
+  filename = os.path.join(configuration_directory, 'application.ini')
+  section = 'storage'
+
+  global __threshold
+  threshold_key = 'threshold'
+
+  global __storage
+  backend_key = 'backend'
+  directory_key = 'directory'
+
+  parser = config.get_application()
+
+  section_parameters = {}
+  if parser.has_section(section):
+    for param in parser.items(section):
+      section_parameters[param[0]] = param[1]
+
+  try:
+    __threshold = parser.getint(section, threshold_key, fallback=None)
+  except ValueError:
+    raise AppCustomException(
+      "Parameter '{0}' in section '{1}' in file '{2}' "
+      "must be an integer.".format(
+        threshold_key, section, os.path.abspath(filename)
+      )
+    )
+
+  backend = section_parameters.pop(backend_key, LOCAL_BACKEND).strip()
+  section_parameters.pop(threshold_key, None)
+  if backend == LOCAL_BACKEND:
+    directory = section_parameters.get(
+      directory_key, parser.get('executable', 'file_root_directory')
+    )
+    __storage = LocalFileStorage(directory)
+  else:
+    try:
+      module_name, class_name = backend.split(':')
+      backend_class = getattr(importlib.import_module(module_name), class_name)
+      __storage = backend_class(**section_parameters)
+    except Exception as ex:
+      raise AppCustomException(
+        "Storage backend '{0}' of section '{1}' in file '{2}' "
+        "not available: {3}".format(
+          backend, section, os.path.abspath(filename), str(ex)
+        )
+      )
+    if not isinstance(__storage, OutputStorage):
+      raise AppCustomException(
+        "Storage backend '{0}' is not an OutputStorage.".format(backend)
+      )
+
+  return
+__config()
+config.on_reload(__config)
+
+def is_to_store(size: int) -> bool:
+  """
+  Returns True if an output of size bytes is to be handed
+  to the storage backend instead of being stored on the DB.
+  """
+
+  return __threshold is not None and size > __threshold
+
+def store(request_id: str, name: str, path: str) -> str:
+  """
+  Store the file at path as output name of the request.
+
+  Returns the reference to the stored output, to be kept on the DB.
+  """
+
+  return __storage.store(request_id, name, path)
+
+def get_output(reference: str):
+  """
+  Returns the stored output as path on the local file system
+  or, if not a local file, as binary file object open for reading.
+
+  Raise FileNotFoundError if the output is not present.
+  """
+
+  path = __storage.path(reference)
+  if path is not None:
+    if not os.path.isfile(path):
+      raise FileNotFoundError(reference)
+    return path
+  return __storage.open(reference)
+
+def delete(request_id: str) -> int:
+  """
+  Remove all the outputs stored for the request.
+
+  Returns the number of bytes freed.
+  """
+
+  try:
+    return __storage.delete(request_id)
+  except Exception as ex:
+    app.logger.error(
+      "Stored outputs of request {0} not removed. {1}".format(
+        request_id, str(ex)
+      )
+    )
+    return 0
@@ -0,0 +1,344 @@
+"""
+    Run the code as a subprocess, within the configured resource limits,
+    and measure the resources it used.
+
+    On initialization the module is configured using parameters
+    in file application.ini, section 'limits' (optional).
+
+    Limits applied to the code (and inherited by its children):
+    -) limit_cpu_time: CPU seconds (RLIMIT_CPU);
+    -) limit_memory: bytes of address space (RLIMIT_AS);
+    -) limit_file_size: bytes of any file written, outputs included
+       (RLIMIT_FSIZE);
+    -) wall_clock_timeout: seconds after which the whole process group
+       of the code receives SIGTERM and, kill_grace_period seconds later,
+       SIGKILL;
+    -) nice: scheduling priority increment (not negative);
+    -) cpu_affinity: CPUs the code may run on, e.g. '0-3,6'.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import resource
+import threading
+import subprocess
+
+from contextlib import contextmanager
+
+from va_simple_provider import app, configuration_directory
+from va_simple_provider import config
+from va_simple_provider.custom_exceptions import AppCustomException
+
+__rlimits = None
+__wall_clock_timeout = None
+__kill_grace_period = None
+__nice = None
+__cpu_affinity = None
+
+# Codes running in this process:
+# request id -> (Popen, event set at the end of the code,
+#                event set when the code is terminated by terminate()).
+__processes = {}
+# Requests to terminate whose code was not yet started:
+# request id -> time of the request.
+__pending_terminations = {}
+__processes_lock = threading.Lock()
+# Seconds a pending termination is kept waiting for its code to start.
+PENDING_TERMINATION_TIMEOUT = 60
+# Script applying the limits before executing the code
+# (a preexec_fn is not safe in a program running many threads).
+LIMITS_TRAMPOLINE = os.path.join(
+  os.path.dirname(os.path.abspath(__file__)), '_limits.py'
+)
+
+def __parse_cpu_list(cpu_list: str) -> set:
+  """
+  Returns the set of CPUs in a list like '0-3,6'.
+  """
+
+  cpus = set()
+  for item in cpu_list.split(','):
+    item = item.strip()
+    if '-' in item:
+      first, last = item.split('-')
+      cpus.update(range(int(first), int(last) + 1))
+    elif item:
+      cpus.add(int(item))
+  return cpus
+
+def __config():
+  """
+  Set the private internal parameters for the whole module.
+
+  The following parameters are read from file 'application.ini',
+  section 'limits' (all optional, not set means no limit):
+    limit_cpu_time
+    limit_memory
+    limit_file_size
+    wall_clock_timeout
+    kill_grace_period (default: 10 seconds)
+    nice
+    cpu_affinity
+  """
+
+  filename = os.path.join(configuration_directory, 'application.ini')
+  section = 'limits'
+
+  global __rlimits
+  rlimit_keys = {
+    'limit_cpu_time': resource.RLIMIT_CPU,
+    'limit_memory': resource.RLIMIT_AS,
+    'limit_file_size': resource.RLIMIT_FSIZE,
+  }
+
+  global __wall_clock_timeout
+  wall_clock_timeout_key = 'wall_clock_timeout'
+
+  global __kill_grace_period
+  kill_grace_period_key = 'kill_grace_period'
+
+  global __nice
+  nice_key = 'nice'
+
+  global __cpu_affinity
+  cpu_affinity_key = 'cpu_affinity'
+
+  parser = config.get_application()
+
+  try:
+    __rlimits = {}
+    for key, rlimit in rlimit_keys.items():
+      value = parser.getint(section, key, fallback=None)
+      if value is not None:
+        __rlimits[rlimit] = value
+    __wall_clock_timeout = parser.getfloat(
+      section, wall_clock_timeout_key, fallback=None
+    )
+    __kill_grace_period = parser.getfloat(
+      section, kill_grace_period_key, fallback=10.0
+    )
+    __nice = parser.getint(section, nice_key, fallback=None)
+    if __nice is not None and __nice < 0:
+      # A negative increment requires privileges: every job would fail.
+      raise ValueError(nice_key)
+    cpu_list = parser.get(section, cpu_affinity_key, fallback=None)
+    __cpu_affinity = __parse_cpu_list(cpu_list) if cpu_list else None
+  except ValueError:
+    raise AppCustomException(
+      "Parameters in section '{0}' in file '{1}' must be integers "
+      "('{2}', '{3}': numbers; '{4}': list like 0-3,6; "
+      "'{5}': not negative).".format(
+        section, os.path.abspath(filename),
+        wall_clock_timeout_key, kill_grace_period_key, cpu_affinity_key,
+        nice_key
+      )
+    )
+
+  return
+__config()
+config.on_reload(__config)
+
+def __terminate_group(process, finished: threading.Event) -> None:
+  """
+  Send SIGTERM to the process group of the code, and SIGKILL
+  if it is still running after kill_grace_period seconds.
+  """
+
+  for sig in (signal.SIGTERM, signal.SIGKILL):
+    try:
+      os.killpg(process.pid, sig)
+    except ProcessLookupError:
+      return
+    if finished.wait(__kill_grace_period):
+      return
+
+def terminate(request_id: str, pending: bool = True) -> bool:
+  """
+  Terminate the code run for the request, with all its children:
+  SIGTERM, then SIGKILL after kill_grace_period seconds.
+
+  Returns False if no code is running for the request in this process.
+  In this case, with pending True, the code is terminated as soon as
+  it is started (within PENDING_TERMINATION_TIMEOUT seconds).
+  """
+
+  with __processes_lock:
+    running = __processes.get(request_id)
+    if running is None:
+      if pending:
+        now = time.monotonic()
+        for expired_id in [
+            pending_id for pending_id, pending_time
+            in __pending_terminations.items()
+            if now - pending_time > PENDING_TERMINATION_TIMEOUT]:
+          del __pending_terminations[expired_id]
+        __pending_terminations[request_id] = now
+      return False
+
+  process, finished, terminated = running
+  terminated.set()
+  threading.Thread(
+    target=__terminate_group, args=(process, finished),
+    name='terminate-' + request_id, daemon=True
+  ).start()
+  return True
+
+def start_process(command_line: list, cwd: str, stdout, stderr,
+                  stdin=None, cpu_time_limit: bool = True):
+  """
+  Start the code within the configured limits, as the leader of
+  a new process group, so that all its children can be signalled together.
+
+  The limits are applied by the trampoline LIMITS_TRAMPOLINE, which
+  then executes the code in place: they hold from its first instruction.
+  With cpu_time_limit False limit_cpu_time is not applied
+  (to processes running many jobs, see module warm_pool).
+
+  Returns the Popen of the code.
+  """
+
+  rlimits = __rlimits
+  if not cpu_time_limit:
+    rlimits = {
+      rlimit: value for rlimit, value in __rlimits.items()
+      if rlimit != resource.RLIMIT_CPU
+    }
+
+  if rlimits or __nice or __cpu_affinity:
+    limits = {
+      'rlimits': rlimits,
+      'nice': __nice,
+      'cpu_affinity': sorted(__cpu_affinity or ()),
+    }
+    command_line = [
+      sys.executable, LIMITS_TRAMPOLINE, json.dumps(limits)
+    ] + list(command_line)
+
+  return subprocess.Popen(
+    command_line,
+    stdin=stdin,
+    stdout=stdout,
+    stderr=stderr,
+    cwd=cwd,
+    start_new_session=True
+  )
+
+@contextmanager
+def supervised(process, request_id: str = None):
+  """
+  Supervise the process group of a code while running a job:
+  with request_id given, the code can be terminated by terminate();
+  the code is terminated after wall_clock_timeout seconds.
+
+  Yields a dictionary of events:
+    finished (to be set by the caller when the code ends,
+              set anyway on exit),
+    terminated (set if the code is terminated by terminate()),
+    timed_out (set if the code is terminated for exceeding
+               wall_clock_timeout).
+  """
+
+  events = {
+    'finished': threading.Event(),
+    'terminated': threading.Event(),
+    'timed_out': threading.Event(),
+  }
+  finished = events['finished']
+
+  if request_id is not None:
+    with __processes_lock:
+      __processes[request_id] = (process, finished, events['terminated'])
+      terminate_now = (
+        __pending_terminations.pop(request_id, None) is not None
+      )
+    if terminate_now:
+      terminate(request_id)
+
+  timer = None
+  if __wall_clock_timeout:
+    def on_timeout():
+      events['timed_out'].set()
+      app.logger.warning(
+        "Code exceeded wall clock timeout of {0} seconds: terminating "
+        "process {1}.".format(__wall_clock_timeout, process.pid)
+      )
+      __terminate_group(process, finished)
+    timer = threading.Timer(__wall_clock_timeout, on_timeout)
+    timer.daemon = True
+    timer.start()
+
+  try:
+    yield events
+  finally:
+    finished.set()
+    if timer is not None:
+      timer.cancel()
+    if request_id is not None:
+      with __processes_lock:
+        if __processes.get(request_id, (None,))[0] is process:
+          del __processes[request_id]
+
+def stop_process(process, grace_period: float = None) -> None:
+  """
+  Terminate the process group of a code not running a job:
+  SIGTERM, then SIGKILL after grace_period seconds
+  (default: kill_grace_period); wait for its end.
+  """
+
+  if grace_period is None:
+    grace_period = __kill_grace_period
+  for sig in (signal.SIGTERM, signal.SIGKILL):
+    try:
+      os.killpg(process.pid, sig)
+    except ProcessLookupError:
+      break
+    try:
+      process.wait(grace_period)
+      return
+    except subprocess.TimeoutExpired:
+      pass
+  process.wait()
+
+def get_kill_grace_period() -> float:
+  """
+  Returns the seconds between SIGTERM and SIGKILL.
+  """
+
+  return __kill_grace_period
+
+def run_process(command_line: list, cwd: str, stdout, stderr,
+                request_id: str = None) -> dict:
+  """
+  Run the code and wait for its end.
+
+  The code is the leader of a new process group,
+  so that all its children can be signalled together.
+  With request_id given, the code can be terminated by terminate().
+
+  Returns a dictionary with keys:
+    exit_code (negative signal number if killed by a signal),
+    timed_out (True if killed for exceeding wall_clock_timeout),
+    terminated (True if killed by terminate()),
+    peak_rss_kb, user_cpu_time, system_cpu_time, wall_time.
+  """
+
+  process = start_process(command_line, cwd, stdout, stderr)
+  start_time = time.monotonic()
+
+  with supervised(process, request_id) as events:
+    # wait4() instead of Popen.wait() to get the resources used.
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+  return {
+    'exit_code': process.returncode,
+    'timed_out': events['timed_out'].is_set(),
+    'terminated': events['terminated'].is_set(),
+    'peak_rss_kb': rusage.ru_maxrss,
+    'user_cpu_time': rusage.ru_utime,
+    'system_cpu_time': rusage.ru_stime,
+    'wall_time': time.monotonic() - start_time,
+  }
@@ -0,0 +1,180 @@
+"""
+    Remove the expired requests from the DB, with their working directories.
+
+    On initialization the module is configured using parameters
+    in file application.ini, section 'retention' (optional).
+
+    Each ended request is assigned a time_to_clean, retention_period
+    seconds after its end (see module code_handler).
+    A background thread removes, every cleanup_interval seconds,
+    the requests whose time_to_clean has passed, in batches of
+    at most cleanup_batch_size requests.
+    With retention_period not set the requests are kept forever.
+
+    The information on the removed requests is dropped from the cache
+    of module code_handler only in the process running the cleanup:
+    other processes may return it for up to job_info_ttl seconds
+    (section 'cache').
+"""
+
+import os
+import time
+import threading
+
+from va_simple_provider import app, configuration_directory
+from va_simple_provider import config
+from va_simple_provider import db_utils
+from va_simple_provider.controllers import code_handler
+from va_simple_provider.custom_exceptions import AppCustomException
+
+__enabled = None
+__cleanup_interval = None
+__cleanup_batch_size = None
+
+__statistics = {
+  'cleanups': 0,
+  'removed_requests': 0,
+  'freed_db_bytes': 0,
+  'freed_file_bytes': 0,
+  'last_cleanup': None,
+}
+__statistics_lock = threading.Lock()
+__cleanup_thread = None
+
+def __cleanup_loop():
+  """
+  Body of the cleanup thread: nothing is removed while retention
+  is disabled (by a reload of the configuration).
+  """
+
+  while True:
+    time.sleep(__cleanup_interval)
+    if not __enabled:
+      continue
+    try:
+      run_cleanup()
+    except Exception as ex:
+      app.logger.error("Cleanup failed: " + str(ex), exc_info=True)
+
+def __start_cleanup_thread() -> None:
+  """
+  Start the cleanup thread, once, when retention is first enabled
+  (at start or on a reload of the configuration).
+  """
+
+  global __cleanup_thread
+  if __cleanup_thread is not None:
+    return
+  __cleanup_thread = threading.Thread(
+    target=__cleanup_loop, name='retention-cleanup', daemon=True
+  )
+  __cleanup_thread.start()
+
+def __config():
+  """
+  Set the private internal parameters for the whole module.
+
+  The following parameters are read from file 'application.ini',
+  section 'retention' (all optional):
+    retention_period (default: not set, requests are kept forever)
+    cleanup_interval (default: 3600 seconds)
+    cleanup_batch_size (default: 100)
+  """
+
+  filename = os.path.join(configuration_directory, 'application.ini')
+  section = 'retention'
+
+  global __enabled
+  retention_period_key = 'retention_period'
+
+  global __cleanup_interval
+  cleanup_interval_key = 'cleanup_interval'
+
+  global __cleanup_batch_size
+  cleanup_batch_size_key = 'cleanup_batch_size'
+
+  parser = config.get_application()
+
+  try:
+    __enabled = parser.getfloat(
+      section, retention_period_key, fallback=0
+    ) > 0
+    __cleanup_interval = parser.getfloat(
+      section, cleanup_interval_key, fallback=3600.0
+    )
+    __cleanup_batch_size = parser.getint(
+      section, cleanup_batch_size_key, fallback=100
+    )
+  except ValueError:
+    raise AppCustomException(
+      "Parameters in section '{0}' in file '{1}' must be numbers.".format(
+        section, os.path.abspath(filename)
+      )
+    )
+  if __cleanup_interval <= 0 or __cleanup_batch_size < 1:
+    raise AppCustomException(
+      "Parameters '{0}' and '{1}' in section '{2}' in file '{3}' "
+      "must be positive.".format(
+        cleanup_interval_key, cleanup_batch_size_key,
+        section, os.path.abspath(filename)
+      )
+    )
+
+  if __enabled:
+    __start_cleanup_thread()
+
+  return
+__config()
+config.on_reload(__config)
+
+def run_cleanup() -> dict:
+  """
+  Remove all the expired requests of the service, batch after batch,
+  with their working directories.
+
+  Returns a dictionary with what was reclaimed:
+  removed_requests, freed_db_bytes, freed_file_bytes.
+  """
+
+  reclaimed = {'removed_requests': 0, 'freed_db_bytes': 0, 'freed_file_bytes': 0}
+
+  while True:
+    with db_utils.get_db_connection() as conn:
+      expired = db_utils.delete_expired_requests(
+        conn, code_handler.get_id_service(), __cleanup_batch_size
+      )
+    for request in expired:
+      reclaimed['freed_file_bytes'] += code_handler.remove_request_files(
+        request['id']
+      )
+      reclaimed['freed_db_bytes'] += request['db_bytes']
+    reclaimed['removed_requests'] += len(expired)
+    if len(expired) < __cleanup_batch_size:
+      break
+
+  with __statistics_lock:
+    __statistics['cleanups'] += 1
+    for key, value in reclaimed.items():
+      __statistics[key] += value
+    __statistics['last_cleanup'] = time.time()
+
+  if reclaimed['removed_requests']:
+    app.logger.info(
+      "Cleanup removed {0} expired requests: freed {1} bytes on DB "
+      "and {2} bytes on disk.".format(
+        reclaimed['removed_requests'], reclaimed['freed_db_bytes'],
+        reclaimed['freed_file_bytes']
+      )
+    )
+  return reclaimed
+
+def get_statistics() -> dict:
+  """
+  Returns the totals reclaimed since start, and the time (epoch seconds)
+  of the last cleanup.
+  """
+
+  with __statistics_lock:
+    statistics = dict(__statistics)
+  statistics['enabled'] = __enabled
+  return statistics
@@ -0,0 +1,466 @@
+"""
+    Run the jobs on a pool of long-lived code processes ("warm" processes),
+    for codes whose startup (loading libraries, lookup tables, ...)
+    costs much more than a job.
+
+    On initialization the module is configured using parameters
+    in file application.ini, section 'warm_pool' (optional):
+    without command_line the pool is disabled and every job runs
+    the code from scratch (module process_runner).
+
+    A warm process is started with command_line, in file_root_directory,
+    within the limits of module process_runner (but limit_cpu_time,
+    which would sum up the CPU time of all its jobs).
+    It talks with the service by JSON lines: the service writes to its
+    standard input, the process writes to its standard output.
+    -) When ready, the process writes {"ready": true}.
+    -) For each job the service writes
+       {"request_id": ..., "arguments": [...], "cwd": ...,
+        "stdout": ..., "stderr": ...}:
+       arguments are those that follow command_line of section 'executable'
+       for the one-shot run, cwd is the job directory, stdout and stderr
+       the paths of the files where to write the standard output and error
+       of the job (open them for appending: they are already created).
+       The process runs the job and writes {"exit_code": N}.
+    -) At the end of its standard input the process exits.
+    benchmarks/dummy_code.py --warm is an example in Python.
+
+    A warm process serves one job at a time; it is replaced after
+    max_jobs_per_process jobs, or when its resident memory exceeds
+    max_rss_kb after a job. It is killed (and replaced) when its job
+    is cancelled or exceeds wall_clock_timeout, or when it breaks the
+    protocol. If no warm process can be started the job runs
+    the code from scratch.
+"""
+
+import os
+import ast
+import json
+import time
+import selectors
+import threading
+import subprocess
+
+from va_simple_provider import app, configuration_directory
+from va_simple_provider import config
+from va_simple_provider.controllers import job_executor
+from va_simple_provider.controllers import process_runner
+from va_simple_provider.custom_exceptions import AppCustomException
+
+__command_line = None
+__cwd = None
+__size = None
+__max_jobs_per_process = None
+__max_rss_kb = None
+__start_timeout = None
+
+# Warm processes not running a job, and number of warm processes.
+__idle_processes = []
+__process_count = 0
+__pool_condition = threading.Condition()
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+class ProtocolError(Exception):
+  """
+  The warm process did not answer as expected.
+  """
+
+class WarmProcess:
+  """
+  A long-lived code process, serving one job at a time.
+  """
+
+  def __init__(self, command_line: list, cwd: str, start_timeout: float):
+    self.process = process_runner.start_process(
+      command_line, cwd, subprocess.PIPE, None,
+      stdin=subprocess.PIPE, cpu_time_limit=False
+    )
+    self.command_line = (command_line, cwd)
+    self.jobs = 0
+    self.broken = False
+    self.__buffer = b''
+    self.__selector = selectors.DefaultSelector()
+    self.__selector.register(self.process.stdout, selectors.EVENT_READ)
+    try:
+      message = self.__read_message(start_timeout)
+      if not message.get('ready'):
+        raise ProtocolError("Expected ready, got {0}.".format(message))
+    except Exception:
+      self.stop()
+      raise
+
+  def __read_message(self, timeout: float = None) -> dict:
+    """
+    Returns the next JSON line written by the process.
+
+    Raise EOFError if the process closed its standard output
+    (e.g. was killed), ProtocolError on timeout or invalid line.
+    """
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while b'\n' not in self.__buffer:
+      remaining = None
+      if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+          raise ProtocolError(
+            "No answer within {0} seconds.".format(timeout)
+          )
+      if not self.__selector.select(remaining):
+        continue
+      data = os.read(self.process.stdout.fileno(), 65536)
+      if not data:
+        raise EOFError()
+      self.__buffer += data
+    line, self.__buffer = self.__buffer.split(b'\n', 1)
+    try:
+      return json.loads(line)
+    except ValueError:
+      raise ProtocolError("Invalid line {0!r}.".format(line[:200]))
+
+  def __proc_status(self, key: str):
+    """
+    Returns the value in kB of key (e.g. VmRSS) in /proc/<pid>/status,
+    or None if not available.
+    """
+
+    try:
+      with open('/proc/{0}/status'.format(self.process.pid)) as f:
+        for line in f:
+          if line.startswith(key + ':'):
+            return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+      pass
+    return None
+
+  def __cpu_times(self):
+    """
+    Returns user and system CPU seconds used so far by the process,
+    or (None, None) if not available.
+    """
+
+    try:
+      with open('/proc/{0}/stat'.format(self.process.pid)) as f:
+        # Fields after the command name, which may contain spaces.
+        fields = f.read().rsplit(')', 1)[1].split()
+      return int(fields[11]) / CLOCK_TICKS, int(fields[12]) / CLOCK_TICKS
+    except (OSError, ValueError, IndexError):
+      return None, None
+
+  def __reset_peak_rss(self) -> None:
+    """
+    Reset the peak resident memory of the process (VmHWM),
+    to measure that of the next job.
+    """
+
+    try:
+      with open('/proc/{0}/clear_refs'.format(self.process.pid), 'w') as f:
+        f.write('5')
+    except OSError:
+      pass
+
+  def run_job(self, request_id: str, arguments: list, cwd: str,
+              std_out_path: str, std_err_path: str) -> dict:
+    """
+    Run a job on the process and wait for its end.
+
+    Returns the same dictionary as process_runner.run_process;
+    resources are measured on the process itself (not its children).
+    If the process ended during the job, the job gets its exit code.
+    """
+
+    self.jobs += 1
+    self.__reset_peak_rss()
+    user_cpu_time, system_cpu_time = self.__cpu_times()
+    start_time = time.monotonic()
+    with process_runner.supervised(self.process, request_id) as events:
+      try:
+        self.process.stdin.write(json.dumps({
+          'request_id': request_id,
+          'arguments': arguments,
+          'cwd': cwd,
+          'stdout': std_out_path,
+          'stderr': std_err_path,
+        }).encode() + b'\n')
+        self.process.stdin.flush()
+        exit_code = int(self.__read_message()['exit_code'])
+      except (EOFError, OSError):
+        exit_code = self.process.wait()
+      except (KeyError, TypeError, ValueError) as ex:
+        self.broken = True
+        raise ProtocolError("Invalid answer: {0}".format(str(ex)))
+      except ProtocolError:
+        self.broken = True
+        raise
+    wall_time = time.monotonic() - start_time
+    if events['terminated'].is_set() or events['timed_out'].is_set():
+      # Killed, or being killed.
+      self.broken = True
+
+    end_user_cpu_time, end_system_cpu_time = self.__cpu_times()
+    return {
+      'exit_code': exit_code,
+      'timed_out': events['timed_out'].is_set(),
+      'terminated': events['terminated'].is_set(),
+      'peak_rss_kb': self.__proc_status('VmHWM'),
+      'user_cpu_time': (
+        None if user_cpu_time is None or end_user_cpu_time is None
+        else end_user_cpu_time - user_cpu_time
+      ),
+      'system_cpu_time': (
+        None if system_cpu_time is None or end_system_cpu_time is None
+        else end_system_cpu_time - system_cpu_time
+      ),
+      'wall_time': wall_time,
+    }
+
+  def rss_kb(self):
+    """
+    Returns the resident memory of the process in kB,
+    or None if not available.
+    """
+
+    return self.__proc_status('VmRSS')
+
+  def stop(self) -> None:
+    """
+    End the process: close its standard input, then terminate it
+    if it does not exit within kill_grace_period seconds.
+    """
+
+    try:
+      self.process.stdin.close()
+    except OSError:
+      pass
+    try:
+      self.process.wait(process_runner.get_kill_grace_period())
+    except subprocess.TimeoutExpired:
+      process_runner.stop_process(self.process)
+    self.__selector.close()
+    self.process.stdout.close()
+
+def __config():
+  """
+  Set the private internal parameters for the whole module.
+
+  The following parameters are read from file 'application.ini',
+  section 'warm_pool' (all optional):
+    command_line (default: not set, pool disabled)
+    size (default: max_concurrent_jobs of section 'executor')
+    max_jobs_per_process (default: 100, 0 means no limit)
+    max_rss_kb (default: not set)
+    start_timeout (default: 300 seconds)
+  The working directory of the warm processes is file_root_directory
+  of section 'executable'.
+  """
+
+  filename = os.path.join(configuration_directory, 'application.ini')
+  section = 'warm_pool'
+
+  global __command_line
+  command_line_key = 'command_line'
+
+  global __cwd
+
+  global __size
+  size_key = 'size'
+
+  global __max_jobs_per_process
+  max_jobs_per_process_key = 'max_jobs_per_process'
+
+  global __max_rss_kb
+  max_rss_kb_key = 'max_rss_kb'
+
+  global __start_timeout
+  start_timeout_key = 'start_timeout'
+
+  parser = config.get_application()
+
+  __command_line = None
+  command_line = parser.get(section, command_line_key, fallback=None)
+  if command_line:
+    try:
+      __command_line = ast.literal_eval(command_line)
+      if not isinstance(__command_line, list):
+        __command_line = [__command_line]
+    except (ValueError, SyntaxError):
+      raise AppCustomException(
+        "Parameter '{0}' in section '{1}' in file '{2}' "
+        "must be a list of strings.".format(
+          command_line_key, section, os.path.abspath(filename)
+        )
+      )
+  __cwd = parser.get('executable', 'file_root_directory', fallback=None)
+
+  try:
+    __size = parser.getint(
+      section, size_key, fallback=job_executor.get_max_concurrent_jobs()
+    )
+    __max_jobs_per_process = parser.getint(
+      section, max_jobs_per_process_key, fallback=100
+    )
+    __max_rss_kb = parser.getint(section, max_rss_kb_key, fallback=None)
+    __start_timeout = parser.getfloat(
+      section, start_timeout_key, fallback=300.0
+    )
+  except ValueError:
+    raise AppCustomException(
+      "Parameters '{0}', '{1}', '{2}', '{3}' in section '{4}' in file '{5}' "
+      "must be numbers.".format(
+        size_key, max_jobs_per_process_key, max_rss_kb_key,
+        start_timeout_key, section, os.path.abspath(filename)
+      )
+    )
+  if __size < 1:
+    raise AppCustomException(
+      "Parameter '{0}' in section '{1}' in file '{2}' "
+      "must be at least 1.".format(
+        size_key, section, os.path.abspath(filename)
+      )
+    )
+
+  __stop_stale_processes()
+  return
+
+def __stop_stale_processes() -> None:
+  """
+  Stop the idle warm processes started with a previous command line
+  (reload of the configuration); those running a job are replaced
+  when released.
+  """
+
+  global __process_count
+
+  with __pool_condition:
+    stale = [
+      warm_process for warm_process in __idle_processes
+      if warm_process.command_line != (__command_line, __cwd)
+    ]
+    for warm_process in stale:
+      __idle_processes.remove(warm_process)
+    __process_count -= len(stale)
+    __pool_condition.notify_all()
+  for warm_process in stale:
+    warm_process.stop()
+
+__config()
+config.on_reload(__config)
+
+def is_enabled() -> bool:
+  """
+  Returns True if the jobs run on warm processes.
+  """
+
+  return __command_line is not None
+
+def __acquire():
+  """
+  Returns an idle warm process, starting a new one if the pool
+  is not full, or waiting for one to be released.
+
+  Returns None if a new warm process cannot be started.
+  """
+
+  global __process_count
+
+  with __pool_condition:
+    while not __idle_processes and __process_count >= __size:
+      __pool_condition.wait()
+    if __idle_processes:
+      return __idle_processes.pop()
+    __process_count += 1
+
+  try:
+    warm_process = WarmProcess(__command_line, __cwd, __start_timeout)
+    app.logger.info(
+      "Warm process {0} started.".format(warm_process.process.pid)
+    )
+    return warm_process
+  except Exception as ex:
+    app.logger.error("Warm process not started. " + str(ex))
+    with __pool_condition:
+      __process_count -= 1
+      __pool_condition.notify()
+    return None
+
+def __is_reusable(warm_process: WarmProcess) -> bool:
+  """
+  Returns True if the warm process may serve another job.
+  """
+
+  if warm_process.broken or warm_process.process.poll() is not None:
+    return False
+  if warm_process.command_line != (__command_line, __cwd):
+    return False
+  if __max_jobs_per_process and warm_process.jobs >= __max_jobs_per_process:
+    return False
+  if __max_rss_kb is not None:
+    rss_kb = warm_process.rss_kb()
+    if rss_kb is not None and rss_kb > __max_rss_kb:
+      app.logger.info(
+        "Warm process {0} recycled: {1} kB resident.".format(
+          warm_process.process.pid, rss_kb
+        )
+      )
+      return False
+  return True
+
+def __release(warm_process: WarmProcess) -> None:
+  """
+  Return the warm process to the pool after a job,
+  or replace it if it is not reusable.
+  """
+
+  global __process_count
+
+  if __is_reusable(warm_process):
+    with __pool_condition:
+      __idle_processes.append(warm_process)
+      __pool_condition.notify()
+    return
+
+  warm_process.stop()
+  with __pool_condition:
+    __process_count -= 1
+    __pool_condition.notify()
+  # Start the replacement now, so that the next job finds it ready.
+  threading.Thread(
+    target=__prestart, name='warm-pool-start', daemon=True
+  ).start()
+
+def __prestart() -> None:
+  """
+  Start a warm process and leave it idle in the pool.
+  """
+
+  with __pool_condition:
+    if (__command_line is None or __idle_processes
+        or __process_count >= __size):
+      return
+  warm_process = __acquire()
+  if warm_process is not None:
+    with __pool_condition:
+      __idle_processes.append(warm_process)
+      __pool_condition.notify()
+
+def run_job(request_id: str, arguments: list, cwd: str,
+            std_out_path: str, std_err_path: str):
+  """
+  Run a job on a warm process, with the given arguments
+  (those after command_line of section 'executable').
+
+  Returns the same dictionary as process_runner.run_process,
+  or None if no warm process can be started: then the job
+  is to be run from scratch.
+  """
+
+  warm_process = __acquire()
+  if warm_process is None:
+    return None
+  try:
+    return warm_process.run_job(
+      request_id, arguments, cwd, std_out_path, std_err_path
+    )
+  finally:
+    __release(warm_process)
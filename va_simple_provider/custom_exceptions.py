@@ -5,4 +5,8 @@ class BaseCustomException(Exception):
 
 class AppCustomException(Exception):
     "Base class for any application specific exception."
-    pass
\ No newline at end of file
+    pass
+
+class ServiceBusyException(BaseCustomException):
+    "The request cannot be accepted now, but can be retried later."
+    pass
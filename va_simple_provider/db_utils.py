@@ -1,17 +1,241 @@
 
 import os
+import time
+import zlib
+import select
+import threading
+
+from collections import deque
+from contextlib import contextmanager
 
 # Imprt library to interact with PostgreSQL
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
-
-from configparser import ConfigParser
+import psycopg2.sql
 
 from va_simple_provider import app, configuration_directory
+from va_simple_provider import config
+from va_simple_provider import metrics
 from va_simple_provider.custom_exceptions import AppCustomException
 
+# Channels of the PostgreSQL notifications sent at the end of each job,
+# on cancellation of a running job and on submission of a job
+# to be claimed by the workers, with the request id as payload.
+JOB_COMPLETED_CHANNEL = 'job_completed'
+JOB_CANCELLED_CHANNEL = 'job_cancelled'
+JOB_SUBMITTED_CHANNEL = 'job_submitted'
+
+# Condition fencing the outcome written by a worker for a claimed request:
+# once its lease is lost, another worker may have claimed the request again.
+__FENCE_CONDITION = " AND worker_id = %s AND end_processing IS NULL"
+
 # Internal use to module only:
 __database_connection_parameters = None
+__connection_pool = None
+__connection_pool_parameters = None
+__compression_threshold = None
+__compression_level = None
+
+
+class _ConnectionPool:
+  """
+  Bounded, thread-safe pool of connections to the DB.
+
+  At most max_connections connections are open at the same time;
+  when all of them are in use a caller waits up to acquire_timeout
+  seconds for one to be released.
+  Idle connections are closed after idle_timeout seconds,
+  keeping at least min_idle_connections open.
+  A connection idle for more than health_check_interval seconds
+  is tested before being handed out again.
+  """
+
+  def __init__(self, connection_parameters, max_connections,
+               min_idle_connections, idle_timeout, acquire_timeout,
+               health_check_interval):
+    self._connection_parameters = connection_parameters
+    self._max_connections = max_connections
+    self._min_idle_connections = min_idle_connections
+    self._idle_timeout = idle_timeout
+    self._acquire_timeout = acquire_timeout
+    self._health_check_interval = health_check_interval
+
+    # Idle connections as (connection, last release time) pairs:
+    # the most recently released is at the right end.
+    self._idle = deque()
+    # Open connections, both idle and in use.
+    self._size = 0
+    self._waiting = 0
+    self._closed = False
+    self._condition = threading.Condition()
+
+    self._statistics = {
+      'acquired': 0,
+      'acquire_timeouts': 0,
+      'total_wait_time': 0.0,
+      'max_wait_time': 0.0,
+      'connections_created': 0,
+      'connections_closed': 0,
+      'failed_health_checks': 0,
+    }
+
+  def acquire(self):
+    """
+    Check out a connection, opening a new one if none is idle
+    and the pool is not full.
+    """
+    start = time.monotonic()
+    deadline = start + self._acquire_timeout
+
+    while True:
+      conn = None
+      last_used = None
+      with self._condition:
+        self._close_expired_idle()
+        while not self._idle and self._size >= self._max_connections:
+          remaining = deadline - time.monotonic()
+          if remaining <= 0:
+            self._statistics['acquire_timeouts'] += 1
+            app.logger.error(
+              'Timeout waiting for a DB connection: '
+              '{0} connections in use.'.format(self._size)
+            )
+            raise AppCustomException('Timeout waiting for a DB connection.')
+          self._waiting += 1
+          try:
+            self._condition.wait(remaining)
+          finally:
+            self._waiting -= 1
+        if self._idle:
+          conn, last_used = self._idle.pop()
+        else:
+          # Reserve the slot before connecting outside the lock.
+          self._size += 1
+
+      if conn is None:
+        try:
+          conn = self._connect()
+        except Exception:
+          with self._condition:
+            self._size -= 1
+            self._condition.notify()
+          raise
+      elif not self._is_healthy(conn, last_used):
+        self._discard(conn)
+        continue
+
+      wait_time = time.monotonic() - start
+      metrics.DB_CONNECTION_WAIT_SECONDS.observe(wait_time)
+      with self._condition:
+        self._statistics['acquired'] += 1
+        self._statistics['total_wait_time'] += wait_time
+        self._statistics['max_wait_time'] = max(
+          self._statistics['max_wait_time'], wait_time
+        )
+      return conn
+
+  def release(self, conn) -> None:
+    """
+    Give back a connection to the pool.
+
+    Connections broken or left inside a transaction are closed.
+    """
+    if not conn.closed:
+      try:
+        if (conn.get_transaction_status()
+            != psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+          conn.rollback()
+      except psycopg2.Error:
+        pass
+    if conn.closed or self._closed or (conn.get_transaction_status()
+                       != psycopg2.extensions.TRANSACTION_STATUS_IDLE):
+      self._discard(conn)
+      return
+
+    with self._condition:
+      self._idle.append((conn, time.monotonic()))
+      self._condition.notify()
+
+  def close(self) -> None:
+    """
+    Close the idle connections, and those in use when released
+    (the pool is replaced by another one).
+    """
+    with self._condition:
+      self._closed = True
+      while self._idle:
+        conn, _ = self._idle.popleft()
+        try:
+          conn.close()
+        except psycopg2.Error:
+          pass
+        self._size -= 1
+        self._statistics['connections_closed'] += 1
+
+  def get_statistics(self) -> dict:
+    """
+    Return a snapshot of the pool usage counters.
+    """
+    with self._condition:
+      statistics = dict(self._statistics)
+      statistics['max_connections'] = self._max_connections
+      statistics['open_connections'] = self._size
+      statistics['idle_connections'] = len(self._idle)
+      statistics['in_use_connections'] = self._size - len(self._idle)
+      statistics['waiting_requests'] = self._waiting
+    return statistics
+
+  def _connect(self):
+    try:
+      conn = psycopg2.connect(**self._connection_parameters)
+    except (Exception) as ex:
+      app.logger.error('Connecting to DB failed: ' + str(ex))
+      raise AppCustomException(
+        'Connecting to DB failed.'
+      )
+    with self._condition:
+      self._statistics['connections_created'] += 1
+    return conn
+
+  def _is_healthy(self, conn, last_used) -> bool:
+    if conn.closed:
+      return False
+    if time.monotonic() - last_used < self._health_check_interval:
+      return True
+    try:
+      with conn.cursor() as cur:
+        cur.execute('SELECT 1')
+      conn.rollback()
+    except psycopg2.Error as ex:
+      app.logger.warning('Discarding broken DB connection: ' + str(ex))
+      with self._condition:
+        self._statistics['failed_health_checks'] += 1
+      return False
+    return True
+
+  def _discard(self, conn) -> None:
+    try:
+      conn.close()
+    except psycopg2.Error:
+      pass
+    with self._condition:
+      self._size -= 1
+      self._statistics['connections_closed'] += 1
+      self._condition.notify()
+
+  def _close_expired_idle(self) -> None:
+    # Called holding the lock: oldest idle connections are on the left.
+    now = time.monotonic()
+    while (len(self._idle) > self._min_idle_connections
+           and now - self._idle[0][1] > self._idle_timeout):
+      conn, _ = self._idle.popleft()
+      try:
+        conn.close()
+      except psycopg2.Error:
+        pass
+      self._size -= 1
+      self._statistics['connections_closed'] += 1
 
 
 def __config():
@@ -20,6 +244,19 @@ def __config():
 
   The following parameters are read from file 'database.ini':
     all section 'postgresql' into __database_connection_parameters
+    section 'connection_pool' (optional):
+      max_connections
+      min_idle_connections
+      idle_timeout
+      acquire_timeout
+      health_check_interval
+    section 'output_compression' (optional):
+      threshold (default: 4096 bytes, 0 disables the compression)
+      level (default: 6)
+
+  The DB is not connected here: see check_connection().
+  On reload the pool of connections is replaced only if
+  its parameters changed.
   """
   
   filename = os.path.join(configuration_directory, 'database.ini')
@@ -27,10 +264,15 @@ def __config():
   section_db = 'postgresql'
   global __database_connection_parameters
 
-  # create a parser
-  parser = ConfigParser()
-  # read config file, default to database.ini
-  parser.read(filename)
+  section_pool = 'connection_pool'
+  global __connection_pool
+  global __connection_pool_parameters
+
+  section_compression = 'output_compression'
+  global __compression_threshold
+  global __compression_level
+
+  parser = config.get_database()
 
   # get database section
   db = {}
@@ -46,8 +288,69 @@ def __config():
     )
   __database_connection_parameters = db
 
+  pool_parameters = {
+    'max_connections': 10,
+    'min_idle_connections': 1,
+    'idle_timeout': 300.0,
+    'acquire_timeout': 30.0,
+    'health_check_interval': 5.0,
+  }
+  if parser.has_section(section_pool):
+    for key, default in pool_parameters.items():
+      if parser.has_option(section_pool, key):
+        try:
+          pool_parameters[key] = type(default)(parser.get(section_pool, key))
+        except ValueError:
+          raise AppCustomException(
+            "Parameter '{0}' in section '{1}' in file '{2}' "
+            "must be a number.".format(
+              key, section_pool, os.path.abspath(filename)
+            )
+          )
+  if pool_parameters['max_connections'] < 1:
+    raise AppCustomException(
+      "Parameter 'max_connections' in section '{0}' in file '{1}' "
+      "must be at least 1.".format(section_pool, os.path.abspath(filename))
+    )
+  if (__connection_pool is None
+      or (db, pool_parameters) != __connection_pool_parameters):
+    previous_pool = __connection_pool
+    __connection_pool = _ConnectionPool(db, **pool_parameters)
+    __connection_pool_parameters = (db, pool_parameters)
+    if previous_pool is not None:
+      previous_pool.close()
+  metrics.DB_POOL_CONNECTIONS.set_function(__pool_connections_by_state)
+
+  try:
+    __compression_threshold = parser.getint(
+      section_compression, 'threshold', fallback=4096
+    )
+    __compression_level = parser.getint(
+      section_compression, 'level', fallback=6
+    )
+  except ValueError:
+    raise AppCustomException(
+      "Parameters in section '{0}' in file '{1}' must be integers.".format(
+        section_compression, os.path.abspath(filename)
+      )
+    )
+  if not 1 <= __compression_level <= 9:
+    raise AppCustomException(
+      "Parameter 'level' in section '{0}' in file '{1}' "
+      "must be from 1 to 9.".format(
+        section_compression, os.path.abspath(filename)
+      )
+    )
+
+  return
+
+def check_connection() -> None:
+  """
+  Test the connection to the DB (readiness probe).
+
+  Raise AppCustomException if the DB cannot be reached.
+  """
   try:
-    # Test connection parameters:
     test_query = """SELECT version()"""
     with get_db_connection() as conn:
       with conn.cursor() as cur:
@@ -59,44 +362,200 @@ def __config():
       'Test connecting to DB failed.'
     ) from ex
 
-  return
-
+@contextmanager
 def get_db_connection():
   """
-  Get and return a new connection to the DB.
+  Check out a connection from the pool, to be used in a with statement.
+
+  On leaving the with block the transaction is committed,
+  or rolled back if an exception was raised,
+  and the connection is returned to the pool.
   """
+  # The pool may be replaced meanwhile, on reload of the configuration.
+  pool = __connection_pool
+  conn = pool.acquire()
   try:
-    conn = psycopg2.connect(**__database_connection_parameters)
-  except (Exception) as ex:
-    app.logger.error('Connecting to DB failed: ' + str(ex))
-    raise AppCustomException(
-      'Test connecting to DB failed.'
-    )
-  
-  return conn
+    with conn:
+      yield conn
+  finally:
+    pool.release(conn)
 
-def add_new_request(conn, service_id: str, request_id: str) -> None:
+def __pool_connections_by_state() -> dict:
   """
-  Create a new record for the request and return the ID.
+  Connections of the pool by state, for metric DB_POOL_CONNECTIONS.
   """
+  statistics = __connection_pool.get_statistics()
+  return {
+    ('in_use', ): statistics['in_use_connections'],
+    ('idle', ): statistics['idle_connections'],
+    ('waiting_requests', ): statistics['waiting_requests'],
+  }
 
-  query_insert = """INSERT INTO request(id, service) VALUES(%s, %s)"""
+def get_pool_statistics() -> dict:
+  """
+  Returns a dictionary with the usage counters of the connection pool.
 
-  with conn.cursor() as cur:
-      cur.execute(query_insert, (request_id, service_id))
-      conn.commit()
+  Wait times are in seconds.
+  """
+  return __connection_pool.get_statistics()
 
-def add_request_parameter(
-    conn, request_id: str, param_name: str, param_value: str) -> None:
+def listen_for_notifications(channels: list, callback,
+                             reconnect_delay: float = 5.0) -> None:
   """
-  Add a parameter to the request.
+  Listen forever for notifications on PostgreSQL channels,
+  calling callback(channel, payload) for each notification received.
+
+  A dedicated connection, outside the pool, is used.
+  After each (re)connection callback(None, None) is called,
+  as notifications sent while disconnected are lost.
   """
-  query_insert = """INSERT INTO request_parameter(request_id, name, value)
-                    VALUES(%s, %s, %s)"""
-  with conn.cursor() as cur:
-    cur.execute(query_insert, (request_id, param_name, param_value))
+  listen_queries = [
+    psycopg2.sql.SQL('LISTEN {0}').format(psycopg2.sql.Identifier(channel))
+    for channel in channels
+  ]
+  while True:
+    conn = None
+    try:
+      conn = psycopg2.connect(**__database_connection_parameters)
+      conn.set_session(autocommit=True)
+      with conn.cursor() as cur:
+        for listen_query in listen_queries:
+          cur.execute(listen_query)
+      callback(None, None)
+      while True:
+        if select.select([conn], [], [], 60) == ([], [], []):
+          continue
+        conn.poll()
+        while conn.notifies:
+          notify = conn.notifies.pop(0)
+          callback(notify.channel, notify.payload)
+    except Exception as ex:
+      app.logger.error(
+        "Listening on channels {0} failed: {1}".format(channels, str(ex))
+      )
+    finally:
+      if conn is not None:
+        try:
+          conn.close()
+        except psycopg2.Error:
+          pass
+    time.sleep(reconnect_delay)
+
+def __notify_job_completed(cur, request_id: str) -> None:
+  """
+  Queue the notification of the end of the job:
+  it is delivered when the transaction is committed.
+  """
+  cur.execute(
+    """SELECT pg_notify(%s, %s)""", (JOB_COMPLETED_CHANNEL, request_id)
+  )
+
+@metrics.DB_OPERATION_SECONDS.time(operation='add_new_request')
+def add_new_request(conn, service_id: str, request_id: str,
+                    parameters: "dict[str, str]" = None,
+                    arguments: list = None, result_key: str = None,
+                    priority: int = 0, client: str = None) -> None:
+  """
+  Create a new record for the request, together with its parameters.
+
+  The request and all the parameters are written with one multi-row
+  insert in a single transaction: on failure nothing is recorded.
+
+  With arguments given (the arguments of the code, after the command line
+  configured for the service) the request is queued to be claimed
+  by the workers (claim_request), which are notified
+  on JOB_SUBMITTED_CHANNEL.
+  With result_key given the result of the request may be reused
+  by later identical requests (see find_result).
+  priority and client are used by the workers to choose the next
+  request to claim (see claim_request).
+  """
+
+  __insert_requests(
+    conn, service_id,
+    [(request_id, parameters, arguments, result_key, priority, client)]
+  )
+
+@metrics.DB_OPERATION_SECONDS.time(operation='add_new_requests')
+def add_new_requests(conn, service_id: str, requests: list) -> set:
+  """
+  Create the records for a batch of requests, together with
+  their parameters, in a single transaction: on failure nothing
+  is recorded.
+
+  Each request is given as tuple
+  (request_id, parameters, arguments, result_key, priority, client),
+  as the arguments of add_new_request.
+  Requests whose id is already on the DB are skipped.
+
+  Returns the set of the ids of the requests recorded.
+  """
+
+  return __insert_requests(conn, service_id, requests, skip_existing=True)
+
+def __insert_requests(conn, service_id: str, requests: list,
+                      skip_existing: bool = False) -> set:
+  """
+  Insert the requests, and all their parameters, with one multi-row
+  insert each, and commit.
+
+  With skip_existing the requests whose id is already on the DB
+  are not inserted, instead of failing the transaction.
+  Returns the set of the ids of the requests inserted.
+  """
+
+  query_insert = """INSERT INTO request(id, service, arguments, result_key,
+                                        priority, client)
+                    VALUES %s"""
+  if skip_existing:
+    query_insert += """ ON CONFLICT (id) DO NOTHING"""
+  query_insert += """ RETURNING id"""
+  query_insert_params = """INSERT INTO request_parameter(request_id, name, value)
+                           VALUES %s"""
+
+  if not requests:
+    return set()
+  try:
+    with conn.cursor() as cur:
+      inserted = {
+        row[0] for row in psycopg2.extras.execute_values(
+          cur, query_insert,
+          [
+            (request_id, service_id, arguments, result_key, priority, client)
+            for request_id, parameters, arguments, result_key, priority,
+                client in requests
+          ],
+          page_size=1000, fetch=True
+        )
+      }
+      requests = [request for request in requests if request[0] in inserted]
+      parameter_rows = [
+        (request_id, name, value)
+        for request_id, parameters, *_ in requests
+        for name, value in (parameters or {}).items()
+      ]
+      if parameter_rows:
+        psycopg2.extras.execute_values(
+          cur, query_insert_params, parameter_rows, page_size=1000
+        )
+      queued_ids = [
+        request_id
+        for request_id, parameters, arguments, *_ in requests
+        if arguments is not None
+      ]
+      if queued_ids:
+        cur.execute(
+          """SELECT pg_notify(%s, request_id)
+             FROM unnest(%s::varchar[]) AS request_id""",
+          (JOB_SUBMITTED_CHANNEL, queued_ids)
+        )
     conn.commit()
+  except Exception:
+    conn.rollback()
+    raise
+  return inserted
 
+@metrics.DB_OPERATION_SECONDS.time(operation='get_request_parameters')
 def get_request_parameters(conn, request_id: str):
   """
   Returns a list of dictionaries with the informations
@@ -113,6 +572,7 @@ def get_request_parameters(conn, request_id: str):
     cur.execute(query_select, query_params)
     return cur.fetchall()
     
+@metrics.DB_OPERATION_SECONDS.time(operation='abort_request')
 def abort_request(conn, request_id: str) -> None:
   """
   Remove the whole request from the DB.
@@ -135,64 +595,585 @@ def abort_request(conn, request_id: str) -> None:
   # ONLY if all above was succesful it is possible to commit.
   conn.commit()
 
-def record_started_request(conn, request_id: str):
+@metrics.DB_OPERATION_SECONDS.time(operation='record_started_request')
+def record_started_request(conn, request_id: str) -> bool:
   """
   Update the request status of the request on the DB at start of processing.
+
+  Returns False, without changes, if the request was cancelled.
   """
   query_update = """UPDATE request 
                     SET start_processing = NOW() 
-                    WHERE id = %s"""
+                    WHERE id = %s AND cancelled IS NULL
+                    RETURNING id"""
   with conn.cursor() as cur:
     cur.execute(query_update, (request_id, ))
+    started = cur.fetchone() is not None
     conn.commit()
+  return started
       
-def record_failed_request(conn, request_id, error_message):
+@metrics.DB_OPERATION_SECONDS.time(operation='record_cancelled_request')
+def record_cancelled_request(conn, request_id: str, error_message: str,
+                             retention_period: float = None):
+  """
+  Record the cancellation of a request not yet ended.
+
+  A request not yet started is also recorded as ended, with exit code -1
+  and error_message in std_err; listeners on JOB_COMPLETED_CHANNEL
+  are notified.
+  A running request is only marked as cancelled: its end is recorded
+  when its code terminates; listeners on JOB_CANCELLED_CHANNEL
+  are notified, so that the process running it terminates the code.
+
+  Returns 'queued' or 'running' according to the state of the cancelled
+  request, None if the request was not found or already ended.
+  """
+  query_cancel_queued = """UPDATE request
+                           SET (cancelled, end_processing, exit_code,
+                                std_out, std_err, time_to_clean)
+                               = (NOW(), NOW(), -1, '', %s,
+                                  NOW() + %s * INTERVAL '1 second')
+                           WHERE id = %s AND start_processing IS NULL
+                             AND end_processing IS NULL
+                           RETURNING id"""
+  query_cancel_running = """UPDATE request
+                            SET cancelled = NOW()
+                            WHERE id = %s AND end_processing IS NULL
+                              AND cancelled IS NULL
+                            RETURNING id"""
+  state = None
+  with conn.cursor() as cur:
+    cur.execute(
+      query_cancel_queued, (error_message, retention_period, request_id)
+    )
+    if cur.fetchone() is not None:
+      state = 'queued'
+      __notify_job_completed(cur, request_id)
+    else:
+      cur.execute(query_cancel_running, (request_id, ))
+      if cur.fetchone() is not None:
+        state = 'running'
+        cur.execute(
+          """SELECT pg_notify(%s, %s)""", (JOB_CANCELLED_CHANNEL, request_id)
+        )
+    conn.commit()
+  return state
+
+@metrics.DB_OPERATION_SECONDS.time(operation='record_failed_request')
+def record_failed_request(conn, request_id, error_message,
+                          retention_period: float = None,
+                          worker_id: str = None) -> bool:
   """
   Update the request status of the request on the DB
   for a request failed before start of execution.
 
   Also a possible error message is set in std_err field.
+  The request is to be cleaned after retention_period seconds
+  (never if None).
+  With worker_id, for a request claimed by a worker (see claim_request),
+  the request is updated only if still held by the worker and not ended.
+  Listeners on JOB_COMPLETED_CHANNEL are notified on commit.
+
+  Returns False, with nothing updated, if the request was not updated.
   """
   query_update = """UPDATE request 
-                    SET (end_processing, exit_code, std_out, std_err)
-                        = (NOW(), -1, '', %s)
+                    SET (end_processing, exit_code, std_out, std_err,
+                         time_to_clean)
+                        = (NOW(), -1, '', %s,
+                           NOW() + %s * INTERVAL '1 second')
                     WHERE id = %s"""
+  parameters = (error_message, retention_period, request_id)
   with conn.cursor() as cur:
-    cur.execute(query_update, (error_message, request_id))
+    if worker_id is not None:
+      query_update += __FENCE_CONDITION
+      parameters += (worker_id, )
+    cur.execute(query_update, parameters)
+    updated = cur.rowcount > 0
+    if updated:
+      __notify_job_completed(cur, request_id)
     conn.commit()
+  return updated
       
-def record_completed_request(conn, request_id, outcome, suppress_stdout):
+def __compress_output(text: str):
+  """
+  Returns the pair (text, compressed) of the values of an output
+  to store on the DB, in columns std_out/std_err and
+  std_out_compressed/std_err_compressed.
+
+  Outputs larger than the compression threshold (in UTF-8 bytes)
+  are stored compressed with zlib, with an empty text.
+  """
+
+  if text is None or __compression_threshold <= 0:
+    return text, None
+  data = text.encode('utf-8')
+  if len(data) <= __compression_threshold:
+    return text, None
+  compressed = zlib.compress(data, __compression_level)
+  if len(compressed) >= len(data):
+    return text, None
+  return '', psycopg2.Binary(compressed)
+
+def __decompress_outputs(job_info: dict) -> dict:
+  """
+  Replace in the job information, as read from the DB,
+  the compressed outputs with their text.
+  """
+
+  for name in ('std_out', 'std_err'):
+    compressed = job_info.pop(name + '_compressed', None)
+    if compressed is not None:
+      job_info[name] = zlib.decompress(compressed).decode('utf-8')
+  return job_info
+
+@metrics.DB_OPERATION_SECONDS.time(operation='record_completed_request')
+def record_completed_request(conn, request_id, exit_code,
+                             std_out, std_err, std_out_bytes, std_err_bytes,
+                             retention_period: float = None,
+                             resource_usage: dict = None,
+                             std_out_ref: str = None,
+                             std_err_ref: str = None,
+                             worker_id: str = None) -> bool:
   """
   Update the request status of the request on the DB
   for a completed request.
 
   All returned information (exit code, std_out, std_err)
-  are stored in the DB.
+  are stored in the DB, together with the full size in bytes
+  of the outputs (std_out and std_err may be truncated).
+  The resources used by the code are given as dictionary with keys:
+  peak_rss_kb, user_cpu_time, system_cpu_time, wall_time (seconds).
+  Outputs kept in the output storage have their reference in
+  std_out_ref, std_err_ref.
+  Outputs larger than the compression threshold are stored compressed
+  (see get_job_info).
+  The request is to be cleaned after retention_period seconds
+  (never if None).
+  With worker_id, for a request claimed by a worker (see claim_request),
+  the request is updated only if still held by the worker and not ended.
+  Listeners on JOB_COMPLETED_CHANNEL are notified on commit.
+
+  Returns False, with nothing updated, if the request was not updated.
   """
+  resource_usage = resource_usage or {}
+  std_out, std_out_compressed = __compress_output(std_out)
+  std_err, std_err_compressed = __compress_output(std_err)
   query_update = """UPDATE request 
-                    SET (end_processing, exit_code, std_out, std_err)
-                        = (NOW(), %s, %s, %s)
+                    SET (end_processing, exit_code, std_out, std_err,
+                         std_out_bytes, std_err_bytes, time_to_clean,
+                         peak_rss_kb, user_cpu_time, system_cpu_time,
+                         wall_time, std_out_ref, std_err_ref,
+                         std_out_compressed, std_err_compressed)
+                        = (NOW(), %s, %s, %s, %s, %s,
+                           NOW() + %s * INTERVAL '1 second',
+                           %s, %s, %s, %s, %s, %s, %s, %s)
                     WHERE id = %s"""
+  parameters = (
+    exit_code, std_out, std_err, std_out_bytes, std_err_bytes,
+    retention_period,
+    resource_usage.get('peak_rss_kb'), resource_usage.get('user_cpu_time'),
+    resource_usage.get('system_cpu_time'), resource_usage.get('wall_time'),
+    std_out_ref, std_err_ref, std_out_compressed, std_err_compressed,
+    request_id
+  )
+  if worker_id is not None:
+    query_update += __FENCE_CONDITION
+    parameters += (worker_id, )
   with conn.cursor() as cur:
-    cur.execute(
-      query_update,
-      (outcome.returncode, outcome.stdout if (not suppress_stdout) else "",
-       outcome.stderr, request_id)
-    )
+    cur.execute(query_update, parameters)
+    updated = cur.rowcount > 0
+    if updated:
+      __notify_job_completed(cur, request_id)
     conn.commit()
+  return updated
       
+@metrics.DB_OPERATION_SECONDS.time(operation='find_result')
+def find_result(conn, service_id: str, result_key: str, ttl: float):
+  """
+  Returns the id of the most recent request of the service
+  with the given result_key, ended successfully less than ttl seconds ago
+  and recorded as reusable (see record_result_size);
+  None if there is none.
+  """
+  query_select = """SELECT id
+                    FROM request
+                    WHERE service = %s AND result_key = %s
+                      AND result_bytes IS NOT NULL AND exit_code = 0
+                      AND end_processing > NOW() - %s * INTERVAL '1 second'
+                    ORDER BY end_processing DESC
+                    LIMIT 1"""
+  with conn.cursor() as cur:
+    cur.execute(query_select, (service_id, result_key, ttl))
+    row = cur.fetchone()
+  return row[0] if row is not None else None
+
+@metrics.DB_OPERATION_SECONDS.time(operation='add_reused_request')
+def add_reused_request(conn, service_id: str, request_id: str,
+                       parameters: "dict[str, str]", source_id: str,
+                       suppress_stdout: bool,
+                       retention_period: float = None,
+                       std_out_ref: str = None,
+                       std_err_ref: str = None) -> bool:
+  """
+  Create a new record for the request, already ended with the outcome
+  of the request source_id, together with its parameters,
+  in a single transaction.
+  The standard output is not copied with suppress_stdout.
+  Outputs of source_id kept in the output storage are referenced
+  by std_out_ref, std_err_ref: the copies stored for the request.
+  Listeners on JOB_COMPLETED_CHANNEL are notified on commit.
+
+  Returns False, recording nothing, if source_id is no more on the DB.
+  """
+  query_insert = """INSERT INTO request(id, service, received,
+                                        start_processing, end_processing,
+                                        exit_code, std_out, std_err,
+                                        std_out_compressed,
+                                        std_err_compressed,
+                                        std_out_bytes, std_err_bytes,
+                                        std_out_ref, std_err_ref,
+                                        time_to_clean, reused_from)
+                    SELECT %s, service, NOW(), NOW(), NOW(),
+                           exit_code,
+                           CASE WHEN %s THEN '' ELSE std_out END, std_err,
+                           CASE WHEN %s THEN NULL ELSE std_out_compressed END,
+                           std_err_compressed,
+                           std_out_bytes, std_err_bytes, %s, %s,
+                           NOW() + %s * INTERVAL '1 second', id
+                    FROM request
+                    WHERE id = %s AND service = %s
+                      AND end_processing IS NOT NULL"""
+  query_insert_params = """INSERT INTO request_parameter(request_id, name, value)
+                           VALUES %s"""
+  try:
+    with conn.cursor() as cur:
+      cur.execute(
+        query_insert,
+        (request_id, suppress_stdout, suppress_stdout,
+         None if suppress_stdout else std_out_ref, std_err_ref,
+         retention_period, source_id, service_id)
+      )
+      if cur.rowcount == 0:
+        conn.rollback()
+        return False
+      if parameters:
+        psycopg2.extras.execute_values(
+          cur, query_insert_params,
+          [(request_id, name, value) for name, value in parameters.items()],
+          page_size=1000
+        )
+      __notify_job_completed(cur, request_id)
+    conn.commit()
+  except Exception:
+    conn.rollback()
+    raise
+  return True
+
+@metrics.DB_OPERATION_SECONDS.time(operation='record_result_size')
+def record_result_size(conn, service_id: str, request_id: str,
+                       result_bytes: int, ttl: float,
+                       max_entries: int, max_bytes: int) -> None:
+  """
+  Record the request, ended successfully, as reusable by later identical
+  requests, with the size of its result (outputs and files).
+
+  Then the oldest reusable results of the service are evicted
+  (no more reusable) beyond max_entries results or max_bytes bytes
+  in total, together with those ended more than ttl seconds ago.
+  """
+  query_update = """UPDATE request
+                    SET result_bytes = %s
+                    WHERE id = %s AND result_key IS NOT NULL
+                      AND exit_code = 0"""
+  query_evict = """UPDATE request
+                   SET result_key = NULL
+                   WHERE id IN (
+                     SELECT id
+                     FROM (SELECT id, end_processing,
+                                  ROW_NUMBER() OVER newest AS position,
+                                  SUM(result_bytes) OVER newest AS total_bytes
+                           FROM request
+                           WHERE service = %s AND result_key IS NOT NULL
+                             AND result_bytes IS NOT NULL
+                           WINDOW newest AS (ORDER BY end_processing DESC)
+                          ) AS results
+                     WHERE position > %s OR total_bytes > %s
+                       OR end_processing
+                          < NOW() - %s * INTERVAL '1 second')"""
+  try:
+    with conn.cursor() as cur:
+      cur.execute(query_update, (result_bytes, request_id))
+      cur.execute(query_evict, (service_id, max_entries, max_bytes, ttl))
+    conn.commit()
+  except Exception:
+    conn.rollback()
+    raise
+
+@metrics.DB_OPERATION_SECONDS.time(operation='claim_request')
+def claim_request(conn, service_id: str, worker_id: str,
+                  lease_duration: float, max_running_per_client: int = None):
+  """
+  Claim for the worker the next request of the service queued
+  for the workers, recording its start.
+
+  Requests are claimed by priority (higher first); at equal priority
+  the request of the client with fewer running requests comes first
+  (fair share), then the oldest one.
+  With max_running_per_client given, the requests of a client already
+  running as many requests are skipped (requests without client
+  are not limited); concurrent claims may exceed the limit briefly.
+  A request whose lease expired (its worker stopped renewing it,
+  see renew_leases) is claimed again.
+  Requests locked by another worker claiming at the same time are skipped.
+  The claim holds for lease_duration seconds.
+
+  Returns a dictionary with keys id, arguments (of the code),
+  or None if there is nothing to claim.
+  """
+  query_claim = """WITH running AS (
+                     SELECT client, count(*) AS requests
+                     FROM request
+                     WHERE service = %(service)s AND end_processing IS NULL
+                       AND start_processing IS NOT NULL
+                       AND client IS NOT NULL
+                     GROUP BY client)
+                   UPDATE request
+                   SET (start_processing, worker_id, heartbeat, lease_expires)
+                       = (NOW(), %(worker_id)s, NOW(),
+                          NOW() + %(lease_duration)s * INTERVAL '1 second')
+                   WHERE id = (
+                     SELECT request.id
+                     FROM request
+                          LEFT JOIN running
+                          ON running.client = request.client
+                     WHERE service = %(service)s AND end_processing IS NULL
+                       AND cancelled IS NULL AND arguments IS NOT NULL
+                       AND (start_processing IS NULL
+                            OR lease_expires < NOW())
+                       AND (%(max_running)s::integer IS NULL
+                            OR request.client IS NULL
+                            OR COALESCE(running.requests, 0)
+                               < %(max_running)s::integer)
+                     ORDER BY priority DESC, COALESCE(running.requests, 0),
+                              received
+                     LIMIT 1
+                     FOR UPDATE OF request SKIP LOCKED)
+                   RETURNING id, arguments"""
+  try:
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+      cur.execute(query_claim, {
+        'service': service_id, 'worker_id': worker_id,
+        'lease_duration': lease_duration,
+        'max_running': max_running_per_client,
+      })
+      claimed = cur.fetchone()
+    conn.commit()
+  except Exception:
+    conn.rollback()
+    raise
+  return claimed
+
+@metrics.DB_OPERATION_SECONDS.time(operation='renew_leases')
+def renew_leases(conn, worker_id: str, request_ids: list,
+                 lease_duration: float) -> dict:
+  """
+  Extend by lease_duration seconds the leases of the worker
+  on the requests it is running, recording the heartbeat.
+
+  Returns a dictionary request id -> True if cancelled,
+  for the requests whose lease is still held by the worker:
+  the others were claimed again by another worker.
+  """
+  query_renew = """UPDATE request
+                   SET (heartbeat, lease_expires)
+                       = (NOW(), NOW() + %s * INTERVAL '1 second')
+                   WHERE id = ANY(%s) AND worker_id = %s
+                     AND end_processing IS NULL
+                   RETURNING id, cancelled IS NOT NULL"""
+  try:
+    with conn.cursor() as cur:
+      cur.execute(query_renew, (lease_duration, request_ids, worker_id))
+      held = dict(cur.fetchall())
+    conn.commit()
+  except Exception:
+    conn.rollback()
+    raise
+  return held
+
+@metrics.DB_OPERATION_SECONDS.time(operation='holds_lease')
+def holds_lease(conn, worker_id: str, request_id: str) -> bool:
+  """
+  Returns True if the request, not ended, is still held by the worker:
+  False if it was claimed again by another worker.
+  """
+  query_select = """SELECT 1
+                    FROM request
+                    WHERE id = %s AND worker_id = %s
+                      AND end_processing IS NULL"""
+  with conn.cursor() as cur:
+    cur.execute(query_select, (request_id, worker_id))
+    held = cur.fetchone() is not None
+  conn.commit()
+  return held
+
+@metrics.DB_OPERATION_SECONDS.time(operation='end_abandoned_requests')
+def end_abandoned_requests(conn, service_id: str, error_message: str,
+                           retention_period: float = None) -> list:
+  """
+  Record as ended, with exit code -1 and error_message in std_err,
+  the cancelled requests of the service whose lease expired:
+  their worker stopped before recording their end.
+
+  Returns the list of the ids of the requests ended.
+  """
+  query_end = """UPDATE request
+                 SET (end_processing, exit_code, std_out, std_err,
+                      time_to_clean)
+                     = (NOW(), -1, '', %s, NOW() + %s * INTERVAL '1 second')
+                 WHERE service = %s AND end_processing IS NULL
+                   AND cancelled IS NOT NULL AND lease_expires < NOW()
+                 RETURNING id"""
+  try:
+    with conn.cursor() as cur:
+      cur.execute(query_end, (error_message, retention_period, service_id))
+      ended = [row[0] for row in cur.fetchall()]
+      for request_id in ended:
+        __notify_job_completed(cur, request_id)
+    conn.commit()
+  except Exception:
+    conn.rollback()
+    raise
+  return ended
+
+@metrics.DB_OPERATION_SECONDS.time(operation='delete_expired_requests')
+def delete_expired_requests(conn, service_id: str, batch_size: int):
+  """
+  Remove from the DB at most batch_size requests of the service
+  whose time_to_clean has passed, together with their parameters.
+
+  Requests locked by another process doing the same are skipped.
+  Returns a list of dictionaries, one per removed request,
+  with keys: id, db_bytes (size of the stored outputs).
+  """
+  query_select = """SELECT id,
+                           COALESCE(octet_length(std_out), 0)
+                           + COALESCE(octet_length(std_err), 0)
+                           + COALESCE(octet_length(std_out_compressed), 0)
+                           + COALESCE(octet_length(std_err_compressed), 0)
+                           AS db_bytes
+                    FROM request
+                    WHERE service = %s AND time_to_clean < NOW()
+                    ORDER BY time_to_clean
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED"""
+  query_delete_params = """DELETE FROM request_parameter
+                           WHERE request_id = ANY(%s)"""
+  query_delete_requests = """DELETE FROM request WHERE id = ANY(%s)"""
+  try:
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+      cur.execute(query_select, (service_id, batch_size))
+      expired = cur.fetchall()
+      if expired:
+        ids = [row['id'] for row in expired]
+        cur.execute(query_delete_params, (ids, ))
+        cur.execute(query_delete_requests, (ids, ))
+    conn.commit()
+  except Exception:
+    conn.rollback()
+    raise
+  return expired
+
+@metrics.DB_OPERATION_SECONDS.time(operation='get_job_info')
 def get_job_info(conn, id_request: str):
   """
   Returns a dictionary with the informations of the job status as on the DB.
+
+  The parameters of the request are returned, in the same single query,
+  as a dictionary name -> value under key 'parameters'.
+  Compressed outputs are returned decompressed.
   """
-  with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+  with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
     query_select = """SELECT service, received, start_processing, 
                              end_processing, time_to_clean, 
-                             exit_code, std_out, std_err
+                             exit_code, std_out, std_err,
+                             std_out_compressed, std_err_compressed,
+                             std_out_bytes, std_err_bytes,
+                             peak_rss_kb, user_cpu_time, system_cpu_time,
+                             wall_time, cancelled, reused_from,
+                             std_out_ref, std_err_ref, priority, client,
+                             COALESCE(
+                               (SELECT json_object_agg(name, value)
+                                FROM request_parameter
+                                WHERE request_id = request.id),
+                               '{}'::json) AS parameters
                       FROM request
                       WHERE id = %s"""
     cur.execute(query_select, (id_request, ))
-    return cur.fetchone()
+    job_info = cur.fetchone()
+  return __decompress_outputs(job_info) if job_info is not None else None
+
+# Conditions selecting the requests by status.
+JOB_STATUS_CONDITIONS = {
+  'queued': "start_processing IS NULL AND end_processing IS NULL",
+  'running': "start_processing IS NOT NULL AND end_processing IS NULL",
+  'ended': "end_processing IS NOT NULL",
+  'cancelled': "cancelled IS NOT NULL",
+}
+
+@metrics.DB_OPERATION_SECONDS.time(operation='get_jobs_info')
+def get_jobs_info(conn, service_id: str, ids: list = None,
+                  status: str = None, received_since=None,
+                  include_output: bool = True, limit: int = 1000) -> list:
+  """
+  Returns, with a single query, a list of dictionaries with the
+  informations of the status of the jobs of the service as on the DB,
+  as get_job_info plus key 'id', in order of arrival.
+
+  The jobs are selected by id (any of ids), by status
+  (a key of JOB_STATUS_CONDITIONS) and by time of arrival (not before
+  received_since), each criterion applied only if given;
+  at most limit jobs are returned.
+  Without include_output std_out and std_err are not read;
+  compressed outputs are returned decompressed.
+  """
+  conditions = [psycopg2.sql.SQL("service = %s")]
+  query_params = [service_id]
+  if ids is not None:
+    conditions.append(psycopg2.sql.SQL("id = ANY(%s)"))
+    query_params.append(list(ids))
+  if status is not None:
+    conditions.append(psycopg2.sql.SQL(JOB_STATUS_CONDITIONS[status]))
+  if received_since is not None:
+    conditions.append(psycopg2.sql.SQL("received >= %s"))
+    query_params.append(received_since)
+  query_params.append(limit)
+
+  output_columns = psycopg2.sql.SQL(
+    "std_out, std_err, std_out_compressed, std_err_compressed,"
+    if include_output else ""
+  )
+  query_select = psycopg2.sql.SQL(
+    """SELECT id, service, received, start_processing,
+              end_processing, time_to_clean,
+              exit_code, {0}
+              std_out_bytes, std_err_bytes,
+              peak_rss_kb, user_cpu_time, system_cpu_time,
+              wall_time, cancelled, reused_from,
+              std_out_ref, std_err_ref, priority, client,
+              COALESCE(
+                (SELECT json_object_agg(name, value)
+                 FROM request_parameter
+                 WHERE request_id = request.id),
+                '{{}}'::json) AS parameters
+       FROM request
+       WHERE {1}
+       ORDER BY received
+       LIMIT %s"""
+  ).format(output_columns, psycopg2.sql.SQL(" AND ").join(conditions))
+  with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+    cur.execute(query_select, query_params)
+    return [__decompress_outputs(job_info) for job_info in cur.fetchall()]
 
 # Run the configuration of the module as initialization step.
 __config()
+config.on_reload(__config)
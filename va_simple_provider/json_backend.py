@@ -0,0 +1,67 @@
+"""
+    JSON backends of the application: the Flask JSON provider
+    (app.json) used for the responses, error messages included,
+    and for the decoding of the request bodies.
+
+    With the optional package orjson (pip install orjson), selected
+    with json_backend=orjson in application.ini, the responses
+    are encoded in C, much faster than with the standard module json,
+    mainly for large outputs of the jobs. The values are those
+    of the default provider of Flask (keys sorted, dates in HTTP format);
+    the documents are compact, with non-ASCII characters as they are.
+    The request bodies are always decoded by the standard module json:
+    orjson decodes integers of more than 64 bits as floats, changing
+    the values of the parameters passed to the code.
+"""
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+# Names of the backends, for parameter json_backend of application.ini.
+STANDARD_BACKEND = 'json'
+ORJSON_BACKEND = 'orjson'
+
+class OrjsonProvider(DefaultJSONProvider):
+  """
+  Flask JSON provider encoding with orjson.
+
+  Arguments of the standard module json (e.g. indent, in debug mode)
+  and values orjson cannot encode (e.g. integers of more than 64 bits)
+  are handled by the default provider, as is all the decoding.
+  """
+
+  def dumps(self, obj, **kwargs) -> str:
+    if kwargs:
+      return super().dumps(obj, **kwargs)
+    # Dates are passed to default(), which formats them as the default
+    # provider does.
+    option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    if self.sort_keys:
+      option |= orjson.OPT_SORT_KEYS
+    try:
+      return orjson.dumps(obj, default=self.default, option=option).decode()
+    except orjson.JSONEncodeError:
+      return super().dumps(obj)
+
+def is_available(name: str) -> bool:
+  """
+  Returns True if the backend can be used (its package is installed).
+  """
+
+  return name == STANDARD_BACKEND or (
+    name == ORJSON_BACKEND and orjson is not None
+  )
+
+def create_provider(app, name: str = None) -> DefaultJSONProvider:
+  """
+  Returns the JSON provider of the backend for app,
+  by default the standard module json.
+  """
+
+  if name == ORJSON_BACKEND:
+    return OrjsonProvider(app)
+  return DefaultJSONProvider(app)
@@ -0,0 +1,104 @@
+"""
+    Thread-safe LRU cache, bounded by number of entries,
+    by total size of the entries and by their time to live.
+"""
+
+import time
+import threading
+
+from collections import OrderedDict
+
+
+class LRUCache:
+  """
+  Least recently used cache.
+
+  Each entry is stored with its size, as computed by the caller:
+  when max_entries or max_bytes would be exceeded the least recently
+  used entries are evicted. Entries older than ttl seconds are never
+  returned.
+  """
+
+  def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+    self._max_entries = max_entries
+    self._max_bytes = max_bytes
+    self._ttl = ttl
+    # key -> (value, size, expiry time); most recently used at the end.
+    self._entries = OrderedDict()
+    self._bytes = 0
+    self._lock = threading.Lock()
+    self._statistics = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+  def get(self, key):
+    """
+    Returns the value cached for key, or None.
+    """
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and entry[2] < time.monotonic():
+        self._remove(key)
+        entry = None
+      if entry is None:
+        self._statistics['misses'] += 1
+        return None
+      self._entries.move_to_end(key)
+      self._statistics['hits'] += 1
+      return entry[0]
+
+  def put(self, key, value, size: int) -> None:
+    """
+    Cache value for key. Values larger than max_bytes are not cached.
+    """
+    if self._max_entries < 1 or size > self._max_bytes:
+      return
+    with self._lock:
+      if key in self._entries:
+        self._remove(key)
+      self._entries[key] = (value, size, time.monotonic() + self._ttl)
+      self._bytes += size
+      while (len(self._entries) > self._max_entries
+             or self._bytes > self._max_bytes):
+        self._remove(next(iter(self._entries)))
+        self._statistics['evictions'] += 1
+
+  def resize(self, max_entries: int, max_bytes: int, ttl: float) -> None:
+    """
+    Change the limits of the cache, keeping its entries within them:
+    the least recently used are evicted, the time to live
+    of each entry is counted from when it was cached.
+    """
+    with self._lock:
+      ttl_change = ttl - self._ttl
+      self._max_entries = max_entries
+      self._max_bytes = max_bytes
+      self._ttl = ttl
+      if ttl_change:
+        for key, (value, size, expiry) in self._entries.items():
+          self._entries[key] = (value, size, expiry + ttl_change)
+      while self._entries and (len(self._entries) > self._max_entries
+                               or self._bytes > self._max_bytes):
+        self._remove(next(iter(self._entries)))
+        self._statistics['evictions'] += 1
+
+  def invalidate(self, key) -> None:
+    """
+    Remove the value cached for key, if any.
+    """
+    with self._lock:
+      if key in self._entries:
+        self._remove(key)
+
+  def get_statistics(self) -> dict:
+    """
+    Returns a snapshot of the cache usage counters.
+    """
+    with self._lock:
+      statistics = dict(self._statistics)
+      statistics['entries'] = len(self._entries)
+      statistics['bytes'] = self._bytes
+    return statistics
+
+  def _remove(self, key) -> None:
+    # Called holding the lock.
+    value, size, expiry = self._entries.pop(key)
+    self._bytes -= size
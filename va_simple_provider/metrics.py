@@ -0,0 +1,286 @@
+"""
+    Metrics of the application, exposed in the Prometheus text format
+    by the route /metrics.
+
+    Metrics are kept per process: with more processes (e.g. gunicorn
+    workers) each process must be scraped, or the values summed.
+"""
+
+import math
+import time
+import threading
+
+from contextlib import ContextDecorator
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Bucket upper bounds, in seconds, for latencies.
+DEFAULT_BUCKETS = (
+  0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+  1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0
+)
+
+# Single underscore: also used inside the metric classes.
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _format_value(value) -> str:
+  if value == math.inf:
+    return '+Inf'
+  return repr(float(value))
+
+def _format_labels(label_names, label_values, extra='') -> str:
+  pairs = [
+    '{0}="{1}"'.format(
+      name,
+      str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    )
+    for name, value in zip(label_names, label_values)
+  ]
+  if extra:
+    pairs.append(extra)
+  return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+  """
+  Base class of the metrics: a family of values, one per combination
+  of label values.
+  """
+
+  metric_type = None
+
+  def __init__(self, name: str, documentation: str, label_names=()):
+    self.name = name
+    self.documentation = documentation
+    self.label_names = tuple(label_names)
+    self._values = {}
+    self._lock = threading.Lock()
+    with _registry_lock:
+      _registry.append(self)
+
+  def _key(self, labels: dict) -> tuple:
+    return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+  def samples(self):
+    """
+    Returns a list of (name suffix, label values, extra label, value).
+    """
+    with self._lock:
+      return [('', key, '', value) for key, value in self._values.items()]
+
+
+class Counter(_Metric):
+  """
+  Value that only increases.
+  """
+
+  metric_type = 'counter'
+
+  def inc(self, amount: float = 1, **labels) -> None:
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+  """
+  Value that goes up and down.
+
+  A function may be set to compute the values at collection time:
+  it returns either a number (metric without labels) or a dictionary
+  tuple of label values -> number.
+  """
+
+  metric_type = 'gauge'
+
+  def __init__(self, name: str, documentation: str, label_names=()):
+    super().__init__(name, documentation, label_names)
+    self._function = None
+
+  def set(self, value: float, **labels) -> None:
+    with self._lock:
+      self._values[self._key(labels)] = value
+
+  def inc(self, amount: float = 1, **labels) -> None:
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def dec(self, amount: float = 1, **labels) -> None:
+    self.inc(-amount, **labels)
+
+  def set_function(self, function) -> None:
+    self._function = function
+
+  def samples(self):
+    if self._function is None:
+      return super().samples()
+    values = self._function()
+    if not isinstance(values, dict):
+      values = {(): values}
+    return [('', key, '', value) for key, value in values.items()]
+
+
+class _Timer(ContextDecorator):
+  """
+  Observe the time spent in a with block, or in a decorated function.
+  """
+
+  def __init__(self, histogram, labels: dict):
+    self._histogram = histogram
+    self._labels = labels
+    self._starts = threading.local()
+
+  def __enter__(self):
+    self._starts.__dict__.setdefault('stack', []).append(time.monotonic())
+    return self
+
+  def __exit__(self, *exc_info):
+    start = self._starts.stack.pop()
+    self._histogram.observe(time.monotonic() - start, **self._labels)
+    return False
+
+
+class Histogram(_Metric):
+  """
+  Distribution of observed values in cumulative buckets.
+  """
+
+  metric_type = 'histogram'
+
+  def __init__(self, name: str, documentation: str, label_names=(),
+               buckets=DEFAULT_BUCKETS):
+    super().__init__(name, documentation, label_names)
+    self._buckets = tuple(sorted(buckets)) + (math.inf, )
+
+  def observe(self, value: float, **labels) -> None:
+    key = self._key(labels)
+    with self._lock:
+      counts = self._values.get(key)
+      if counts is None:
+        # Counts per bucket, then sum.
+        counts = self._values[key] = [0] * len(self._buckets) + [0.0]
+      for index, bound in enumerate(self._buckets):
+        if value <= bound:
+          counts[index] += 1
+          break
+      counts[-1] += value
+
+  def time(self, **labels) -> _Timer:
+    """
+    Returns a context manager, usable also as decorator,
+    observing the elapsed time in seconds.
+    """
+    return _Timer(self, labels)
+
+  def samples(self):
+    samples = []
+    with self._lock:
+      for key, counts in self._values.items():
+        cumulative = 0
+        for bound, count in zip(self._buckets, counts):
+          cumulative += count
+          samples.append(
+            ('_bucket', key, 'le="{0}"'.format(_format_value(bound)),
+             cumulative)
+          )
+        samples.append(('_sum', key, '', counts[-1]))
+        samples.append(('_count', key, '', cumulative))
+    return samples
+
+
+def render() -> str:
+  """
+  Returns all the metrics in the Prometheus text exposition format.
+  """
+
+  lines = []
+  with _registry_lock:
+    metrics = list(_registry)
+  for metric in metrics:
+    lines.append('# HELP {0} {1}'.format(metric.name, metric.documentation))
+    lines.append('# TYPE {0} {1}'.format(metric.name, metric.metric_type))
+    for suffix, label_values, extra, value in metric.samples():
+      lines.append('{0}{1}{2} {3}'.format(
+        metric.name, suffix,
+        _format_labels(metric.label_names, label_values, extra),
+        _format_value(value)
+      ))
+  return '\n'.join(lines) + '\n'
+
+
+# Metrics of the application.
+
+HTTP_REQUEST_SECONDS = Histogram(
+  'va_http_request_duration_seconds',
+  'Time to serve HTTP requests, up to the response headers.',
+  ('endpoint', 'method', 'status')
+)
+SYNCH_WAIT_SECONDS = Histogram(
+  'va_synch_request_wait_seconds',
+  'Time synchronous /execute requests wait for the end of the job.'
+)
+DB_OPERATION_SECONDS = Histogram(
+  'va_db_operation_duration_seconds',
+  'Time of the operations on the DB, by function of module db_utils.',
+  ('operation', )
+)
+DB_CONNECTION_WAIT_SECONDS = Histogram(
+  'va_db_connection_wait_seconds',
+  'Time waited to get a connection from the pool.'
+)
+DB_POOL_CONNECTIONS = Gauge(
+  'va_db_pool_connections',
+  'Connections of the pool, by state.',
+  ('state', )
+)
+JOBS_SUBMITTED = Counter(
+  'va_jobs_submitted_total',
+  'Jobs accepted.'
+)
+JOBS_REUSED = Counter(
+  'va_jobs_reused_total',
+  'Jobs served with the result of an identical earlier job (memoization).'
+)
+JOBS_REJECTED = Counter(
+  'va_jobs_rejected_total',
+  'Jobs rejected because the queue was full.'
+)
+JOBS_ENDED = Counter(
+  'va_jobs_ended_total',
+  'Jobs ended, by outcome: success (exit code 0), failure, error '
+  '(code not run or outcome not recorded).',
+  ('outcome', )
+)
+JOB_QUEUE_WAIT_SECONDS = Histogram(
+  'va_job_queue_wait_seconds',
+  'Time jobs waited in the queue for a free worker.'
+)
+JOB_START_LATENCY_SECONDS = Histogram(
+  'va_job_start_latency_seconds',
+  'Time from a worker taking the job to the start of the code '
+  '(DB update included).'
+)
+JOB_RUNTIME_SECONDS = Histogram(
+  'va_job_runtime_seconds',
+  'Run time of the code.'
+)
+JOB_RESULT_WRITE_SECONDS = Histogram(
+  'va_job_result_write_seconds',
+  'Time from the end of the code to its outcome recorded on the DB.'
+)
+JOB_OUTPUT_BYTES = Counter(
+  'va_job_output_bytes_total',
+  'Bytes written by the codes, by stream.',
+  ('stream', )
+)
+ACTIVE_SUBPROCESSES = Gauge(
+  'va_active_subprocesses',
+  'Codes running now.'
+)
+QUEUED_JOBS = Gauge(
+  'va_queued_jobs',
+  'Jobs accepted but not yet started.'
+)
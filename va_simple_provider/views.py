@@ -13,28 +13,77 @@
 
 import re
 import os
+import math
+import gzip
+import zlib
+import codecs
 import logging
 import numbers
 import time
 
+from datetime import datetime
+
 from flask import request, json, abort, render_template, Response, send_from_directory
+from flask import make_response, g, send_file
 from werkzeug.exceptions import BadRequest
 from werkzeug.exceptions import HTTPException
-from configparser import ConfigParser
+from werkzeug.http import parse_accept_header
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, NeedData
 from json.decoder import JSONDecodeError
 from collections.abc import Mapping
+from contextlib import contextmanager
 
 from va_simple_provider import app, configuration_directory
+from va_simple_provider import config
 
 from va_simple_provider.custom_exceptions import BaseCustomException
 from va_simple_provider.custom_exceptions import AppCustomException
+from va_simple_provider.custom_exceptions import ServiceBusyException
 from va_simple_provider import db_utils
+from va_simple_provider import json_backend
+from va_simple_provider import metrics
 from va_simple_provider.controllers import code_handler
+from va_simple_provider.controllers import job_executor
+from va_simple_provider.controllers import retention_handler
 
 __max_param_len = None
+__compress_responses = None
+__compression_min_size = None
+__compression_level = None
+# Declared parameters (section 'parameters'): name -> (type, JSON types
+# of the values), None if any parameter is accepted.
+__parameter_types = None
 FORMAT_TAG = "-out_format"
 HTML_FORMAT = "html"
 JSON_FORMAT = "json"
+# Maximum number of jobs returned by /jobs_info.
+MAX_JOBS_INFO = 1000
+# Multipart requests to /execute: name of the part with the JSON
+# description of the job, its maximum size, size of the chunks read.
+MULTIPART_REQUEST_PART = 'request'
+MAX_REQUEST_PART_SIZE = 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Line breaks of the data of Server-Sent Events.
+SSE_LINE_BREAK = re.compile(r'\r\n|\r|\n')
+# Maximum length of the client of a job (application_params).
+MAX_CLIENT_LEN = 255
+# Content codings of the compressed responses, in order of preference,
+# and media types compressed.
+CONTENT_ENCODINGS = ('gzip', 'deflate')
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain')
+# Types of the parameters declared in section 'parameters' of
+# application.ini -> types of their values in the JSON request
+# ('file': input file of a multipart request).
+PARAMETER_TYPES = {
+  'string': (str, ),
+  'integer': (int, ),
+  'number': (int, float),
+  'boolean': (bool, ),
+  'list': (list, ),
+  'file': (),
+}
 
 def __config():
   """
@@ -45,6 +94,13 @@ def __config():
     succesfull_job_submit_url
     max_allowed_parameter_len
     max_allowed_request_body_size
+    compress_responses (optional, default: True)
+    compression_min_size (optional, default: 1024 bytes)
+    compression_level (optional, default: 6)
+    json_backend (optional, default: json)
+
+  The optional section 'parameters' declares the only parameters
+  accepted, as name = type (see PARAMETER_TYPES).
   """
 
   filename = os.path.join(configuration_directory, 'application.ini')
@@ -55,10 +111,7 @@ def __config():
 
   max_body_size_key = 'max_allowed_request_body_size'
 
-  # create a parser
-  parser = ConfigParser()
-  # read config file
-  parser.read(filename)
+  parser = config.get_application()
 
   # get section parameters
   section_params = {}
@@ -102,23 +155,307 @@ def __config():
         max_body_size_key, section, os.path.abspath(filename)
       )
     )
+  # Product of the factors, e.g. 16 * 1024 * 1024
+  factors = section_params[max_body_size_key].split('*')
+  if not all(factor.strip() for factor in factors):
+    raise AppCustomException(
+      "Parameter '{0}' in section '{1}' in file '{2}' "
+      "is not a product of integers.".format(
+        max_body_size_key, section, os.path.abspath(filename)
+      )
+    )
   app.config['MAX_CONTENT_LENGTH'] = (
-    int(eval(section_params[max_body_size_key], {}))
+    math.prod(int(factor) for factor in factors)
   )
 
+  global __compress_responses
+  global __compression_min_size
+  global __compression_level
+  try:
+    __compress_responses = parser.getboolean(
+      section, 'compress_responses', fallback=True
+    )
+    __compression_min_size = parser.getint(
+      section, 'compression_min_size', fallback=1024
+    )
+    __compression_level = parser.getint(
+      section, 'compression_level', fallback=6
+    )
+  except ValueError:
+    raise AppCustomException(
+      "Parameter 'compress_responses' must be a boolean, "
+      "'compression_min_size' and 'compression_level' integers "
+      "in section '{0}' in file '{1}'.".format(
+        section, os.path.abspath(filename)
+      )
+    )
+  if not 1 <= __compression_level <= 9:
+    raise AppCustomException(
+      "Parameter 'compression_level' in section '{0}' in file '{1}' "
+      "must be from 1 to 9.".format(section, os.path.abspath(filename))
+    )
+
+  json_backend_key = 'json_backend'
+  backend = parser.get(section, json_backend_key, fallback=None)
+  if backend is not None and not json_backend.is_available(backend):
+    raise AppCustomException(
+      "Parameter '{0}' in section '{1}' in file '{2}' must be '{3}' "
+      "or '{4}' (package orjson installed).".format(
+        json_backend_key, section, os.path.abspath(filename),
+        json_backend.STANDARD_BACKEND, json_backend.ORJSON_BACKEND
+      )
+    )
+  app.json = json_backend.create_provider(app, backend)
+
+  section_parameters = 'parameters'
+  global __parameter_types
+  if parser.has_section(section_parameters):
+    try:
+      __parameter_types = compile_parameter_types(
+        dict(parser.items(section_parameters))
+      )
+    except ValueError as ex:
+      raise AppCustomException(
+        "{0} in section '{1}' in file '{2}'.".format(
+          str(ex), section_parameters, os.path.abspath(filename)
+        )
+      )
+  else:
+    __parameter_types = None
+
   return
 __config()
+config.on_reload(__config)
+
+def is_compressible(body: bytes, mimetype: str) -> bool:
+  """
+  Returns True if a response with the body and media type is sent
+  compressed to the clients accepting it (see compress_body).
+  """
+
+  return (
+    __compress_responses and mimetype in COMPRESSIBLE_MIMETYPES
+    and len(body) >= __compression_min_size
+  )
+
+def compress_body(body: bytes, accept_encoding: str):
+  """
+  Compress the body of a response with the content coding preferred
+  by the client among CONTENT_ENCODINGS, according to the value of
+  its Accept-Encoding header.
+
+  Returns the pair (body, content coding),
+  with the body unchanged and None if no coding is accepted.
+  """
+
+  encoding = parse_accept_header(accept_encoding or '').best_match(
+    CONTENT_ENCODINGS
+  )
+  if encoding == 'gzip':
+    return gzip.compress(body, __compression_level, mtime=0), encoding
+  if encoding == 'deflate':
+    return zlib.compress(body, __compression_level), encoding
+  return body, None
 
 def __check_parameter_name(param_name: str):
   """
   Perform some parameters name check common to files and data.
+
+  Raise BaseCustomException if the name is not acceptable.
   """
 
   if (len(param_name) > __max_param_len):
-    err_msg = (
-      "Parameter name exceed maximum allowed len: '{0}...'."
-    ).format(param_name[0:(__max_param_len-1)])
-    abort(Response(json.dumps({'Message': err_msg}), 400))
+    raise BaseCustomException(
+      "Parameter name exceed maximum allowed len: '{0}...'.".format(
+        param_name[0:(__max_param_len-1)]
+      )
+    )
+
+def compile_parameter_types(declared: dict) -> dict:
+  """
+  Returns the declared parameters (name -> name of type, see
+  PARAMETER_TYPES) as used by convert_parameters().
+
+  Raise ValueError if a type is not known.
+  """
+
+  parameter_types = {}
+  for name, type_name in declared.items():
+    type_name = type_name.strip().lower()
+    if type_name not in PARAMETER_TYPES:
+      raise ValueError(
+        "Type '{0}' of parameter '{1}' is not one of {2}".format(
+          type_name, name, ", ".join(PARAMETER_TYPES)
+        )
+      )
+    parameter_types[name] = (type_name, frozenset(PARAMETER_TYPES[type_name]))
+  return parameter_types
+
+def __list_value(value: list) -> list:
+  return [str(v) for v in value]
+
+def __flag_value(value: bool) -> str:
+  return ""
+
+# JSON value of a parameter -> value passed to the code, by type.
+# The exact type is looked up (bool is also an int).
+__value_conversions = {
+  str: str,
+  list: __list_value,
+  bool: __flag_value,
+  int: str,
+  float: str,
+}
+
+def convert_parameters(code_input_params: Mapping,
+                       parameter_types: dict = None) -> dict:
+  """
+  Returns the parameters passed to the code (strings or lists
+  of strings) from the JSON object code_input_params.
+
+  With parameter_types (see compile_parameter_types) only the declared
+  parameters, with values of their type, are accepted.
+  Raise BaseCustomException if a parameter is not acceptable.
+  """
+
+  string_parameters = {}
+  for name, value in code_input_params.items():
+    conversion = __value_conversions.get(type(value))
+    if parameter_types is None:
+      __check_parameter_name(name)
+      if conversion is None and isinstance(value, numbers.Number):
+        conversion = str
+    else:
+      declared = parameter_types.get(name)
+      if declared is None:
+        raise BaseCustomException(
+          "Parameter '{0}' not allowed.".format(name[0:__max_param_len])
+        )
+      if type(value) not in declared[1]:
+        raise BaseCustomException(
+          "Parameter '{0}' must be of type {1}.".format(name, declared[0])
+        )
+    if conversion is None:
+      raise BaseCustomException(
+        "Unexpected value for parameter '{0}.".format(name)
+      )
+    string_parameters[name] = conversion(value)
+  return string_parameters
+
+def __check_file_parameter(param_name: str):
+  """
+  Check the name of the parameter of an input file.
+
+  Raise BaseCustomException if the name is not acceptable.
+  """
+
+  if __parameter_types is None:
+    __check_parameter_name(param_name)
+    return
+  declared = __parameter_types.get(param_name)
+  if declared is None or declared[0] != 'file':
+    raise BaseCustomException(
+      "Parameter '{0}' is not an input file.".format(
+        param_name[0:__max_param_len]
+      )
+    )
+
+def __parse_execute_entry(json_body):
+  """
+  Validate a job submission, as decoded from the JSON body of /execute.
+
+  Returns the tuple
+  (request_id, synch_execution, string_parameters, priority, client).
+  Raise BaseCustomException if the submission is not acceptable.
+  """
+
+  try:
+    code_input_params = json_body['code_input_params']
+    application_params =  json_body['application_params']
+    request_id = application_params['job_id']
+    synch_execution = application_params.get('synch_execution', True)
+    priority = application_params.get('priority', 0)
+    client = application_params.get('client')
+  except (TypeError, KeyError, AttributeError) as error:
+    # Here logging is required, as we do not want to return
+    # the full JSON to the user.
+    err_msg = "Malformed JSON string for \'inputs\'."
+    app.logger.warning(err_msg + str(error))
+    raise BaseCustomException(err_msg)
+
+  code_handler.check_request_id(request_id)
+  if isinstance(priority, bool) or not isinstance(priority, int):
+    raise BaseCustomException("Priority must be an integer.")
+  if client is not None and not (
+      isinstance(client, str) and 0 < len(client) <= MAX_CLIENT_LEN):
+    raise BaseCustomException(
+      "Client must be a string of at most {0} characters.".format(
+        MAX_CLIENT_LEN
+      )
+    )
+
+  if not isinstance(code_input_params, Mapping):
+    raise BaseCustomException(
+      "JSON string does not represent an object (pairs of name/value)."
+    )
+
+  string_parameters = convert_parameters(code_input_params, __parameter_types)
+
+  return request_id, synch_execution, string_parameters, priority, client
+
+@app.before_request
+def __start_request_timer():
+  g.request_start_time = time.monotonic()
+
+@app.after_request
+def __observe_request_time(response):
+  """
+  Record the time to serve the request, by route (not by URL,
+  to keep the number of distinct label values bounded).
+  """
+  if 'request_start_time' in g:
+    metrics.HTTP_REQUEST_SECONDS.observe(
+      time.monotonic() - g.request_start_time,
+      endpoint=request.url_rule.rule if request.url_rule else '',
+      method=request.method,
+      status=response.status_code
+    )
+  return response
+
+@app.after_request
+def __compress_response(response):
+  """
+  Compress the responses of at least compression_min_size bytes
+  for the clients accepting gzip or deflate.
+
+  Files and streamed responses (job outputs) are sent as they are.
+  The ETag of a compressed response becomes weak: it still matches
+  the If-None-Match of the later requests, compressed or not.
+  """
+  if (response.status_code != 200 or response.direct_passthrough
+      or response.is_streamed or 'Content-Encoding' in response.headers):
+    return response
+  body = response.get_data()
+  if not is_compressible(body, response.mimetype):
+    return response
+
+  response.vary.add('Accept-Encoding')
+  body, encoding = compress_body(body, request.headers.get('Accept-Encoding'))
+  if encoding is None:
+    return response
+  response.set_data(body)
+  response.headers['Content-Encoding'] = encoding
+  etag, weak = response.get_etag()
+  if etag and not weak:
+    response.set_etag(etag, weak=True)
+  return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+  """
+  Return the metrics of this process in the Prometheus text format.
+  """
+  return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/execute', methods=['POST'])
 def do_execute():
@@ -129,24 +466,55 @@ def do_execute():
   Only the following Content-Type are allowed:
   -) text/plain
   -) application/json
+  -) multipart/form-data, with input files (see submit_multipart_request)
 
   If succesfull the request is redirected to a page
   with the ID of the accepted job.
   If unsuccesfull the request is aborted and redirected to error page
   with status code 400 and possibly a meaningfull description.
+  If too many jobs are already queued the request is aborted
+  with status code 503.
   """
 
-  try:
-    content_type = request.headers.get('Content-Type')
-    if not content_type.startswith('application/json'):
+  content_type = request.headers.get('Content-Type')
+  if (content_type or '').startswith('multipart/form-data'):
+    request_id, synch_execution = submit_multipart_request(
+      content_type, request.stream
+    )
+  else:
+    request_id, synch_execution = submit_execute_request(
+      content_type, request.data
+    )
+
+  # Il job è in coda o già partito
+  if not synch_execution:
+    return {}
+  else:
+    # Nota: se ci fosse un problema per il thread di connettersi
+    # e scrivere sul DB, allora fallirebbe anche get_job_info()
+    # con una eccezione ed abort(), terminando la richiesta.
+    with metrics.SYNCH_WAIT_SECONDS.time():
+      code_handler.wait_for_completion(request_id)
+    return get_job_info(request_id)
+
+def submit_execute_request(content_type: str, body: bytes):
+  """
+  Validate the body of a request to /execute and submit the job.
+
+  Returns the pair (request_id, synch_execution).
+  If unsuccesfull the request is aborted (HTTPException raised)
+  as described for do_execute().
+
+  Not depending on the Flask request context,
+  it is shared with the ASGI entry point (module asgi).
+  """
+
+  with __submission_errors():
+    if not (content_type or '').startswith('application/json'):
       err_msg = "Unaccepted content type: '{0}'.".format(content_type)
       abort(Response(json.dumps({'Message': err_msg}), 400))
     try:
-      json_body = json.loads(request.data)
-      code_input_params = json_body['code_input_params']
-      application_params =  json_body['application_params']
-      request_id = application_params['job_id']
-      synch_execution = application_params.get('synch_execution', True)
+      json_body = json.loads(body)
     except (JSONDecodeError, TypeError) as error:
       # Here logging is required, as we do not want to return
       # the full JSON to the user.
@@ -154,31 +522,30 @@ def do_execute():
       app.logger.warning(err_msg + str(error))
       abort(Response(json.dumps({'Message': err_msg}), 400))
 
-    if not isinstance(code_input_params, Mapping):
-      err_msg = "JSON string does not represent an object " \
-                "(pairs of name/value)."
-      abort(Response(json.dumps({'Message': err_msg}), 400))
-    
-    string_parameters = {}
-    for parameter_key in code_input_params.keys():
-      __check_parameter_name(parameter_key)
-      if isinstance(code_input_params[parameter_key], str):
-        string_parameters[parameter_key] = code_input_params[parameter_key]
-      elif isinstance(code_input_params[parameter_key], list):
-        string_parameters[parameter_key] = [
-          str(v) for v in code_input_params[parameter_key]
-        ]
-      elif isinstance(code_input_params[parameter_key], bool):
-        string_parameters[parameter_key] = ""
-      elif isinstance(code_input_params[parameter_key], numbers.Number):
-        string_parameters[parameter_key] = str(code_input_params[parameter_key])
-      else:
-        err_msg = "Unexpected value for parameter '{0}.".format(parameter_key)
-        abort(Response(json.dumps({'Message': err_msg}), 400))
+    request_id, synch_execution, string_parameters, priority, client = (
+      __parse_execute_entry(json_body)
+    )
+
+    code_handler.submit_form_request(
+      string_parameters, request_id, priority, client, synch_execution
+    )
+
+  return request_id, synch_execution
 
-    code_handler.submit_form_request(string_parameters, request_id)
+@contextmanager
+def __submission_errors():
+  """
+  Abort the request, as described for do_execute(),
+  on the exceptions raised within the with block.
+  """
+
+  try:
+    yield
   except HTTPException as error:
     raise error
+  except ServiceBusyException as error:
+    app.logger.warning(str(error))
+    abort(Response(json.dumps({'Message': str(error)}), 503))
   except BaseCustomException as error:
     app.logger.warning(str(error))
     abort(Response(json.dumps({'Message': str(error)}), 400))
@@ -193,67 +560,542 @@ def do_execute():
               "with date and time of the problem."
     abort(Response(json.dumps({'Message': err_msg}), 400))
 
+def submit_multipart_request(content_type: str, stream):
+  """
+  Submit a job whose request to /execute is multipart/form-data:
+  the first part, named 'request', is the JSON object of the body
+  of a JSON request; each following part is an input file, for the
+  parameter named as the part.
 
-  MAX_WAIT = 2.0      # secondi di attesa massima per far partire il thread
-  SLEEP = 0.5         # polling interval
-  start = time.monotonic()
-  while True:
-    job_info = get_job_info(request_id)
-    if job_info['job_info']['start_processing'] is not None:
-      break
-
-    # possibile che il thread sia in partenza
-    if time.monotonic() - start > MAX_WAIT:
-      # thread non partito in tempi ragionevoli:
-      err_msg = "Job not started. Please report to the application manager " \
-                "with date and time of the problem."
-      app.logger.error(err_msg, exc_info=True)
-      abort(Response(json.dumps({'Message': err_msg}), 400))
-      
-    time.sleep(SLEEP)
+  The body is read from stream in chunks: each input file is written,
+  as it is received, to the working directory of the job, and its path
+  is passed to the code as value of its parameter.
+  The JSON object must contain a job_id not yet used.
 
-  # Il thread è partito
-  if not synch_execution:
-    return {}
-  else:
-    while True:
-      job_info = get_job_info(request_id)
-      if job_info['job_info']['end_processing'] is not None:
-        # Nota: se ci fosse un problema per il thread di connettersi
-        # e scrivere sul DB, allora fallirebbe anche get_job_info()
-        # con una eccezione ed abort(), terminando la richiesta.
-        return job_info
-      time.sleep(SLEEP)
+  Returns the pair (request_id, synch_execution).
+  If unsuccesfull the request is aborted (HTTPException raised)
+  as described for do_execute(), and the input files removed.
+  """
+
+  request_id = None
+  try:
+    with __submission_errors():
+      boundary = parse_options_header(content_type)[1].get('boundary')
+      if not boundary:
+        raise BaseCustomException("Multipart request without boundary.")
+      decoder = MultipartDecoder(
+        boundary.encode('latin-1'), MAX_REQUEST_PART_SIZE
+      )
+
+      synch_execution = None
+      priority = None
+      client = None
+      string_parameters = None
+      request_part = None
+      input_file = None
+      file_parameters = {}
+      try:
+        ended = False
+        while not ended:
+          chunk = stream.read(UPLOAD_CHUNK_SIZE)
+          decoder.receive_data(chunk or None)
+          ended = not chunk
+          event = decoder.next_event()
+          while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File):
+              if string_parameters is None:
+                raise BaseCustomException(
+                  "The part '{0}' must precede the files.".format(
+                    MULTIPART_REQUEST_PART
+                  )
+                )
+              __check_file_parameter(event.name)
+              if (event.name in string_parameters
+                  or event.name in file_parameters):
+                raise BaseCustomException(
+                  "Parameter '{0}' given more than once.".format(event.name)
+                )
+              path, input_file = code_handler.open_input_file(
+                request_id, event.filename
+              )
+              file_parameters[event.name] = path
+            elif isinstance(event, Field):
+              if (event.name != MULTIPART_REQUEST_PART
+                  or request_part is not None):
+                raise BaseCustomException(
+                  "Unexpected part '{0}': only one part '{1}', "
+                  "then files.".format(event.name, MULTIPART_REQUEST_PART)
+                )
+              request_part = []
+            elif isinstance(event, Data):
+              if input_file is not None:
+                input_file.write(event.data)
+                if not event.more_data:
+                  input_file.close()
+                  input_file = None
+              else:
+                request_part.append(event.data)
+                if sum(map(len, request_part)) > MAX_REQUEST_PART_SIZE:
+                  raise BaseCustomException(
+                    "Part '{0}' too large.".format(MULTIPART_REQUEST_PART)
+                  )
+                if not event.more_data:
+                  try:
+                    json_body = json.loads(b''.join(request_part))
+                  except (JSONDecodeError, TypeError, UnicodeDecodeError):
+                    raise BaseCustomException(
+                      "Malformed JSON string for \'inputs\'."
+                    )
+                  (entry_id, synch_execution, string_parameters,
+                   priority, client) = __parse_execute_entry(json_body)
+                  code_handler.create_request_directory(entry_id)
+                  request_id = entry_id
+            event = decoder.next_event()
+          if isinstance(event, Epilogue):
+            ended = True
+          elif ended:
+            raise ValueError("unexpected end of the body")
+      except ValueError as error:
+        raise BaseCustomException(
+          "Malformed multipart request: {0}".format(str(error))
+        )
+      finally:
+        if input_file is not None:
+          input_file.close()
+
+      if string_parameters is None:
+        raise BaseCustomException(
+          "Part '{0}' missing.".format(MULTIPART_REQUEST_PART)
+        )
+      string_parameters.update(file_parameters)
+      code_handler.submit_form_request(
+        string_parameters, request_id, priority, client, synch_execution,
+        directory_created=True
+      )
+  except Exception:
+    if request_id is not None:
+      # Set only once this request created the directory.
+      code_handler.remove_request_directory(request_id)
+    raise
+
+  return request_id, synch_execution
+
+@app.route('/execute_batch', methods=['POST'])
+def do_execute_batch():
+  """
+  Handle the request to submit many jobs at once: the body is a JSON array
+  of objects, each as the body of /execute.
+
+  Each job is validated as by /execute; the valid ones are recorded
+  on the DB in a single transaction and queued together.
+  The jobs are always run asynchronously (synch_execution is ignored).
+
+  Returns, in the order of the request, an object for each job with keys
+  job_id, accepted (boolean) and, if not accepted, Message.
+  If the body is not an array of objects, or the jobs cannot be recorded,
+  the request is aborted with status code 400.
+  """
+
+  content_type = request.headers.get('Content-Type')
+  if not (content_type or '').startswith('application/json'):
+    err_msg = "Unaccepted content type: '{0}'.".format(content_type)
+    abort(Response(json.dumps({'Message': err_msg}), 400))
+  try:
+    json_body = json.loads(request.data)
+  except (JSONDecodeError, TypeError) as error:
+    err_msg = "Malformed JSON string for \'inputs\'."
+    app.logger.warning(err_msg + str(error))
+    abort(Response(json.dumps({'Message': err_msg}), 400))
+  if not isinstance(json_body, list):
+    err_msg = "JSON string does not represent an array of jobs."
+    abort(Response(json.dumps({'Message': err_msg}), 400))
+
+  statuses = []
+  valid_requests = []
+  request_ids = set()
+  for entry in json_body:
+    try:
+      request_id, synch_execution, string_parameters, priority, client = (
+        __parse_execute_entry(entry)
+      )
+    except BaseCustomException as error:
+      job_id = None
+      if isinstance(entry, Mapping) and isinstance(
+          entry.get('application_params'), Mapping):
+        job_id = entry['application_params'].get('job_id')
+      statuses.append(
+        {'job_id': job_id, 'accepted': False, 'Message': str(error)}
+      )
+      continue
+    if request_id in request_ids:
+      statuses.append(
+        {'job_id': request_id, 'accepted': False,
+         'Message': "Duplicated job_id in the batch."}
+      )
+      continue
+    request_ids.add(request_id)
+    valid_requests.append((request_id, string_parameters, priority, client))
+    statuses.append({'job_id': request_id})
+
+  try:
+    outcomes = code_handler.submit_form_requests(valid_requests)
+  except AppCustomException as error:
+    app.logger.error(str(error))
+    err_msg = "Application error. Please report to the " \
+              "application manager with date and time of the problem."
+    abort(Response(json.dumps({'Message': err_msg}), 400))
+  except Exception as error:
+    app.logger.error(str(error), exc_info=True)
+    err_msg = "Please report to the application manager " \
+              "with date and time of the problem."
+    abort(Response(json.dumps({'Message': err_msg}), 400))
+
+  for status in statuses:
+    if 'accepted' in status:
+      continue
+    error = outcomes[status['job_id']]
+    status['accepted'] = error is None
+    if isinstance(error, BaseCustomException):
+      status['Message'] = str(error)
+    elif error is not None:
+      status['Message'] = "Please report to the application manager " \
+                          "with date and time of the problem."
+
+  return Response(json.dumps(statuses), mimetype='application/json')
 
 @app.route('/job_info/<string:job_id>', methods=['GET'])
 def get_job_info(job_id: str):
     """
     Return input parameters, the status of the requested
     elaboration, and possibly the output.
+
+    The response has an ETag: a request with a matching If-None-Match
+    header gets status 304 without body.
+    Responses for ended jobs, which never change, may be cached
+    by the client; the others must be revalidated.
     """
 
-    job_info = code_handler.get_job_info(job_id)
-    if job_info:
-      params = code_handler.get_request_parameters(job_id)
-    else:
+    job_info = build_job_info(job_id)
+    if job_info is None:
       err_msg = "Data on job_id  {0} not present.".format(job_id)
       abort(Response(json.dumps({'Message': err_msg}), 400))
 
-    code_params = {}
-    for param in params:
-      code_params[param["name"]] = param["value"]
-            
-    return {
+    response = make_response(job_info)
+    response.add_etag()
+    if job_info['job_info']['end_processing'] is not None:
+      response.cache_control.private = True
+      response.cache_control.max_age = int(code_handler.get_cache_ttl())
+    else:
+      response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/jobs_info', methods=['GET', 'POST'])
+def get_jobs_info():
+    """
+    Return, with a single query, the information returned by /job_info
+    for many jobs, in order of arrival.
+
+    The jobs are selected by the criteria, all optional, given as query
+    parameters (GET) or as attributes of a JSON object (POST):
+    -) job_id: list of job ids (repeated query parameter for GET),
+    -) status: one of queued, running, ended, cancelled,
+    -) received_since: ISO 8601 date and time,
+    -) include_output: false to leave out std_out and std_err,
+    -) limit: maximum number of jobs returned (at most MAX_JOBS_INFO).
+    In a JSON object include_output must be a boolean and limit an integer.
+    """
+
+    if request.method == 'POST':
+      try:
+        criteria = json.loads(request.data)
+      except (JSONDecodeError, TypeError):
+        criteria = None
+      if not isinstance(criteria, Mapping):
+        err_msg = "JSON string does not represent an object " \
+                  "(pairs of name/value)."
+        abort(Response(json.dumps({'Message': err_msg}), 400))
+      ids = criteria.get('job_id')
+      if ids is not None and not (
+          isinstance(ids, list) and all(isinstance(i, str) for i in ids)):
+        err_msg = "Parameter 'job_id' must be a list of strings."
+        abort(Response(json.dumps({'Message': err_msg}), 400))
+      include_output = criteria.get('include_output', True)
+      if type(include_output) is not bool:
+        err_msg = "Parameter 'include_output' must be a boolean."
+        abort(Response(json.dumps({'Message': err_msg}), 400))
+      limit = criteria.get('limit', MAX_JOBS_INFO)
+      if type(limit) is not int:
+        limit = -1
+    else:
+      criteria = request.args
+      ids = request.args.getlist('job_id') or None
+      include_output = request.args.get('include_output', 'true')
+      limit = request.args.get('limit', MAX_JOBS_INFO)
+    if isinstance(include_output, str):
+      include_output = include_output.lower() not in ('false', '0', 'no')
+
+    status = criteria.get('status')
+    if status is not None and (not isinstance(status, str)
+        or status not in db_utils.JOB_STATUS_CONDITIONS):
+      err_msg = "Parameter 'status' must be one of: {0}.".format(
+        ", ".join(db_utils.JOB_STATUS_CONDITIONS)
+      )
+      abort(Response(json.dumps({'Message': err_msg}), 400))
+
+    received_since = criteria.get('received_since')
+    if received_since is not None:
+      try:
+        received_since = datetime.fromisoformat(received_since)
+      except (TypeError, ValueError):
+        err_msg = "Parameter 'received_since' must be an ISO 8601 date."
+        abort(Response(json.dumps({'Message': err_msg}), 400))
+
+    try:
+      limit = int(limit)
+    except (TypeError, ValueError):
+      limit = -1
+    if not 0 < limit <= MAX_JOBS_INFO:
+      err_msg = "Parameter 'limit' must be between 1 and {0}.".format(
+        MAX_JOBS_INFO
+      )
+      abort(Response(json.dumps({'Message': err_msg}), 400))
+
+    jobs_info = code_handler.get_jobs_info(
+      ids, status, received_since, include_output, limit
+    )
+    response = make_response({
+      "jobs": [
+        __format_job_info(job_info['id'], job_info) for job_info in jobs_info
+      ]
+    })
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/job/<string:job_id>', methods=['DELETE'])
+def cancel_job(job_id: str):
+    """
+    Cancel a job not yet ended.
+
+    A queued job ends immediately without running the code;
+    the code of a running job is terminated, with all its children.
+    The response reports the state of the job when cancelled:
+    'queued' or 'running'.
+    """
+
+    state = code_handler.cancel_request(job_id)
+    if state is None:
+      err_msg = "Job {0} not present or already ended.".format(job_id)
+      abort(Response(json.dumps({'Message': err_msg}), 400))
+
+    return {"job_id": job_id, "cancelled": state}
+
+def build_job_info(job_id: str):
+    """
+    Returns the dictionary returned by /job_info for the job,
+    or None if the job is not present.
+
+    Not depending on the Flask request context,
+    it is shared with the ASGI entry point (module asgi).
+    """
+
+    job_info = code_handler.get_job_info(job_id)
+    if not job_info:
+      return None
+
+    return __format_job_info(job_id, job_info)
+
+def __output_url(job_id: str, job_info, stream: str):
+    """
+    Returns the URL where to download the full output of the job,
+    if it was not stored on the DB, otherwise None.
+    """
+
+    if job_info[stream + "_ref"] is None:
+      return None
+    return "/job_download/{0}/{1}".format(job_id, stream)
+
+def __format_job_info(job_id: str, job_info) -> dict:
+    """
+    Returns the dictionary returned by /job_info for the job,
+    from the job information of module code_handler.
+
+    std_out and std_err are left out if not in job_info.
+    """
+
+    formatted = {
       "job_id": job_id,
       "job_info": {
           "received": job_info["received"],
           "start_processing": job_info["start_processing"],
           "end_processing": job_info["end_processing"],
           "exit_code": job_info["exit_code"],
-          "std_out": job_info["std_out"],
-          "std_err": job_info["std_err"]},
-      "params": code_params
+          "std_out": job_info.get("std_out"),
+          "std_err": job_info.get("std_err"),
+          "std_out_bytes": job_info["std_out_bytes"],
+          "std_err_bytes": job_info["std_err_bytes"],
+          "std_out_url": __output_url(job_id, job_info, "std_out"),
+          "std_err_url": __output_url(job_id, job_info, "std_err"),
+          "cancelled": job_info["cancelled"],
+          "reused_from": job_info["reused_from"],
+          "priority": job_info["priority"],
+          "client": job_info["client"],
+          "resource_usage": {
+              "peak_rss_kb": job_info["peak_rss_kb"],
+              "user_cpu_time": job_info["user_cpu_time"],
+              "system_cpu_time": job_info["system_cpu_time"],
+              "wall_time": job_info["wall_time"]}},
+      "params": job_info["parameters"]
     }
+    if "std_out" not in job_info:
+      del formatted["job_info"]["std_out"]
+      del formatted["job_info"]["std_err"]
+    return formatted
+
+@app.route('/job_output/<string:job_id>/<string:stream>', methods=['GET'])
+def get_job_output(job_id: str, stream: str):
+    """
+    Stream the standard output ('std_out') or error ('std_err')
+    of the job as it is produced, until the job ends.
+
+    The output is returned from the byte offset given by the query
+    parameter 'from' (default 0), so that a client can resume
+    after an interruption.
+    With 'Accept: text/event-stream' the output is sent as
+    Server-Sent Events, each with the offset reached as event id
+    (also accepted as Last-Event-ID header to resume);
+    an event 'end' is sent when the job has ended.
+    Otherwise the raw bytes are sent with chunked transfer encoding.
+    """
+
+    if stream not in code_handler.OUTPUT_STREAMS:
+      err_msg = "Unknown output '{0}'.".format(stream)
+      abort(Response(json.dumps({'Message': err_msg}), 400))
+    if not code_handler.is_output_available(stream):
+      err_msg = "Output '{0}' not available for this service.".format(stream)
+      abort(Response(json.dumps({'Message': err_msg}), 400))
+
+    offset = request.args.get(
+      'from', request.headers.get('Last-Event-ID', '0')
+    )
+    if not (offset.isascii() and offset.isdecimal()):
+      err_msg = "Parameter 'from' must be a non negative integer."
+      abort(Response(json.dumps({'Message': err_msg}), 400))
+    offset = int(offset)
+
+    if not code_handler.get_job_info(job_id):
+      err_msg = "Data on job_id  {0} not present.".format(job_id)
+      abort(Response(json.dumps({'Message': err_msg}), 400))
+
+    chunks = code_handler.follow_output(job_id, stream, offset)
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+    if (request.accept_mimetypes.best_match(
+          ['text/plain', 'text/event-stream']) == 'text/event-stream'):
+      def event(event_offset, text):
+        lines = SSE_LINE_BREAK.split(text)
+        return 'id: {0}\n{1}\n\n'.format(
+          event_offset, '\n'.join('data: ' + line for line in lines)
+        )
+
+      def events():
+        # The event id is the offset of the bytes sent: a partial character,
+        # or a '\r' that may precede '\n', are held for the next event.
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        pending = ''
+        end_offset = offset
+        for end_offset, data in chunks:
+          text = pending + decoder.decode(data)
+          pending = '\r' if text.endswith('\r') else ''
+          text = text[:len(text) - len(pending)]
+          if text:
+            yield event(
+              end_offset - len(decoder.getstate()[0]) - len(pending), text
+            )
+        text = pending + decoder.decode(b'', final=True)
+        if text:
+          yield event(end_offset, text)
+        yield 'event: end\ndata: \n\n'
+      return Response(events(), mimetype='text/event-stream', headers=headers)
+
+    return Response(
+      (data for chunk_offset, data in chunks),
+      mimetype='text/plain', headers=headers
+    )
+
+@app.route('/job_download/<string:job_id>/<string:stream>', methods=['GET'])
+def download_job_output(job_id: str, stream: str):
+    """
+    Return the full standard output ('std_out') or error ('std_err')
+    of an ended job, also when too large to be stored on the DB.
+
+    Range requests (header Range) are supported, to download
+    large outputs in parts or to resume a download, for outputs
+    stored as local files.
+    """
+
+    if stream not in code_handler.OUTPUT_STREAMS:
+      err_msg = "Unknown output '{0}'.".format(stream)
+      abort(Response(json.dumps({'Message': err_msg}), 400))
+    if not code_handler.is_output_available(stream):
+      err_msg = "Output '{0}' not available for this service.".format(stream)
+      abort(Response(json.dumps({'Message': err_msg}), 400))
+
+    output_file = code_handler.get_output_file(job_id, stream)
+    if output_file is None:
+      err_msg = "Output '{0}' of job_id {1} not available.".format(
+        stream, job_id
+      )
+      abort(Response(json.dumps({'Message': err_msg}), 404))
+
+    return send_file(
+      output_file, mimetype='text/plain', conditional=True,
+      download_name="{0}_{1}.log".format(job_id, stream)
+    )
+
+@app.route('/db_pool_stats', methods=['GET'])
+def get_db_pool_stats():
+  """
+  Return the usage counters of the DB connection pool,
+  to size the pool parameters in database.ini.
+  """
+  return db_utils.get_pool_statistics()
+
+@app.route('/executor_stats', methods=['GET'])
+def get_executor_stats():
+  """
+  Return the number of running and queued jobs,
+  to size the parameters of section executor in application.ini.
+  """
+  return job_executor.get_statistics()
+
+@app.route('/cache_stats', methods=['GET'])
+def get_cache_stats():
+  """
+  Return the usage counters of the cache of job information,
+  to size the parameters of section cache in application.ini.
+  """
+  return code_handler.get_cache_statistics()
+
+@app.route('/retention_stats', methods=['GET'])
+def get_retention_stats():
+  """
+  Return what was reclaimed removing the expired requests.
+  """
+  return retention_handler.get_statistics()
+
+@app.route('/ready', methods=['GET'])
+def get_ready():
+  """
+  Readiness probe: 503 until the DB can be reached.
+  """
+  try:
+    db_utils.check_connection()
+  except AppCustomException as ex:
+    return Response(
+      json.dumps({'ready': False, 'Message': str(ex)}), 503,
+      mimetype='application/json'
+    )
+  return {'ready': True}
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
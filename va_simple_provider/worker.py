@@ -0,0 +1,286 @@
+"""
+    Worker entry point for distributed execution, e.g.:
+      python -m va_simple_provider.worker
+
+    With distributed set in section 'executor' of file application.ini
+    the web application only queues the jobs on the DB; any number
+    of worker processes, on any host reaching the DB and sharing
+    file_root_directory, claim them (SELECT ... FOR UPDATE SKIP LOCKED),
+    run the configured code and record the outcome on the DB.
+
+    On initialization the module is configured using parameters
+    in file application.ini, section 'worker' (optional).
+
+    Each worker runs at most concurrency jobs at the same time,
+    claiming them by priority and fair share among the clients
+    (see db_utils.claim_request and module job_executor).
+    A claimed job is leased for lease_duration seconds, renewed every
+    heartbeat_interval seconds while its code runs: the jobs of a worker
+    that stopped are claimed again by the others when their lease expires.
+    Workers are woken up by PostgreSQL notifications when a job is queued,
+    and check the DB every poll_interval seconds in any case.
+    On SIGTERM or SIGINT a worker stops claiming jobs and exits
+    when the running ones have ended.
+"""
+
+import os
+import time
+import signal
+import socket
+import threading
+
+from va_simple_provider import app, configuration_directory
+from va_simple_provider import config
+from va_simple_provider import db_utils
+from va_simple_provider.controllers import code_handler
+from va_simple_provider.controllers import job_executor
+from va_simple_provider.controllers import process_runner
+from va_simple_provider.custom_exceptions import AppCustomException
+
+__worker_id = None
+__concurrency = None
+__poll_interval = None
+__lease_duration = None
+__heartbeat_interval = None
+
+# Jobs running in this worker, and those among them being terminated.
+__running_jobs = set()
+__terminated_jobs = set()
+__running_jobs_lock = threading.Lock()
+
+__job_submitted = threading.Condition()
+__stopping = threading.Event()
+
+def __config():
+  """
+  Set the private internal parameters for the whole module.
+
+  The following parameters are read from file 'application.ini',
+  section 'worker' (all optional):
+    concurrency (default: max_concurrent_jobs of section 'executor')
+    poll_interval (default: 5 seconds)
+    lease_duration (default: 60 seconds)
+    heartbeat_interval (default: 20 seconds)
+  """
+
+  filename = os.path.join(configuration_directory, 'application.ini')
+  section = 'worker'
+
+  global __worker_id
+
+  global __concurrency
+  concurrency_key = 'concurrency'
+
+  global __poll_interval
+  poll_interval_key = 'poll_interval'
+
+  global __lease_duration
+  lease_duration_key = 'lease_duration'
+
+  global __heartbeat_interval
+  heartbeat_interval_key = 'heartbeat_interval'
+
+  parser = config.get_application()
+
+  try:
+    __concurrency = parser.getint(
+      section, concurrency_key,
+      fallback=job_executor.get_max_concurrent_jobs()
+    )
+    __poll_interval = parser.getfloat(
+      section, poll_interval_key, fallback=5.0
+    )
+    __lease_duration = parser.getfloat(
+      section, lease_duration_key, fallback=60.0
+    )
+    __heartbeat_interval = parser.getfloat(
+      section, heartbeat_interval_key, fallback=20.0
+    )
+  except ValueError:
+    raise AppCustomException(
+      "Parameters in section '{0}' in file '{1}' must be numbers.".format(
+        section, os.path.abspath(filename)
+      )
+    )
+  if (__concurrency < 1 or __poll_interval <= 0
+      or not 0 < __heartbeat_interval < __lease_duration):
+    raise AppCustomException(
+      "Parameters '{0}' and '{1}' in section '{2}' in file '{3}' "
+      "must be positive, '{4}' less than '{5}'.".format(
+        concurrency_key, poll_interval_key, section,
+        os.path.abspath(filename),
+        heartbeat_interval_key, lease_duration_key
+      )
+    )
+
+  __worker_id = "{0}:{1}".format(socket.gethostname(), os.getpid())
+
+  return
+__config()
+config.on_reload(__config)
+
+def __on_notification(channel, request_id) -> None:
+  """
+  Terminate the code of a cancelled job if it runs in this worker;
+  wake up the idle threads when a job is queued (or after a reconnection,
+  as notifications may have been lost).
+  """
+
+  if channel == db_utils.JOB_CANCELLED_CHANNEL:
+    process_runner.terminate(request_id, pending=False)
+  else:
+    with __job_submitted:
+      __job_submitted.notify_all()
+
+def __terminate(request_id: str) -> None:
+  """
+  Terminate, once, the code of a job running in this worker.
+  """
+
+  with __running_jobs_lock:
+    if request_id in __terminated_jobs:
+      return
+    __terminated_jobs.add(request_id)
+  process_runner.terminate(request_id, pending=False)
+
+def __claim_loop() -> None:
+  """
+  Body of each worker thread: claim a job from the DB and run it,
+  until the worker is stopping.
+
+  While running a job the thread takes the request id as name,
+  so that log lines are associated to the job.
+  """
+
+  thread_name = threading.current_thread().name
+
+  while not __stopping.is_set():
+    try:
+      with db_utils.get_db_connection() as conn:
+        claimed = db_utils.claim_request(
+          conn, code_handler.get_id_service(), __worker_id, __lease_duration,
+          job_executor.get_max_running_jobs_per_client()
+        )
+    except Exception as ex:
+      app.logger.error("Claim of a job failed: {0}".format(str(ex)))
+      claimed = None
+
+    if claimed is None:
+      with __job_submitted:
+        __job_submitted.wait(__poll_interval)
+      continue
+
+    request_id = claimed['id']
+    with __running_jobs_lock:
+      __running_jobs.add(request_id)
+    threading.current_thread().name = request_id
+    try:
+      code_handler.run_claimed_request(
+        request_id, claimed['arguments'], __worker_id
+      )
+    except Exception as ex:
+      app.logger.error(
+        "Job terminated with unexpected error. Request id = {0}. {1}".format(
+          request_id, str(ex)
+        ),
+        exc_info=True
+      )
+    finally:
+      threading.current_thread().name = thread_name
+      with __running_jobs_lock:
+        __running_jobs.discard(request_id)
+        __terminated_jobs.discard(request_id)
+
+def __heartbeat_loop() -> None:
+  """
+  Renew, every heartbeat_interval seconds, the leases on the jobs
+  running in this worker, terminating the codes of the jobs cancelled
+  or claimed again by another worker.
+  Record as ended the cancelled jobs abandoned by stopped workers.
+  """
+
+  while True:
+    time.sleep(__heartbeat_interval)
+    with __running_jobs_lock:
+      request_ids = list(__running_jobs)
+    try:
+      if request_ids:
+        with db_utils.get_db_connection() as conn:
+          held = db_utils.renew_leases(
+            conn, __worker_id, request_ids, __lease_duration
+          )
+        for request_id in request_ids:
+          if request_id not in held:
+            app.logger.warning(
+              "Lease on job {0} lost: terminating its code.".format(
+                request_id
+              )
+            )
+            __terminate(request_id)
+          elif held[request_id]:
+            __terminate(request_id)
+      code_handler.end_abandoned_requests()
+    except Exception as ex:
+      app.logger.error("Heartbeat failed: {0}".format(str(ex)))
+
+def __stop(signum, frame) -> None:
+  """
+  Signal handler: stop claiming jobs.
+  """
+
+  app.logger.info(
+    "Worker {0} stopping: waiting for the running jobs.".format(__worker_id)
+  )
+  __stopping.set()
+  with __job_submitted:
+    __job_submitted.notify_all()
+
+def main() -> None:
+  """
+  Run the worker until SIGTERM or SIGINT, and the end
+  of the running jobs.
+  """
+
+  if not job_executor.is_distributed():
+    app.logger.warning(
+      "Parameter 'distributed' of section 'executor' not set: "
+      "the web application runs the jobs itself."
+    )
+  app.logger.info(
+    "Worker {0} started with {1} threads.".format(__worker_id, __concurrency)
+  )
+
+  signal.signal(signal.SIGTERM, __stop)
+  signal.signal(signal.SIGINT, __stop)
+  config.install_reload_handler()
+
+  threading.Thread(
+    target=db_utils.listen_for_notifications,
+    name='worker-listener',
+    args=(
+      [db_utils.JOB_SUBMITTED_CHANNEL, db_utils.JOB_CANCELLED_CHANNEL],
+      __on_notification
+    ),
+    daemon=True
+  ).start()
+  threading.Thread(
+    target=__heartbeat_loop, name='worker-heartbeat', daemon=True
+  ).start()
+
+  threads = [
+    threading.Thread(
+      target=__claim_loop, name='claim-worker-{0}'.format(i)
+    )
+    for i in range(__concurrency)
+  ]
+  for t in threads:
+    t.start()
+  # Joining with a timeout, so that signals are handled.
+  for t in threads:
+    while t.is_alive():
+      t.join(1)
+
+  app.logger.info("Worker {0} stopped.".format(__worker_id))
+
+if __name__ == '__main__':
+  main()